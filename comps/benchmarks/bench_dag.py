@@ -0,0 +1,74 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+"""Micro-benchmark for building and mutating large comps.core.dag.DAG graphs.
+
+Generates layered graphs shaped like programmatically built per-tenant pipelines
+(each node fans out to a few nodes of the next layers) and times graph construction
+with cycle validation, predecessor lookups, downstream traversal and node deletion.
+
+Usage:
+    python -m comps.benchmarks.bench_dag --nodes 1000 5000 20000
+"""
+
+import argparse
+import random
+import time
+
+from comps.core.dag import DAG
+
+
+def build_edges(num_nodes: int, width: int, fan_out: int, seed: int):
+    rng = random.Random(seed)
+    edges = []
+    for node in range(num_nodes - width):
+        layer_end = (node // width + 1) * width
+        for dep_node in rng.sample(range(layer_end, min(layer_end + 2 * width, num_nodes)), fan_out):
+            edges.append((f"node{node}", f"node{dep_node}"))
+    return edges
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def bench(num_nodes: int, width: int, fan_out: int, seed: int):
+    edges = build_edges(num_nodes, width, fan_out, seed)
+    dag = DAG()
+
+    def build():
+        for i in range(num_nodes):
+            dag.add_node(f"node{i}")
+        for ind_node, dep_node in edges:
+            dag.add_edge(ind_node, dep_node)
+
+    build_time, _ = timed(build)
+    predecessors_time, _ = timed(lambda: [dag.predecessors(node) for node in dag.graph])
+    downstreams_time, _ = timed(lambda: [dag.all_downstreams(node) for node in dag.ind_nodes()[:10]])
+    victims = random.Random(seed).sample(list(dag.graph), num_nodes // 10)
+    delete_time, _ = timed(lambda: [dag.delete_node(node) for node in victims])
+    return len(edges), build_time, predecessors_time, downstreams_time, delete_time
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, nargs="+", default=[1000, 2000, 5000, 10000])
+    parser.add_argument("--width", type=int, default=20, help="nodes per layer")
+    parser.add_argument("--fan-out", type=int, default=3, help="edges per node")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(
+        f"{'nodes':>7} {'edges':>7} {'build (s)':>10} {'preds all (s)':>14} "
+        f"{'10x all_downstreams (s)':>24} {'delete 10% (s)':>15}"
+    )
+    for num_nodes in args.nodes:
+        num_edges, build_time, predecessors_time, downstreams_time, delete_time = bench(
+            num_nodes, args.width, args.fan_out, args.seed
+        )
+        print(
+            f"{num_nodes:>7} {num_edges:>7} {build_time:>10.4f} {predecessors_time:>14.4f} "
+            f"{downstreams_time:>24.4f} {delete_time:>15.4f}"
+        )
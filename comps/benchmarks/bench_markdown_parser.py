@@ -0,0 +1,211 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+"""Benchmark TreeParser.build_tree against the line-by-line parser it replaced.
+
+Parses a marker markdown output and its toc.txt, or a synthetic document of ``--synthetic``
+sections, with both parsers. The markdown and the TOC are repeated ``--scale`` times to get
+large inputs. Reports seconds and MB/s for each parser, and checks that they build the same
+tree, which holds as long as the old parser matches every heading to the next TOC entry.
+The markdown is cut after its last non-blank line. The old parser drops the content of the
+last section when the file ends with a blank line, and the new one does not.
+
+Usage:
+    python -m comps.benchmarks.bench_markdown_parser out/selected_file/selected_file.md \\
+        out/selected_file/toc.txt --scale 20
+    python -m comps.benchmarks.bench_markdown_parser --synthetic 5000
+"""
+
+import argparse
+import io
+import os
+import random
+import re
+import tempfile
+import time
+from difflib import SequenceMatcher
+
+from comps.parsers.node import Node
+from comps.parsers.table import Table
+from comps.parsers.text import Text
+from comps.parsers.treeparser import TreeParser
+
+
+def peek_next_lines(f):
+    pos = f.tell()
+    line = f.readline()
+    line_2 = f.readline()
+    f.seek(pos)
+    return line, line_2
+
+
+def legacy_parse_markdown(markdown_file, toc_file, rootNode, recentNodeDict, node_dir):
+    """TreeParser.parse_markdown before the single-pass parser, reading file objects."""
+    toc_line = toc_file.readline()
+    currNode = rootNode
+    tables = []
+    content = ""
+    previous_line = ""
+
+    line = markdown_file.readline()
+    while line:
+        line = re.sub(r'<span[^>]*?\/?>(</span>)?', '', line)
+        if line == "\n":
+            line = markdown_file.readline()
+            continue
+        if bool(re.match(r'^#+', line)):
+            _, heading = line.split(" ", 1)
+            if not toc_line:
+                line = markdown_file.readline()
+                continue
+            level, heading_toc = toc_line.split(";")
+            heading = heading.strip().replace("*", "")
+            if (SequenceMatcher(None, "contents", heading_toc.lower())).ratio() > 0.6:
+                toc_line = toc_file.readline()
+                level, heading_toc = toc_line.split(";")
+            elif SequenceMatcher(None, heading.lower(), heading_toc.lower()).ratio() > 0.6:
+                node = Node(level, heading, node_dir)
+                if level > currNode.get_level():
+                    currNode.append_child(node)
+                    node.set_parent(currNode)
+                else:
+                    parent_key = -1
+                    for key in reversed(recentNodeDict):
+                        if key < node.get_level():
+                            parent_key = key
+                            break
+                    recentNodeDict[parent_key].append_child(node)
+                    node.set_parent(recentNodeDict[parent_key])
+                    recentNodeDict[node.get_level()] = node
+                text_obj = Text(content, currNode)
+                currNode.append_content(text_obj)
+                for table in tables:
+                    currNode.append_content(table)
+                tables.clear()
+                content = ""
+                currNode = node
+                toc_line = toc_file.readline()
+            else:
+                content += line
+        elif line[0] == '|':
+            table_list = []
+            table_list.append(line)
+            while peek_next_lines(markdown_file)[0] and peek_next_lines(markdown_file)[0][0] == '|':
+                line = markdown_file.readline()
+                table_list.append(line)
+            next_line = peek_next_lines(markdown_file)[1].split('>', 1)
+            if len(next_line) > 1:
+                next_line = next_line[1]
+            else:
+                next_line = next_line[0]
+            pattern_table_heading = re.compile(r'^(Table|Figure)\s+(\d+)', re.IGNORECASE)
+            match_table_heading_previous = pattern_table_heading.search(previous_line)
+            match_table_heading_next = pattern_table_heading.search(next_line)
+            heading = ""
+            if match_table_heading_previous:
+                heading = previous_line
+            elif match_table_heading_next:
+                heading = next_line
+            table_obj = Table("".join(table_list), heading, currNode)
+            tables.append(table_obj)
+        else:
+            pattern_heading = re.compile(r'^(Table|Figure)\s+(\d+)', re.IGNORECASE)
+            match_heading = pattern_heading.search(line)
+            if not match_heading:
+                content += line
+        previous_line = line
+        line = markdown_file.readline()
+        if not line:
+            text_obj = Text(content, currNode)
+            currNode.append_content(text_obj)
+            for table in tables:
+                currNode.append_content(table)
+
+
+def synthetic_document(sections: int, seed: int = 0):
+    rng = random.Random(seed)
+    words = "matrix vector kernel gradient layer token model cache index tree node page table figure".split()
+    markdown, toc = ["# Contents\n", "\n"], ["1;Contents\n"]
+    numbers = [0, 0, 0]
+    for _ in range(sections):
+        depth = rng.choice([1, 2, 2, 3, 3, 3]) if numbers[0] else 1
+        numbers[depth - 1] += 1
+        numbers[depth:] = [0] * (3 - depth)
+        number = ".".join(str(x) for x in numbers[:depth] if x)
+        title = f"{number} " + " ".join(rng.choice(words).capitalize() for _ in range(rng.randint(2, 5)))
+        toc.append(f"{depth};{title}\n")
+        markdown += ["#" * depth + f" <span id=\"page-{len(toc)}\"></span>{title}\n", "\n"]
+        for _ in range(rng.randint(1, 6)):
+            markdown += [" ".join(rng.choice(words) for _ in range(rng.randint(20, 120))) + "\n", "\n"]
+        if rng.random() < 0.3:
+            markdown += [f"Table {len(toc)}: {rng.choice(words)} results\n", "\n"]
+            markdown += ["| a | b | c |\n", "|---|---|---|\n"]
+            markdown += [f"| {rng.random():.3f} | {rng.random():.3f} | {rng.choice(words)} |\n" for _ in range(8)]
+            markdown += ["\n"]
+    return "".join(markdown), "".join(toc)
+
+
+def dump(node):
+    content = [
+        (item.content,) if isinstance(item, Text) else (item.markdown_content, item.heading)
+        for item in node.get_content()
+    ]
+    children = [dump(node.get_child(i)) for i in range(node.get_length_children())]
+    return (node.get_level(), node.get_heading(), content, children)
+
+
+def run(parse, markdown: str, toc: str, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        root = Node('0', "root", "out")
+        start = time.perf_counter()
+        parse(markdown, toc, root, {'0': root})
+        best = min(best, time.perf_counter() - start)
+    return best, dump(root)
+
+
+def main(markdown: str, toc: str, scale: int, repeat: int):
+    markdown = markdown.rstrip("\n") + "\n"
+    markdown = "\n".join([markdown] * scale)
+    toc = (toc.rstrip("\n") + "\n") * scale
+    size = len(markdown.encode("utf-8")) / 2**20
+    print(f"{size:.1f} MB of markdown, {markdown.count(chr(10))} lines, {toc.count(chr(10))} TOC entries")
+
+    # the old parser read, peeked and seeked the files on disk
+    with tempfile.TemporaryDirectory() as tmp:
+        markdown_path, toc_path = os.path.join(tmp, "doc.md"), os.path.join(tmp, "toc.txt")
+        with open(markdown_path, "w") as markdown_file, open(toc_path, "w") as toc_file:
+            markdown_file.write(markdown)
+            toc_file.write(toc)
+
+        def legacy(markdown, toc, root, recent):
+            with open(markdown_path, "r") as markdown_file, open(toc_path, "r") as toc_file:
+                legacy_parse_markdown(markdown_file, toc_file, root, recent, "out")
+
+        legacy_time, legacy_tree = run(legacy, markdown, toc, repeat)
+
+    tree_parser = TreeParser()
+
+    def single_pass(markdown, toc, root, recent):
+        tree_parser.build_tree(markdown, io.StringIO(toc).readlines(), root, recent, "out")
+
+    new_time, new_tree = run(single_pass, markdown, toc, repeat)
+    print(f"{'legacy':>12}: {legacy_time:8.3f} s  {size / legacy_time:8.1f} MB/s")
+    print(f"{'single pass':>12}: {new_time:8.3f} s  {size / new_time:8.1f} MB/s  speedup {legacy_time / new_time:5.1f}x")
+    print(f"same tree: {legacy_tree == new_tree}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("markdown", nargs="?")
+    parser.add_argument("toc", nargs="?")
+    parser.add_argument("--synthetic", type=int, default=0, help="sections of a generated document")
+    parser.add_argument("--scale", type=int, default=1, help="times the markdown is repeated")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    if args.synthetic:
+        markdown, toc = synthetic_document(args.synthetic)
+    else:
+        with open(args.markdown, "r") as markdown_file, open(args.toc, "r") as toc_file:
+            markdown, toc = markdown_file.read(), toc_file.read()
+    main(markdown, toc, args.scale, args.repeat)
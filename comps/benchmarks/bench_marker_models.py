@@ -0,0 +1,64 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+"""Benchmark marker PDF conversion with per-document and shared model loading.
+
+Converts the given PDFs ``--repeat`` times each, once building the model dict for every
+document as TreeParser used to, and once through the process-wide registry of
+``comps.parsers.treeparser``. Reports seconds per page and the resident set size after
+each conversion.
+
+Usage:
+    python -m comps.benchmarks.bench_marker_models assets/selected_file.pdf --repeat 3
+"""
+
+import argparse
+import gc
+import os
+import time
+
+from marker.converters.pdf import PdfConverter
+from marker.models import create_model_dict
+from pdfminer.pdfpage import PDFPage
+
+from comps.parsers.treeparser import get_marker_models
+
+CONFIG = {"output_format": "markdown", "use_llm": False}
+
+
+def count_pages(path: str) -> int:
+    with open(path, "rb") as fp:
+        return sum(1 for _ in PDFPage.get_pages(fp))
+
+
+def rss_mb() -> float:
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def convert(path: str, artifact_dict_factory) -> float:
+    start = time.perf_counter()
+    converter = PdfConverter(artifact_dict=artifact_dict_factory(), config=CONFIG)
+    converter(path)
+    return time.perf_counter() - start
+
+
+def bench(name: str, paths, repeat: int, artifact_dict_factory):
+    for path in paths:
+        pages = count_pages(path)
+        for i in range(repeat):
+            elapsed = convert(path, artifact_dict_factory)
+            gc.collect()
+            print(
+                f"{name:>6} {os.path.basename(path):>30} run {i}: {elapsed:8.2f} s "
+                f"{elapsed / pages:6.3f} s/page  rss {rss_mb():8.0f} MB"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdfs", nargs="+")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    bench("cold", args.pdfs, args.repeat, create_model_dict)
+    bench("warm", args.pdfs, args.repeat, get_marker_models)
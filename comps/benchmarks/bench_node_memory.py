@@ -0,0 +1,168 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+"""Memory of parsed document trees, with the array-backed Node against the dict-backed one it replaced.
+
+Parses a corpus of ``--documents`` synthetic documents of ``--sections`` sections each and
+keeps all their trees, as the ingestion queues hold parsed documents, then walks every tree
+over its content the way chunking does. Each Node implementation is measured in a forked
+process of its own. Reports the RSS the trees hold once built and the peak RSS growth over the
+whole run, both relative to the process before the first document, and the seconds taken.
+The RSS also holds the text of the documents and the memory the parser freed but the
+allocator kept, so the bytes of the objects reachable from the trees are reported apart:
+the strings, the same for both, and the node structure around them.
+
+The dict-backed run walks the trees recursively into one list per subtree, as create_chunks did.
+The array-backed run walks them with the iterative Node.walk generator.
+
+Usage:
+    python -m comps.benchmarks.bench_node_memory --documents 50 --sections 2000
+"""
+
+import argparse
+import gc
+import sys
+import time
+import types
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from comps.benchmarks.bench_markdown_parser import synthetic_document
+from comps.parsers import treeparser
+from comps.parsers.node import Node
+from comps.parsers.table import Table
+from comps.parsers.text import Text
+
+
+class LegacyNode:
+    """Node before the node store, accepting the store argument TreeParser now passes."""
+
+    store = None
+
+    def __init__(self, level, heading, dir, store=None):
+        self.__level = level
+        self.__heading = heading
+        self.__parent = None
+        self.__content = []
+        self.__children = []
+        self.__dir = dir
+
+    def get_level(self):
+        return self.__level
+
+    def get_heading(self):
+        return self.__heading
+
+    def get_content(self):
+        return self.__content
+
+    def set_parent(self, node):
+        self.__parent = node
+
+    def append_child(self, node):
+        self.__children.append(node)
+
+    def append_content(self, line):
+        self.__content.append(line)
+
+    def get_length_children(self):
+        return len(self.__children)
+
+    def get_child(self, pos):
+        return self.__children[pos]
+
+
+class LegacyText:
+    def __init__(self, content, node):
+        self.content = content
+        self.node = node
+
+
+class LegacyTable:
+    def __init__(self, markdown_content, heading, node):
+        self.markdown_content = markdown_content
+        self.heading = heading
+        self.node = node
+
+
+def legacy_items(node):
+    items = [(node.get_heading(), item) for item in node.get_content()]
+    for i in range(node.get_length_children()):
+        items.extend(legacy_items(node.get_child(i)))
+    return items
+
+
+def retained(roots):
+    """Bytes of the strings and of the other objects reachable from roots."""
+    seen, stack = set(), list(roots)
+    strings = structure = 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, (type, types.ModuleType, types.FunctionType)):
+            continue
+        seen.add(id(obj))
+        if isinstance(obj, str):
+            strings += sys.getsizeof(obj)
+            continue
+        structure += sys.getsizeof(obj)
+        stack.extend(gc.get_referents(obj))
+    return strings / 2**20, structure / 2**20
+
+
+def memory():
+    """Current and peak resident set size in MB."""
+    with open("/proc/self/status") as status:
+        fields = dict(line.split(":", 1) for line in status)
+    return int(fields["VmRSS"].split()[0]) / 1024, int(fields["VmHWM"].split()[0]) / 1024
+
+
+def measure(legacy: bool, documents: int, sections: int):
+    node_class = LegacyNode if legacy else Node
+    if legacy:
+        treeparser.Node, treeparser.Text, treeparser.Table = LegacyNode, LegacyText, LegacyTable
+    tree_parser = treeparser.TreeParser()
+    baseline, _ = memory()
+    start = time.perf_counter()
+
+    roots = []
+    for seed in range(documents):
+        markdown, toc = synthetic_document(sections, seed)
+        root = node_class('0', "root", "out")
+        tree_parser.build_tree(markdown, toc.splitlines(keepends=True), root, {'0': root}, "out")
+        roots.append(root)
+        del markdown, toc
+    held, _ = memory()
+
+    characters = 0
+    for root in roots:
+        if legacy:
+            characters += sum(len(getattr(item, "content", "")) for _, item in legacy_items(root))
+        else:
+            characters += sum(
+                len(item.content) for node in root.walk() for item in node.get_content() if isinstance(item, Text)
+            )
+    elapsed = time.perf_counter() - start
+    _, peak = memory()
+    return held - baseline, peak - baseline, elapsed, characters, *retained(roots)
+
+
+def main(documents: int, sections: int):
+    print(f"{documents} documents of {sections} sections")
+    for name, legacy in (("dict-backed", True), ("array-backed", False)):
+        # a fresh process per run, so neither sees memory the other freed
+        with ProcessPoolExecutor(1, get_context("fork")) as pool:
+            held, peak, elapsed, characters, strings, structure = pool.submit(
+                measure, legacy, documents, sections
+            ).result()
+        print(
+            f"{name:>13}: trees {held:8.1f} MB  peak {peak:8.1f} MB  {elapsed:7.2f} s  "
+            f"strings {strings:7.1f} MB  structure {structure:7.1f} MB  ({characters} characters)"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=50)
+    parser.add_argument("--sections", type=int, default=2000)
+    args = parser.parse_args()
+    main(args.documents, args.sections)
@@ -0,0 +1,94 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+"""Load test for concurrent LLM streams through ServiceOrchestrator.
+
+Starts a fake OpenAI-style SSE server that emits a token every ``--token-delay``
+seconds, then drives ``--concurrency`` streaming requests through the orchestrator
+at once. With a non-blocking streaming path the wall time stays close to the time
+of a single stream instead of growing with the number of concurrent requests.
+
+Usage:
+    python -m comps.benchmarks.bench_orchestrator_stream --concurrency 1 8 32
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from aiohttp import web
+
+from comps import MicroService, ServiceOrchestrator, ServiceType
+from comps.proto.docarray import LLMParams
+
+
+def make_llm_app(num_tokens: int, token_delay: float) -> web.Application:
+    async def chat_completions(request: web.Request) -> web.StreamResponse:
+        await request.read()
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for i in range(num_tokens):
+            await asyncio.sleep(token_delay)
+            chunk = {"choices": [{"delta": {"content": f" tok{i}"}, "finish_reason": None}]}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    return app
+
+
+async def run_stream(orchestrator: ServiceOrchestrator) -> int:
+    result_dict, _ = await orchestrator.schedule(
+        initial_inputs={"inputs": "hello"}, llm_parameters=LLMParams(stream=True)
+    )
+    received = 0
+    for response in result_dict.values():
+        async for _ in response.body_iterator:
+            received += 1
+    return received
+
+
+async def main(args):
+    runner = web.AppRunner(make_llm_app(args.num_tokens, args.token_delay))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", args.port)
+    await site.start()
+
+    orchestrator = ServiceOrchestrator()
+    orchestrator.add(
+        MicroService(
+            name="llm",
+            host="127.0.0.1",
+            port=args.port,
+            endpoint="/v1/chat/completions",
+            use_remote_service=True,
+            service_type=ServiceType.LLM,
+        )
+    )
+
+    single_stream = args.num_tokens * args.token_delay
+    print(f"ideal single stream time: {single_stream:.3f}s")
+    print(f"{'concurrency':>12} {'wall (s)':>10} {'serialized (s)':>15} {'speedup':>8}")
+    try:
+        for concurrency in args.concurrency:
+            start = time.perf_counter()
+            await asyncio.gather(*(run_stream(orchestrator) for _ in range(concurrency)))
+            wall = time.perf_counter() - start
+            serialized = single_stream * concurrency
+            print(f"{concurrency:>12} {wall:>10.3f} {serialized:>15.3f} {serialized / wall:>8.1f}x")
+    finally:
+        await orchestrator.close()
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--num-tokens", type=int, default=50)
+    parser.add_argument("--token-delay", type=float, default=0.02)
+    parser.add_argument("--port", type=int, default=18080)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,69 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+"""Scaling of page-sharded marker PDF conversion with the number of worker processes.
+
+For every worker count, starts a pool and runs one warm-up task in each of its workers,
+which loads the marker models there, before the clock starts, then converts the PDF with ``TreeParser.convert_pdf`` in shards of
+``--pages-per-shard`` pages. Reports seconds, pages per second and the speedup over the
+first worker count. Scaling flattens once the workers outnumber the shards or the cores,
+and every worker holds its own copy of the models.
+
+Usage:
+    python -m comps.benchmarks.bench_page_parallel assets/long_thesis.pdf --workers 1 2 4 8 --pages-per-shard 8
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from comps.parsers.treeparser import TreeParser, count_pages, get_marker_models
+
+_barrier = None
+
+
+def init_worker(barrier):
+    global _barrier
+    _barrier = barrier
+
+
+def warm_up() -> int:
+    """Load the models of this worker, then hold it until every worker has taken a warm-up task."""
+    get_marker_models()
+    _barrier.wait()
+    return os.getpid()
+
+
+def convert(path: str, workers: int, pages_per_shard: int) -> float:
+    context = get_context("fork")
+    with ProcessPoolExecutor(workers, context, initializer=init_worker, initargs=(context.Barrier(workers),)) as pool:
+        # the barrier keeps a worker from taking a second warm-up task, so each one loads its models
+        pids = {future.result() for future in [pool.submit(warm_up) for _ in range(workers)]}
+        assert len(pids) == workers
+        parser = TreeParser(page_executor=pool, pages_per_shard=pages_per_shard)
+        start = time.perf_counter()
+        rendered = parser.convert_pdf(path)
+        elapsed = time.perf_counter() - start
+    print(f"  {len(rendered.markdown)} characters, {len(rendered.metadata['table_of_contents'])} headings")
+    return elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdf")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--pages-per-shard", type=int, default=8)
+    args = parser.parse_args()
+
+    pages = count_pages(args.pdf)
+    print(f"{args.pdf}: {pages} pages, {args.pages_per_shard} pages per shard")
+    baseline = None
+    for workers in args.workers:
+        elapsed = convert(args.pdf, workers, args.pages_per_shard)
+        baseline = baseline or elapsed
+        print(
+            f"{workers:>3} workers: {elapsed:8.2f} s  {pages / elapsed:6.2f} pages/s  "
+            f"speedup {baseline / elapsed:5.2f}x"
+        )
@@ -0,0 +1,74 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+"""Regression benchmark for the retriever's "is the index empty?" probe.
+
+Grows the keyspace of a scratch Redis Stack database with filler hashes and times,
+at every size, the former ``KEYS *`` probe against a cold ``FT.INFO`` read and the
+cached ``IndexState`` check used by ``retrieve()``. The two latter should stay flat
+while ``KEYS *`` grows linearly with the number of keys. The database selected by
+``--redis-url`` is flushed, point it at a throwaway instance.
+
+Usage:
+    python -m comps.benchmarks.bench_retriever_probe --redis-url redis://localhost:6379/15 \\
+        --keys 10000 100000 1000000
+"""
+
+import argparse
+import time
+
+import redis
+from redis.commands.search.field import TextField
+from redis.commands.search.indexDefinition import IndexDefinition, IndexType
+
+from comps.retriever.index_state import IndexState
+
+INDEX_NAME = "bench-probe"
+
+
+def fill(client: redis.Redis, start: int, stop: int, batch: int = 10000):
+    for offset in range(start, stop, batch):
+        pipe = client.pipeline(transaction=False)
+        for i in range(offset, min(offset + batch, stop)):
+            pipe.hset(f"doc:{i}", mapping={"content": f"chunk {i}"})
+        pipe.execute()
+
+
+def timed(func, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def main(redis_url: str, sizes, repeat: int, keys_repeat: int):
+    client = redis.Redis.from_url(redis_url)
+    client.flushdb()
+    client.ft(INDEX_NAME).create_index(
+        [TextField("content")], definition=IndexDefinition(prefix=["doc:"], index_type=IndexType.HASH)
+    )
+    index_state = IndexState(client, INDEX_NAME)
+
+    print(f"{'keys':>10} {'KEYS * (ms)':>12} {'FT.INFO (ms)':>13} {'cached (us)':>12}")
+    filled = 0
+    try:
+        for size in sorted(sizes):
+            fill(client, filled, size)
+            filled = size
+            keys_probe = timed(lambda: client.keys() == [], keys_repeat)
+            info_probe = timed(index_state.refresh, repeat)
+            cached_probe = timed(index_state.is_empty, repeat)
+            print(f"{size:>10} {keys_probe * 1e3:>12.2f} {info_probe * 1e3:>13.3f} {cached_probe * 1e6:>12.2f}")
+    finally:
+        client.ft(INDEX_NAME).dropindex(delete_documents=False)
+        client.flushdb()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--redis-url", default="redis://localhost:6379/15")
+    parser.add_argument("--keys", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--repeat", type=int, default=1000, help="iterations of the FT.INFO and cached probes")
+    parser.add_argument("--keys-repeat", type=int, default=5, help="iterations of the KEYS * probe")
+    args = parser.parse_args()
+    main(args.redis_url, args.keys, args.repeat, args.keys_repeat)
@@ -0,0 +1,127 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+"""Quality and speed of matching markdown headings to TOC entries, on a suite of fixtures.
+
+Every fixture is a generated outline of ``--headings`` sections, numbered up to three
+levels with titles drawn from a small vocabulary, so titles share most of their words.
+Its TOC is the outline, and its markdown headings are the outline with one kind of damage
+marker and PDF outlines are prone to:
+
+    clean       headings equal to the TOC
+    missing     5% of the headings lost in conversion
+    extra       unnumbered headings absent from the TOC, such as "Example" or "Note"
+    noise       OCR typos, bold markup and case changes in 30% of the headings
+    repeated    every chapter ends with "Exercises" and "Summary" sections
+    front       the TOC starts with front matter missing from the markdown
+    mixed       all of the above
+
+Reports precision and recall of the heading -> TOC entry pairs, and the time to match,
+for the sequential matcher TreeParser used before and for ``align_headings``.
+
+Usage:
+    python -m comps.benchmarks.bench_toc_alignment --headings 100 1000 3000
+"""
+
+import argparse
+import random
+import time
+from difflib import SequenceMatcher
+
+from comps.parsers.toc_alignment import align_headings
+
+WORDS = "matrix vector kernel gradient layer token model cache index tree node page table figure".split()
+DAMAGES = ["clean", "missing", "extra", "noise", "repeated", "front", "mixed"]
+
+
+def outline(size: int, rng: random.Random, repeated: bool):
+    numbers = [0, 0, 0]
+    entries = []
+    while len(entries) < size:
+        depth = rng.choice([1, 2, 2, 3, 3, 3]) if numbers[0] else 1
+        if repeated and depth == 1 and numbers[0]:
+            entries += [("2", "Exercises"), ("2", "Summary")]
+        numbers[depth - 1] += 1
+        numbers[depth:] = [0] * (3 - depth)
+        number = ".".join(str(x) for x in numbers[:depth])
+        entries.append((str(depth), f"{number} " + " ".join(rng.choice(WORDS).capitalize() for _ in range(3))))
+    return entries[:size]
+
+
+def typo(title: str, rng: random.Random) -> str:
+    chars = list(title)
+    for _ in range(rng.randint(1, 2)):
+        k = rng.randrange(len(chars))
+        chars[k] = rng.choice(["", chars[k] * 2, rng.choice("aeiourln"), chars[k].upper()])
+    return "**" + "".join(chars) + "**"
+
+
+def fixture(damage: str, size: int, seed: int = 0):
+    """(TOC titles, markdown headings, true pairs of heading index -> TOC index)."""
+    rng = random.Random(seed)
+    mixed = damage == "mixed"
+    toc = [title for _, title in outline(size, rng, damage == "repeated" or mixed)]
+    front = 0
+    if damage == "front" or mixed:
+        front = max(3, size // 50)
+        toc = ["Preface", "Acknowledgements", "List of Figures"][: min(3, front)] + [
+            f"Abbreviation {k}" for k in range(front - 3)
+        ] + toc
+    headings, truth = [], {}
+    for j, title in enumerate(toc[front:], start=front):
+        if (damage == "missing" or mixed) and rng.random() < 0.05:
+            continue
+        if (damage == "extra" or mixed) and rng.random() < 0.2:
+            headings.append(rng.choice(["Example", "Note", "Proof", "Remark"]) + f" {rng.randint(1, 9)}")
+        if (damage == "noise" or mixed) and rng.random() < 0.3:
+            title = typo(title, rng)
+        truth[len(headings)] = j
+        headings.append(title)
+    return toc, headings, truth
+
+
+def sequential_matcher(headings, toc):
+    """The matcher of TreeParser.parse_markdown before the alignment: each heading against the next entry."""
+    alignment, j = {}, 0
+    for i, heading in enumerate(headings):
+        if j >= len(toc):
+            break
+        heading = heading.strip().replace("*", "")
+        if SequenceMatcher(None, "contents", toc[j].lower() + "\n").ratio() > 0.6:
+            j += 1
+        elif SequenceMatcher(None, heading.lower(), toc[j].lower() + "\n").ratio() > 0.6:
+            alignment[i] = j
+            j += 1
+    return alignment
+
+
+def score(alignment, truth):
+    correct = sum(1 for i, j in alignment.items() if truth.get(i) == j)
+    precision = correct / len(alignment) if alignment else 1.0
+    recall = correct / len(truth) if truth else 1.0
+    return precision, recall
+
+
+def main(sizes, repeat: int):
+    print(f"{'fixture':>10} {'headings':>8} | {'sequential P/R':>16} {'ms':>8} | {'aligned P/R':>16} {'ms':>8}")
+    for size in sizes:
+        for damage in DAMAGES:
+            toc, headings, truth = fixture(damage, size)
+            row = f"{damage:>10} {len(headings):>8}"
+            for matcher in (sequential_matcher, align_headings):
+                best = float("inf")
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    alignment = matcher(headings, toc)
+                    best = min(best, time.perf_counter() - start)
+                precision, recall = score(alignment, truth)
+                row += f" | {precision:7.3f}/{recall:<7.3f} {best * 1000:8.1f}"
+            print(row)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--headings", type=int, nargs="+", default=[100, 1000, 3000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    main(args.headings, args.repeat)
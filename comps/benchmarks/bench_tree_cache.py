@@ -0,0 +1,75 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+"""Time to rebuild a document tree from the tree cache, against parsing its markdown again.
+
+Builds the tree of a marker markdown output and its toc.txt, or of a synthetic document of
+``--synthetic`` sections, saves it as a tree cache and loads it back. Reports the seconds
+of each step, the size of the cache, and checks that the loaded tree is the parsed one.
+Converting the PDF with marker, which the cache also skips, takes minutes and is left out.
+
+Usage:
+    python -m comps.benchmarks.bench_tree_cache out/selected_file/selected_file.md out/selected_file/toc.txt
+    python -m comps.benchmarks.bench_tree_cache --synthetic 5000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from comps.benchmarks.bench_markdown_parser import dump, synthetic_document
+from comps.parsers.node import Node
+from comps.parsers.tree_cache import load_tree, read_tree_cache, save_tree_cache
+from comps.parsers.treeparser import TreeParser
+
+
+def timed(func, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main(markdown: str, toc: str, repeat: int):
+    tree_parser = TreeParser()
+
+    def parse():
+        root = Node('0', "root", "out")
+        tree_parser.build_tree(markdown, toc.splitlines(keepends=True), root, {'0': root}, "out")
+        return root
+
+    def load():
+        root = Node('0', "root", "out")
+        load_tree(read_tree_cache(path)["nodes"], root, "out")
+        return root
+
+    parse_time, parsed = timed(parse, repeat)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "tree.json.gz")
+        save_time, _ = timed(lambda: save_tree_cache(path, parsed, {}, "0" * 64), repeat)
+        size = os.path.getsize(path)
+        load_time, loaded = timed(load, repeat)
+
+    print(f"{len(markdown) / 2**20:.1f} MB of markdown, {toc.count(chr(10))} TOC entries, {size / 2**20:.2f} MB cache")
+    print(f"{'parse':>6}: {parse_time * 1000:8.1f} ms")
+    print(f"{'save':>6}: {save_time * 1000:8.1f} ms")
+    print(f"{'load':>6}: {load_time * 1000:8.1f} ms  {parse_time / load_time:5.1f}x faster than parsing")
+    print(f"same tree: {dump(parsed) == dump(loaded)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("markdown", nargs="?")
+    parser.add_argument("toc", nargs="?")
+    parser.add_argument("--synthetic", type=int, default=0, help="sections of a generated document")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    if args.synthetic:
+        markdown, toc = synthetic_document(args.synthetic)
+    else:
+        with open(args.markdown, "r") as markdown_file, open(args.toc, "r") as toc_file:
+            markdown, toc = markdown_file.read(), toc_file.read()
+    main(markdown, toc, args.repeat)
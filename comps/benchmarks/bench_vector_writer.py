@@ -0,0 +1,89 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+"""Ingest throughput of the dataprep BulkVectorWriter in chunks per second.
+
+Writes ``--chunks`` synthetic chunks to a scratch index of a Redis Stack instance,
+embedding them with a stand-in model that takes ``--embed-delay`` seconds per chunk.
+It compares three ways of writing: embedding and writing each batch one after the other,
+the writer's overlapped ingest, and writing precomputed vectors only. The last one
+isolates the Redis side.
+
+Usage:
+    python -m comps.benchmarks.bench_vector_writer --redis-url redis://localhost:6379 \\
+        --chunks 20000 --batch-size 64 256 1024
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+import redis
+
+from comps.dataprep.vector_writer import BulkVectorWriter
+
+INDEX_NAME = "bench-vector-writer"
+SCHEMA = os.path.join(os.path.dirname(__file__), "..", "dataprep", "redis_schema.yml")
+
+
+def make_embed(dim: int, delay: float):
+    rng = np.random.default_rng(0)
+
+    def embed(texts):
+        time.sleep(delay * len(texts))
+        return rng.random((len(texts), dim), dtype=np.float32).tolist()
+
+    return embed
+
+
+def drop(pool: redis.ConnectionPool):
+    try:
+        redis.Redis(connection_pool=pool).ft(INDEX_NAME).dropindex(delete_documents=True)
+    except redis.ResponseError:
+        pass
+
+
+def run(pool, batch_size: int, texts, metadatas, embed, mode: str) -> float:
+    drop(pool)
+    writer = BulkVectorWriter(pool, INDEX_NAME, SCHEMA, batch_size=batch_size)
+    start = time.perf_counter()
+    if mode == "overlapped":
+        writer.ingest(texts, metadatas, embed)
+    elif mode == "serial":
+        for i in range(0, len(texts), batch_size):
+            writer.write(texts[i : i + batch_size], metadatas[i : i + batch_size], embed(texts[i : i + batch_size]))
+    else:
+        embeddings = embed(texts)
+        start = time.perf_counter()
+        for i in range(0, len(texts), batch_size):
+            writer.write(texts[i : i + batch_size], metadatas[i : i + batch_size], embeddings[i : i + batch_size])
+    return len(texts) / (time.perf_counter() - start)
+
+
+def main(redis_url: str, num_chunks: int, batch_sizes, dim: int, embed_delay: float):
+    pool = redis.ConnectionPool.from_url(redis_url)
+    texts = [f"chunk {i} " + "lorem ipsum " * 100 for i in range(num_chunks)]
+    metadatas = [
+        {"file_name": "bench.pdf", "chunk_index": i, "page": i // 10, "heading_path": "1 > 1.1"}
+        for i in range(num_chunks)
+    ]
+    embed = make_embed(dim, embed_delay)
+    print(f"{'batch':>6} {'serial':>12} {'overlapped':>12} {'write only':>12}  (chunks/s)")
+    try:
+        for batch_size in batch_sizes:
+            rates = [run(pool, batch_size, texts, metadatas, embed, mode) for mode in ("serial", "overlapped", "write")]
+            print(f"{batch_size:>6} " + " ".join(f"{rate:>12.0f}" for rate in rates))
+    finally:
+        drop(pool)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--redis-url", default="redis://localhost:6379")
+    parser.add_argument("--chunks", type=int, default=20000)
+    parser.add_argument("--batch-size", type=int, nargs="+", default=[64, 256, 1024])
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--embed-delay", type=float, default=0.0005, help="seconds per chunk of the stand-in model")
+    args = parser.parse_args()
+    main(args.redis_url, args.chunks, args.batch_size, args.dim, args.embed_delay)
@@ -0,0 +1,163 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import asyncio
+import time
+from collections import deque
+from enum import Enum
+from typing import Any, Awaitable, Callable, Optional
+
+from prometheus_client import Gauge, Histogram
+
+from .logger import CustomLogger
+
+logger = CustomLogger("comps-core-batching")
+
+
+class BatchingMetrics:
+    # Class members for the same reasons as OrchestratorMetrics
+    batch_size = Histogram(
+        "microservice_batch_size",
+        "Requests per dynamic batch (histogram)",
+        ["service", "service_type"],
+        buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+    )
+    queue_wait = Histogram(
+        "microservice_batch_queue_wait",
+        "Time a request waited in the batching queue (histogram)",
+        ["service", "service_type"],
+        buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+    )
+    queue_depth = Gauge(
+        "microservice_batch_queue_depth", "Requests waiting in the batching queue (gauge)", ["service", "service_type"]
+    )
+    wait_budget = Gauge(
+        "microservice_batch_wait_budget",
+        "Current adaptive batching deadline in seconds (gauge)",
+        ["service", "service_type"],
+    )
+
+    def __init__(self) -> None:
+        pass
+
+
+class BatchQueue:
+    """Dynamic batching queue of one service type.
+
+    A batch is flushed as soon as it holds ``max_batch_size`` requests or its oldest
+    request reached the deadline. The deadline is ``max_wait`` seconds, shortened so that
+    queueing plus the observed p99 inference time stays within ``target_latency``, and the
+    queue flushes early when the observed arrival rate makes another request unlikely to
+    come before the deadline, so an idle service adds no batching delay. At most
+    ``max_queue_size`` requests wait at once, further submitters are held back until the
+    queue drains.
+    """
+
+    ARRIVAL_SMOOTHING = 0.2
+    INFER_WINDOW = 128
+
+    def __init__(
+        self,
+        name: str,
+        service_type: Enum,
+        infer: Callable[[Enum, list], Awaitable[list]],
+        max_batch_size: int = 32,
+        max_wait: float = 0.005,
+        target_latency: Optional[float] = None,
+        max_queue_size: Optional[int] = None,
+    ):
+        self.service_type = service_type
+        self.infer = infer
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.target_latency = target_latency
+        self.metrics = BatchingMetrics()
+        self._labels = (name, str(service_type))
+        self._queue = deque()  # (request, future, enqueue time)
+        self._slots = asyncio.Semaphore(max_queue_size or 8 * max_batch_size)
+        self._arrival = asyncio.Event()
+        self._worker = None
+        self._last_arrival = None
+        self._arrival_gap = max_wait
+        self._infer_latencies = deque(maxlen=self.INFER_WINDOW)
+
+    async def submit(self, request: Any) -> Any:
+        await self._slots.acquire()
+        now = time.perf_counter()
+        if self._last_arrival is not None:
+            # gaps beyond max_wait all mean "idle", do not let them dominate the average
+            gap = min(now - self._last_arrival, self.max_wait)
+            self._arrival_gap += self.ARRIVAL_SMOOTHING * (gap - self._arrival_gap)
+        self._last_arrival = now
+
+        future = asyncio.get_running_loop().create_future()
+        self._queue.append((request, future, now))
+        self.metrics.queue_depth.labels(*self._labels).set(len(self._queue))
+        self._arrival.set()
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+        return await future
+
+    def wait_budget(self) -> float:
+        if self.target_latency is None or not self._infer_latencies:
+            return self.max_wait
+        latencies = sorted(self._infer_latencies)
+        infer_p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        return min(self.max_wait, max(0.0, self.target_latency - infer_p99))
+
+    async def _fill(self):
+        budget = self.wait_budget()
+        self.metrics.wait_budget.labels(*self._labels).set(budget)
+        deadline = self._queue[0][2] + budget
+        while len(self._queue) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0 or self._arrival_gap > remaining:
+                return
+            self._arrival.clear()
+            try:
+                await asyncio.wait_for(self._arrival.wait(), remaining)
+            except asyncio.TimeoutError:
+                return
+
+    async def _run(self):
+        while True:
+            if not self._queue:
+                self._arrival.clear()
+                await self._arrival.wait()
+                continue
+            await self._fill()
+
+            now = time.perf_counter()
+            batch = []
+            for _ in range(min(self.max_batch_size, len(self._queue))):
+                request, future, enqueued = self._queue.popleft()
+                self._slots.release()
+                self.metrics.queue_wait.labels(*self._labels).observe(now - enqueued)
+                batch.append({"request": request, "response": future})
+            self.metrics.queue_depth.labels(*self._labels).set(len(self._queue))
+            self.metrics.batch_size.labels(*self._labels).observe(len(batch))
+
+            try:
+                results = list(await self.infer(self.service_type, batch))
+            except Exception as e:
+                # fail the waiting requests instead of the worker
+                logger.error(f"dynamic batching inference failed: {e}")
+                for req in batch:
+                    if not req["response"].done():
+                        req["response"].set_exception(e)
+                continue
+            finally:
+                self._infer_latencies.append(time.perf_counter() - now)
+
+            for req, result in zip(batch, results):
+                if not req["response"].done():
+                    req["response"].set_result(result)
+            if len(results) != len(batch):
+                # a request without a result would otherwise wait forever
+                error = RuntimeError(
+                    f"dynamic batching inference returned {len(results)} results for {len(batch)} requests"
+                )
+                logger.error(str(error))
+                for req in batch[len(results) :]:
+                    if not req["response"].done():
+                        req["response"].set_exception(error)
@@ -2,18 +2,31 @@
 # SPDX-License-Identifier: Apache-2.0
 
 from collections import OrderedDict, defaultdict
-from copy import deepcopy
 
 
 class DAG(object):
     def __init__(self):
         self.reset_graph()
 
+    @property
+    def graph(self):
+        return self._graph
+
+    @graph.setter
+    def graph(self, graph):
+        # keep the reverse index in sync when a whole graph is assigned
+        self._graph = graph
+        self.reverse = OrderedDict((node, set()) for node in graph)
+        for node, edges in graph.items():
+            for dep_node in edges:
+                self.reverse[dep_node].add(node)
+
     def add_node(self, node_name: str):
         graph = self.graph
         if node_name in graph:
             raise KeyError("node %s already exists" % node_name)
         graph[node_name] = set()
+        self.reverse[node_name] = set()
 
     def add_node_if_not_exists(self, node_name):
         try:
@@ -25,11 +38,11 @@ class DAG(object):
         graph = self.graph
         if node_name not in graph:
             raise KeyError("node %s does not exist" % node_name)
-        graph.pop(node_name)
 
-        for node, edges in graph.items():
-            if node_name in edges:
-                edges.remove(node_name)
+        for node in self.reverse.pop(node_name):
+            graph[node].discard(node_name)
+        for dep_node in graph.pop(node_name):
+            self.reverse[dep_node].discard(node_name)
 
     def delete_node_if_exists(self, node_name):
         try:
@@ -41,23 +54,39 @@ class DAG(object):
         graph = self.graph
         if ind_node not in graph or dep_node not in graph:
             raise KeyError("one or more nodes do not exist in graph")
-        test_graph = deepcopy(graph)
-        test_graph[ind_node].add(dep_node)
-        is_valid = self.validate(test_graph)
-        if is_valid:
-            graph[ind_node].add(dep_node)
-        else:
+        # the new edge closes a cycle iff ind_node is already reachable from dep_node
+        if self.reachable(dep_node, ind_node):
             raise Exception("validation error!")
+        graph[ind_node].add(dep_node)
+        self.reverse[dep_node].add(ind_node)
 
     def delete_edge(self, ind_node, dep_node):
         graph = self.graph
         if dep_node not in graph.get(ind_node, []):
             raise KeyError("this edge does not exist in graph")
         graph[ind_node].remove(dep_node)
+        self.reverse[dep_node].remove(ind_node)
 
-    def predecessors(self, node):
+    def reachable(self, from_node, to_node) -> bool:
+        """Whether to_node can be reached from from_node by following edges."""
         graph = self.graph
-        return [key for key in graph if node in graph[key]]
+        stack = [from_node]
+        nodes_seen = {from_node}
+        while stack:
+            node = stack.pop()
+            if node == to_node:
+                return True
+            for downstream_node in graph[node]:
+                if downstream_node not in nodes_seen:
+                    nodes_seen.add(downstream_node)
+                    stack.append(downstream_node)
+        return False
+
+    def predecessors(self, node):
+        return list(self.reverse.get(node, ()))
+
+    def in_degree(self, node) -> int:
+        return len(self.reverse[node])
 
     def downstream(self, node) -> list:
         graph = self.graph
@@ -77,7 +106,9 @@ class DAG(object):
                     nodes_seen.add(downstream_node)
                     nodes.append(downstream_node)
             i += 1
-        return list(filter(lambda node: node in nodes_seen, self.topological_sort(graph=graph)))
+        # the downstreams of a reachable node are reachable too, so sorting the subgraph is enough
+        subgraph = OrderedDict((key, graph[key]) for key in graph if key in nodes_seen)
+        return self.topological_sort(graph=subgraph)
 
     def all_leaves(self):
         graph = self.graph
@@ -97,7 +128,8 @@ class DAG(object):
         self.graph = OrderedDict()
 
     def ind_nodes(self, graph=None):
-        graph = graph if graph is not None else self.graph
+        if graph is None:
+            return [node for node, preds in self.reverse.items() if not preds]
 
         dependent_nodes = set(node for dependents in graph.values() for node in dependents)
         return [node for node in graph.keys() if node not in dependent_nodes]
@@ -140,3 +172,102 @@ class DAG(object):
 
     def size(self):
         return len(self.graph)
+
+
+class ExecutionPlan(object):
+    """Read-only snapshot of a static DAG with every lookup the scheduler needs precomputed."""
+
+    def __init__(self, dag: DAG):
+        graph = dag.graph
+        self.graph = OrderedDict((node, frozenset(edges)) for node, edges in graph.items())
+        self.downstreams = {node: tuple(edges) for node, edges in graph.items()}
+        self.predecessors = {node: tuple(dag.predecessors(node)) for node in graph}
+        self.in_degree = {node: dag.in_degree(node) for node in graph}
+        self.order = tuple(dag.topological_sort(graph=graph))
+        self.ind_nodes = tuple(node for node in graph if not self.in_degree[node])
+        self.leaves = tuple(node for node in graph if not graph[node])
+        position = {node: i for i, node in enumerate(self.order)}
+        self.all_downstreams = {}
+        for node in reversed(self.order):
+            reachable = set(self.downstreams[node])
+            for dep_node in self.downstreams[node]:
+                reachable.update(self.all_downstreams[dep_node])
+            self.all_downstreams[node] = tuple(sorted(reachable, key=position.__getitem__))
+
+
+class RuntimeGraph(DAG):
+    """Per-request view over an ExecutionPlan.
+
+    Reads are served from the plan. The plan's graph is only copied the first time the
+    request mutates it, e.g. when a node blacklists downstreams or rewires the flow.
+    """
+
+    def __init__(self, plan: ExecutionPlan):
+        self.plan = plan
+        # reads are answered by the plan, the reverse index is only built once the graph is owned
+        self._graph = plan.graph
+        self.reverse = None
+        self.dirty = False
+
+    def _own(self):
+        if not self.dirty:
+            self.graph = OrderedDict((node, set(edges)) for node, edges in self.plan.graph.items())
+            self.dirty = True
+
+    # the preconditions are checked on the plan's graph first, so a call that changes nothing,
+    # like delete_node_if_exists of an absent node, does not copy it
+
+    def add_node(self, node_name: str):
+        if node_name in self.graph:
+            raise KeyError("node %s already exists" % node_name)
+        self._own()
+        super().add_node(node_name)
+
+    def delete_node(self, node_name):
+        if node_name not in self.graph:
+            raise KeyError("node %s does not exist" % node_name)
+        self._own()
+        super().delete_node(node_name)
+
+    def add_edge(self, ind_node, dep_node):
+        if ind_node not in self.graph or dep_node not in self.graph:
+            raise KeyError("one or more nodes do not exist in graph")
+        self._own()
+        super().add_edge(ind_node, dep_node)
+
+    def delete_edge(self, ind_node, dep_node):
+        if dep_node not in self.graph.get(ind_node, []):
+            raise KeyError("this edge does not exist in graph")
+        self._own()
+        super().delete_edge(ind_node, dep_node)
+
+    def reset_graph(self):
+        self.graph = OrderedDict()
+        self.dirty = True
+
+    def predecessors(self, node):
+        if self.dirty:
+            return super().predecessors(node)
+        return list(self.plan.predecessors.get(node, ()))
+
+    def downstream(self, node) -> list:
+        if self.dirty:
+            return super().downstream(node)
+        if node not in self.plan.downstreams:
+            raise KeyError("node %s is not in graph" % node)
+        return list(self.plan.downstreams[node])
+
+    def all_downstreams(self, node):
+        if self.dirty:
+            return super().all_downstreams(node)
+        return list(self.plan.all_downstreams[node])
+
+    def all_leaves(self):
+        if self.dirty:
+            return super().all_leaves()
+        return list(self.plan.leaves)
+
+    def ind_nodes(self, graph=None):
+        if self.dirty or graph is not None:
+            return super().ind_nodes(graph=graph)
+        return list(self.plan.ind_nodes)
@@ -0,0 +1,106 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import asyncio
+import hashlib
+import re
+import unicodedata
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+from prometheus_client import Counter
+
+from .logger import CustomLogger
+
+logger = CustomLogger("comps-core-embedding-cache")
+
+
+class EmbeddingCacheMetrics:
+    # Class members for the same reasons as OrchestratorMetrics
+    hits = Counter("megaservice_embedding_cache_hits", "Embeddings served from the cache (counter)", ["tier"])
+    misses = Counter("megaservice_embedding_cache_misses", "Embeddings computed by the service (counter)")
+
+    def __init__(self) -> None:
+        pass
+
+
+class EmbeddingCache:
+    """Query embedding cache keyed by a hash of the normalized text and the model id.
+
+    The first tier is an in-process LRU of ``max_entries`` vectors. When ``redis_url``
+    is given, vectors are also shared through Redis for ``ttl`` seconds so every
+    megaservice replica benefits from them.
+    """
+
+    def __init__(
+        self,
+        model_id: str,
+        max_entries: int = 4096,
+        redis_url: Optional[str] = None,
+        ttl: int = 86400,
+        key_prefix: str = "embedding-cache:",
+    ):
+        self.model_id = model_id
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.key_prefix = key_prefix
+        self.metrics = EmbeddingCacheMetrics()
+        self._entries = OrderedDict()
+        self._redis = None
+        self._writes = set()
+        if redis_url:
+            import redis.asyncio
+
+            self._redis = redis.asyncio.Redis.from_url(redis_url)
+
+    def key(self, text: str) -> str:
+        text = re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip()
+        digest = hashlib.sha256(f"{self.model_id}\0{text}".encode("utf-8")).hexdigest()
+        return self.key_prefix + digest
+
+    def _remember(self, key: str, embedding: List[float]):
+        self._entries[key] = embedding
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get(self, text: str) -> Optional[List[float]]:
+        key = self.key(text)
+        embedding = self._entries.get(key)
+        if embedding is not None:
+            self._entries.move_to_end(key)
+            self.metrics.hits.labels("local").inc()
+            return embedding
+
+        if self._redis is not None:
+            try:
+                value = await self._redis.get(key)
+            except Exception as e:
+                logger.error(f"Fail to read embedding cache from Redis: {e}")
+                value = None
+            if value:
+                embedding = np.frombuffer(value, dtype=np.float32).tolist()
+                self._remember(key, embedding)
+                self.metrics.hits.labels("redis").inc()
+                return embedding
+
+        self.metrics.misses.inc()
+        return None
+
+    def put(self, text: str, embedding: List[float]):
+        key = self.key(text)
+        if key in self._entries:
+            return
+        self._remember(key, embedding)
+        if self._redis is not None:
+            # write-behind, the caller is on the request path
+            task = asyncio.get_running_loop().create_task(self._store(key, embedding))
+            self._writes.add(task)
+            task.add_done_callback(self._writes.discard)
+
+    async def _store(self, key: str, embedding: List[float]):
+        try:
+            await self._redis.set(key, np.asarray(embedding, dtype=np.float32).tobytes(), ex=self.ttl)
+        except Exception as e:
+            logger.error(f"Fail to write embedding cache to Redis: {e}")
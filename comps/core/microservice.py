@@ -1,10 +1,9 @@
-import asyncio
 import os
-from collections import defaultdict, deque
 from enum import Enum
 from typing import Any, List, Optional, Type
 
 from ..proto.docarray import TextDoc
+from .batching import BatchQueue
 from .constants import ServiceRoleType, ServiceType
 from .http_service import HTTPService
 from .logger import CustomLogger
@@ -37,8 +36,10 @@ class MicroService(HTTPService):
         use_remote_service: Optional[bool] = False,
         description: Optional[str] = None,
         dynamic_batching: bool = False,
-        dynamic_batching_timeout: int = 1,
+        dynamic_batching_timeout: float = 0.005,
         dynamic_batching_max_batch_size: int = 32,
+        dynamic_batching_target_latency: Optional[float] = None,
+        dynamic_batching_max_queue_size: Optional[int] = None,
     ):
         """Init the microservice."""
         self.service_role = service_role
@@ -54,6 +55,8 @@ class MicroService(HTTPService):
         self.dynamic_batching = dynamic_batching
         self.dynamic_batching_timeout = dynamic_batching_timeout
         self.dynamic_batching_max_batch_size = dynamic_batching_max_batch_size
+        self.dynamic_batching_target_latency = dynamic_batching_target_latency
+        self.dynamic_batching_max_queue_size = dynamic_batching_max_queue_size
         self.uvicorn_kwargs = {}
 
         if ssl_keyfile:
@@ -82,43 +85,30 @@ class MicroService(HTTPService):
 
             super().__init__(uvicorn_kwargs=self.uvicorn_kwargs, runtime_args=runtime_args)
 
-            # create a batch request processor loop if using dynamic batching
+            # one batching queue per service type, created on first use
             if self.dynamic_batching:
-                self.buffer_lock = asyncio.Lock()
-                self.request_buffer = defaultdict(deque)
-                self.add_startup_event(self._dynamic_batch_processor())
+                self.batch_queues = {}
 
             self._async_setup()
 
         # overwrite name
         self.name = f"{name}/{self.__class__.__name__}" if name else self.__class__.__name__
 
-    async def _dynamic_batch_processor(self):
-        if logflag:
-            logger.info("dynamic batch processor looping...")
-        while True:
-            await asyncio.sleep(self.dynamic_batching_timeout)
-            runtime_batch: dict[Enum, list[dict]] = {}  # {ServiceType.Embedding: [{"request": xx, "response": yy}, {}]}
-
-            async with self.buffer_lock:
-                # prepare the runtime batch, access to buffer is locked
-                if self.request_buffer:
-                    for service_type, request_lst in self.request_buffer.items():
-                        batch = []
-                        # grab min(MAX_BATCH_SIZE, REQUEST_SIZE) requests from buffer
-                        for _ in range(min(self.dynamic_batching_max_batch_size, len(request_lst))):
-                            batch.append(request_lst.popleft())
-
-                        runtime_batch[service_type] = batch
-
-            # Run batched inference on the batch and set results
-            for service_type, batch in runtime_batch.items():
-                if not batch:
-                    continue
-                results = await self.dynamic_batching_infer(service_type, batch)
-
-                for req, result in zip(batch, results):
-                    req["response"].set_result(result)
+    async def dynamic_batching_request(self, service_type: Enum, request: Any) -> Any:
+        """Queue a request for batched inference and wait for its result."""
+        batch_queue = self.batch_queues.get(service_type)
+        if batch_queue is None:
+            batch_queue = BatchQueue(
+                self.name,
+                service_type,
+                lambda service_type, batch: self.dynamic_batching_infer(service_type, batch),
+                max_batch_size=self.dynamic_batching_max_batch_size,
+                max_wait=self.dynamic_batching_timeout,
+                target_latency=self.dynamic_batching_target_latency,
+                max_queue_size=self.dynamic_batching_max_queue_size,
+            )
+            self.batch_queues[service_type] = batch_queue
+        return await batch_queue.submit(request)
 
     async def dynamic_batching_infer(self, service_type: Enum, batch: list[dict]):
         """Need to implement."""
@@ -153,8 +143,10 @@ def register_microservice(
     provider_endpoint: Optional[str] = None,
     methods: List[str] = ["POST"],
     dynamic_batching: bool = False,
-    dynamic_batching_timeout: int = 1,
+    dynamic_batching_timeout: float = 0.005,
     dynamic_batching_max_batch_size: int = 32,
+    dynamic_batching_target_latency: Optional[float] = None,
+    dynamic_batching_max_queue_size: Optional[int] = None,
 ):
     def decorator(func):
         if name not in opea_microservices:
@@ -175,6 +167,8 @@ def register_microservice(
                 dynamic_batching=dynamic_batching,
                 dynamic_batching_timeout=dynamic_batching_timeout,
                 dynamic_batching_max_batch_size=dynamic_batching_max_batch_size,
+                dynamic_batching_target_latency=dynamic_batching_target_latency,
+                dynamic_batching_max_queue_size=dynamic_batching_max_queue_size,
             )
             opea_microservices[name] = micro_service
         opea_microservices[name].app.router.add_api_route(endpoint, func, methods=methods)
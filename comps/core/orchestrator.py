@@ -2,27 +2,31 @@
 # SPDX-License-Identifier: Apache-2.0
 
 import asyncio
-import copy
-import json
 import os
 import re
 import time
+import weakref
 from typing import Dict, List
 
 import aiohttp
-import requests
 from fastapi.responses import StreamingResponse
-from prometheus_client import Gauge, Histogram
+from prometheus_client import Counter, Gauge, Histogram
 from pydantic import BaseModel
 
 from ..proto.docarray import LLMParams
 from .constants import ServiceType
-from .dag import DAG
+from .dag import DAG, ExecutionPlan, RuntimeGraph
 from .logger import CustomLogger
 
 logger = CustomLogger("comps-core-orchestrator")
 LOGFLAG = os.getenv("LOGFLAG", False)
 
+# connection pool shared by all requests of an orchestrator, limits are per upstream host:port
+POOL_LIMIT = int(os.getenv("MEGASERVICE_POOL_LIMIT", 1024))
+POOL_LIMIT_PER_HOST = int(os.getenv("MEGASERVICE_POOL_LIMIT_PER_HOST", 256))
+POOL_KEEPALIVE_TIMEOUT = float(os.getenv("MEGASERVICE_POOL_KEEPALIVE_TIMEOUT", 60))
+POOL_DNS_CACHE_TTL = int(os.getenv("MEGASERVICE_POOL_DNS_CACHE_TTL", 300))
+
 
 class OrchestratorMetrics:
     # Because:
@@ -34,6 +38,11 @@ class OrchestratorMetrics:
     inter_token_latency = Histogram("megaservice_inter_token_latency", "Inter-token latency (histogram)")
     request_latency = Histogram("megaservice_request_latency", "Whole request/reply latency (histogram)")
     request_pending = Gauge("megaservice_request_pending", "Count of currently pending requests (gauge)")
+    schedule_overhead = Histogram(
+        "megaservice_schedule_overhead",
+        "Time spent by schedule() on graph bookkeeping, excluding service calls (histogram)",
+        buckets=(1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, float("inf")),
+    )
 
     def __init__(self) -> None:
         pass
@@ -55,19 +64,178 @@ class OrchestratorMetrics:
         else:
             self.request_pending.dec()
 
+    def schedule_update(self, overhead: float) -> None:
+        self.schedule_overhead.observe(overhead)
+
+
+class ConnectionPoolMetrics:
+    # Class members for the same reasons as OrchestratorMetrics, the series are labelled
+    # with the orchestrator name and, per upstream, with the upstream "host:port".
+    # Counts come from the aiohttp trace callbacks, the pool has no public occupancy API.
+    connections_created = Counter(
+        "megaservice_pool_connections_created",
+        "New connections opened to an upstream (counter)",
+        ["orchestrator", "upstream"],
+    )
+    connections_reused = Counter(
+        "megaservice_pool_connections_reused",
+        "Keep-alive connections reused for an upstream (counter)",
+        ["orchestrator", "upstream"],
+    )
+    connection_queued_latency = Histogram(
+        "megaservice_pool_connection_queued_latency",
+        "Time spent waiting for a free connection slot (histogram)",
+        ["orchestrator", "upstream"],
+    )
+    requests_in_flight = Gauge(
+        "megaservice_pool_requests_in_flight",
+        "Requests sent through the pool and waiting for their response headers (gauge)",
+        ["orchestrator"],
+    )
+    requests_queued = Gauge(
+        "megaservice_pool_requests_queued", "Requests waiting for a free connection slot (gauge)", ["orchestrator"]
+    )
+
+    def __init__(self, name: str = "megaservice") -> None:
+        self.name = name
+
+    def trace_config(self) -> aiohttp.TraceConfig:
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(self._on_request_start)
+        trace_config.on_request_end.append(self._on_request_done)
+        trace_config.on_request_exception.append(self._on_request_done)
+        trace_config.on_connection_create_end.append(self._on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(self._on_connection_reuseconn)
+        trace_config.on_connection_queued_start.append(self._on_connection_queued_start)
+        trace_config.on_connection_queued_end.append(self._on_connection_queued_end)
+        return trace_config
+
+    async def _on_request_start(self, session, trace_config_ctx, params):
+        trace_config_ctx.upstream = f"{params.url.host}:{params.url.port}"
+        trace_config_ctx.queued_start = None
+        self.requests_in_flight.labels(self.name).inc()
+
+    async def _on_request_done(self, session, trace_config_ctx, params):
+        # a request cancelled or failed while queued never sees on_connection_queued_end
+        if trace_config_ctx.queued_start is not None:
+            self.requests_queued.labels(self.name).dec()
+        self.requests_in_flight.labels(self.name).dec()
+
+    async def _on_connection_create_end(self, session, trace_config_ctx, params):
+        self.connections_created.labels(self.name, trace_config_ctx.upstream).inc()
+
+    async def _on_connection_reuseconn(self, session, trace_config_ctx, params):
+        self.connections_reused.labels(self.name, trace_config_ctx.upstream).inc()
+
+    async def _on_connection_queued_start(self, session, trace_config_ctx, params):
+        trace_config_ctx.queued_start = time.time()
+        self.requests_queued.labels(self.name).inc()
+
+    async def _on_connection_queued_end(self, session, trace_config_ctx, params):
+        self.connection_queued_latency.labels(self.name, trace_config_ctx.upstream).observe(
+            time.time() - trace_config_ctx.queued_start
+        )
+        trace_config_ctx.queued_start = None
+        self.requests_queued.labels(self.name).dec()
+
+
+class ReleasingStream:
+    """Async iterator over a streamed reply that calls ``release`` exactly once.
+
+    It runs when the stream ends, fails, is cancelled or closed, and otherwise when the iterator
+    is garbage collected without being drained: the client disconnected before the first read,
+    or a downstream node failed and the response was never sent. Wrappers that rebuild the
+    StreamingResponse around it are covered as well.
+    """
+
+    def __init__(self, gen, release):
+        self.gen = gen
+        self._release = weakref.finalize(self, release)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.gen.__anext__()
+        except BaseException:
+            self._release()
+            raise
+
+    async def aclose(self):
+        try:
+            await self.gen.aclose()
+        finally:
+            self._release()
+
 
 class ServiceOrchestrator(DAG):
-    """Manage 1 or N micro services in a DAG through Python API."""
+    """Manage 1 or N micro services in a DAG through Python API.
 
-    def __init__(self) -> None:
+    ``name`` labels the connection pool metrics of the orchestrator.
+    """
+
+    def __init__(self, name: str = "megaservice") -> None:
+        self.name = name
         self.metrics = OrchestratorMetrics()
+        self.pool_metrics = ConnectionPoolMetrics(name)
         self.services = {}  # all services, id -> service
+        self._session = None
+        self._session_loop = None
         super().__init__()
+        self.compile()
+
+    def compile(self):
+        """Precompute the execution plan of the static flow, shared by every schedule() call."""
+        self.plan = ExecutionPlan(self)
+        return self.plan
+
+    def get_session(self) -> aiohttp.ClientSession:
+        """Return the pooled client session, creating it on first use in the running event loop."""
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._session_loop is not loop:
+            if self._session is not None:
+                self._close_stale_session(self._session, self._session_loop)
+            connector = aiohttp.TCPConnector(
+                limit=POOL_LIMIT,
+                limit_per_host=POOL_LIMIT_PER_HOST,
+                keepalive_timeout=POOL_KEEPALIVE_TIMEOUT,
+                use_dns_cache=True,
+                ttl_dns_cache=POOL_DNS_CACHE_TTL,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                trust_env=True,
+                timeout=aiohttp.ClientTimeout(total=1000),
+                trace_configs=[self.pool_metrics.trace_config()],
+            )
+            self._session_loop = loop
+        return self._session
+
+    @staticmethod
+    def _close_stale_session(session: aiohttp.ClientSession, loop: asyncio.AbstractEventLoop) -> None:
+        """Close a session created in another event loop on that loop, detach it when the loop is closed."""
+        if session.closed:
+            return
+        if loop.is_closed():
+            # the transports of a closed loop cannot be closed any more, they are freed with the connector
+            session.detach()
+        else:
+            # runs on that loop right away, or as soon as a stopped loop runs again
+            asyncio.run_coroutine_threadsafe(session.close(), loop)
+
+    async def close(self):
+        """Close the pooled client session and all its keep-alive connections."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._session_loop = None
 
     def add(self, service):
         if service.name not in self.services:
             self.services[service.name] = service
             self.add_node_if_not_exists(service.name)
+            self.compile()
         else:
             raise Exception(f"Service {service.name} already exists!")
         return self
@@ -75,6 +243,7 @@ class ServiceOrchestrator(DAG):
     def flow_to(self, from_service, to_service):
         try:
             self.add_edge(from_service.name, to_service.name)
+            self.compile()
             return True
         except Exception as e:
             logger.error(e)
@@ -85,26 +254,29 @@ class ServiceOrchestrator(DAG):
         self.metrics.pending_update(True)
 
         result_dict = {}
-        runtime_graph = DAG()
-        runtime_graph.graph = copy.deepcopy(self.graph)
+        runtime_graph = RuntimeGraph(self.plan)
         if LOGFLAG:
             logger.info(initial_inputs)
 
-        timeout = aiohttp.ClientTimeout(total=1000)
-        async with aiohttp.ClientSession(trust_env=True, timeout=timeout) as session:
+        session = self.get_session()
+        # a streaming LLM node releases the pending request once its stream is drained
+        streaming = False
+        try:
             pending = {
                 asyncio.create_task(
                     self.execute(session, req_start, node, initial_inputs, runtime_graph, llm_parameters, **kwargs)
                 )
-                for node in self.ind_nodes()
+                for node in self.plan.ind_nodes
             }
-            ind_nodes = self.ind_nodes()
+            overhead = time.time() - req_start
 
             while pending:
                 done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                step_start = time.time()
                 for done_task in done:
                     response, node = await done_task
                     result_dict[node] = response
+                    streaming = streaming or isinstance(response, StreamingResponse)
 
                     # traverse the current node's downstream nodes and execute if all one's predecessors are finished
                     downstreams = runtime_graph.downstream(node)
@@ -142,18 +314,30 @@ class ServiceOrchestrator(DAG):
                                     )
                                 )
                             )
-        nodes_to_keep = []
-        for i in ind_nodes:
-            nodes_to_keep.append(i)
-            nodes_to_keep.extend(runtime_graph.all_downstreams(i))
-
-        all_nodes = list(runtime_graph.graph.keys())
-
-        for node in all_nodes:
-            if node not in nodes_to_keep:
-                runtime_graph.delete_node_if_exists(node)
-
-        if not llm_parameters.stream:
+                overhead += time.time() - step_start
+        except BaseException:
+            # a stream already handed out releases the pending request itself, read or not
+            if not streaming:
+                self.metrics.pending_update(False)
+            raise
+
+        # an untouched plan has no unreachable nodes, only prune graphs rewired by this request
+        if runtime_graph.dirty:
+            step_start = time.time()
+            nodes_to_keep = set()
+            for i in self.plan.ind_nodes:
+                nodes_to_keep.add(i)
+                nodes_to_keep.update(runtime_graph.all_downstreams(i))
+
+            all_nodes = list(runtime_graph.graph.keys())
+
+            for node in all_nodes:
+                if node not in nodes_to_keep:
+                    runtime_graph.delete_node_if_exists(node)
+            overhead += time.time() - step_start
+        self.metrics.schedule_update(overhead)
+
+        if not streaming:
             self.metrics.pending_update(False)
 
         return result_dict, runtime_graph
@@ -190,17 +374,13 @@ class ServiceOrchestrator(DAG):
         inputs = self.align_inputs(inputs, cur_node, runtime_graph, llm_parameters_dict, **kwargs)
 
         if is_llm_vlm and llm_parameters.stream:
-            # Still leave to sync requests.post for StreamingResponse
             if LOGFLAG:
                 logger.info(inputs)
-            response = requests.post(
-                url=endpoint,
-                data=json.dumps(inputs),
-                headers={"Content-type": "application/json"},
-                proxies={"http": None},
-                stream=True,
-                timeout=1000,
-            )
+            # send the request eagerly so connection and HTTP errors surface from schedule(),
+            # the body is then consumed by the async generator below
+            response = await session.post(endpoint, json=inputs)
+            # releases the connection before raising on an error status
+            response.raise_for_status()
             downstream = runtime_graph.downstream(cur_node)
             if downstream:
                 assert len(downstream) == 1, "Not supported multiple stream downstreams yet!"
@@ -208,43 +388,45 @@ class ServiceOrchestrator(DAG):
                 hitted_ends = [".", "?", "!", "。", "，", "！"]
                 downstream_endpoint = self.services[downstream[0]].endpoint_path
 
-            def generate():
+            async def generate():
                 token_start = req_start
-                if response:
-                    # response.elapsed = time until first headers received
-                    buffered_chunk_str = ""
-                    is_first = True
-                    for chunk in response.iter_content(chunk_size=None):
-                        if chunk:
-                            if downstream:
-                                chunk = chunk.decode("utf-8")
-                                buffered_chunk_str += self.extract_chunk_str(chunk)
-                                is_last = chunk.endswith("[DONE]\n\n")
-                                if (buffered_chunk_str and buffered_chunk_str[-1] in hitted_ends) or is_last:
-                                    res = requests.post(
-                                        url=downstream_endpoint,
-                                        data=json.dumps({"text": buffered_chunk_str}),
-                                        proxies={"http": None},
-                                    )
-                                    res_json = res.json()
-                                    if "text" in res_json:
-                                        res_txt = res_json["text"]
-                                    else:
-                                        raise Exception("Other response types not supported yet!")
-                                    buffered_chunk_str = ""  # clear
-                                    yield from self.token_generator(
-                                        res_txt, token_start, is_first=is_first, is_last=is_last
-                                    )
-                                    token_start = time.time()
-                            else:
-                                token_start = self.metrics.token_update(token_start, is_first)
-                                yield chunk
-                            is_first = False
-                    self.metrics.request_update(req_start)
-                    self.metrics.pending_update(False)
-
+                buffered_chunk_str = ""
+                is_first = True
+                async for chunk in response.content.iter_any():
+                    if chunk:
+                        if downstream:
+                            chunk = chunk.decode("utf-8")
+                            buffered_chunk_str += self.extract_chunk_str(chunk)
+                            is_last = chunk.endswith("[DONE]\n\n")
+                            if (buffered_chunk_str and buffered_chunk_str[-1] in hitted_ends) or is_last:
+                                async with session.post(
+                                    downstream_endpoint, json={"text": buffered_chunk_str}
+                                ) as res:
+                                    res_json = await res.json()
+                                if "text" in res_json:
+                                    res_txt = res_json["text"]
+                                else:
+                                    raise Exception("Other response types not supported yet!")
+                                buffered_chunk_str = ""  # clear
+                                for token in self.token_generator(
+                                    res_txt, token_start, is_first=is_first, is_last=is_last
+                                ):
+                                    yield token
+                                token_start = time.time()
+                        else:
+                            token_start = self.metrics.token_update(token_start, is_first)
+                            yield chunk
+                        is_first = False
+                self.metrics.request_update(req_start)
+
+            def release():
+                # return the connection to the pool
+                response.release()
+                self.metrics.pending_update(False)
+
+            stream = ReleasingStream(generate(), release)
             return (
-                StreamingResponse(self.align_generator(generate(), **kwargs), media_type="text/event-stream"),
+                StreamingResponse(self.align_generator(stream, **kwargs), media_type="text/event-stream"),
                 cur_node,
             )
         else:
@@ -256,6 +438,12 @@ class ServiceOrchestrator(DAG):
                 input_data = {k: v for k, v in input_data.items() if v is not None}
             else:
                 input_data = inputs
+            cached_data = await self.align_cached_outputs(
+                input_data, cur_node, runtime_graph, llm_parameters_dict, **kwargs
+            )
+            if cached_data is not None:
+                data = self.align_outputs(cached_data, cur_node, inputs, runtime_graph, llm_parameters_dict, **kwargs)
+                return data, cur_node
             async with session.post(endpoint, json=input_data) as response:
                 if response.content_type == "audio/wav":
                     audio_data = await response.read()
@@ -278,6 +466,13 @@ class ServiceOrchestrator(DAG):
         """Override this method in megaservice definition."""
         return data
 
+    async def align_cached_outputs(self, inputs, *args, **kwargs):
+        """Override this method in megaservice definition.
+
+        Return the reply of the current node to skip calling its service, or None.
+        """
+        return None
+
     def align_generator(self, gen, *args, **kwargs):
         """Override this method in megaservice definition."""
         return gen
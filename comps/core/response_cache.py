@@ -0,0 +1,193 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import hashlib
+import json
+import re
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, List, Optional
+
+import numpy as np
+from prometheus_client import Counter, Gauge, Histogram
+
+from .logger import CustomLogger
+
+logger = CustomLogger("comps-core-response-cache")
+
+METRICS_PATTERN = re.compile(r"__METRICS__.*?__METRICS__", re.DOTALL)
+
+
+class ResponseCacheMetrics:
+    # Class members for the same reasons as OrchestratorMetrics
+    hits = Counter("megaservice_response_cache_hits", "Requests answered from the semantic cache (counter)")
+    misses = Counter("megaservice_response_cache_misses", "Requests that ran the full pipeline (counter)")
+    saved_latency = Histogram(
+        "megaservice_response_cache_saved_latency", "Pipeline latency avoided by a cache hit (histogram)"
+    )
+    evictions = Counter(
+        "megaservice_response_cache_evictions", "Entries removed from the semantic cache (counter)", ["reason"]
+    )
+    entries = Gauge("megaservice_response_cache_entries", "Entries held in the semantic cache (gauge)")
+
+    def __init__(self) -> None:
+        pass
+
+
+class CacheEntry:
+    def __init__(self, answer: str, sources: List[Dict], fingerprint: str, latency: float, expires: float):
+        self.answer = answer
+        self.sources = sources
+        self.fingerprint = fingerprint
+        self.latency = latency
+        self.expires = expires
+
+
+class SemanticResponseCache:
+    """In-process answer cache keyed on the query embedding.
+
+    A lookup hits when a live entry with the same request fingerprint has a cosine
+    similarity of at least ``threshold`` with the query embedding. Entries expire after
+    ``ttl`` seconds and the least recently used one is evicted beyond ``max_entries``.
+    The whole cache is dropped when the corpus version stored in Redis under
+    ``version_key`` changes, dataprep bumps it on every ingest and delete. Without
+    ``redis_url`` no change is seen, so every lookup bypasses the cache.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.95,
+        ttl: float = 3600,
+        max_entries: int = 1024,
+        redis_url: Optional[str] = None,
+        version_key: str = "chatqna:corpus_version",
+    ):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.version_key = version_key
+        self.metrics = ResponseCacheMetrics()
+        self._entries = OrderedDict()  # key -> CacheEntry, least recently used first
+        self._vectors = {}  # key -> normalized embedding
+        self._matrix = None
+        self._matrix_keys = []
+        self._next_key = 0
+        self._version = None
+        self._redis = None
+        if redis_url:
+            import redis.asyncio
+
+            self._redis = redis.asyncio.Redis.from_url(redis_url)
+
+    @staticmethod
+    def fingerprint(*params) -> str:
+        """Hash the request parameters that change the answer, beside the question itself."""
+        data = []
+        for param in params:
+            param = param.dict() if hasattr(param, "dict") else dict(param)
+            data.append({k: v for k, v in param.items() if k not in ("id", "stream")})
+        return hashlib.sha1(json.dumps(data, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    async def corpus_version(self) -> int:
+        if self._redis is None:
+            return -1
+        try:
+            version = await self._redis.get(self.version_key)
+        except Exception as e:
+            logger.error(f"Fail to read corpus version, bypassing the response cache: {e}")
+            return -1
+        return int(version) if version else 0
+
+    def clear(self, reason: str = "invalidated"):
+        if self._entries:
+            self.metrics.evictions.labels(reason).inc(len(self._entries))
+        self._entries.clear()
+        self._vectors.clear()
+        self._matrix = None
+        self.metrics.entries.set(0)
+
+    def _sync_version(self, version: int) -> bool:
+        if version < 0:
+            return False
+        if version != self._version:
+            self.clear("invalidated")
+            self._version = version
+        return True
+
+    def _remove(self, key, reason: str):
+        self._entries.pop(key)
+        self._vectors.pop(key)
+        self._matrix = None
+        self.metrics.evictions.labels(reason).inc()
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, embedding, fingerprint: str, version: int) -> Optional[CacheEntry]:
+        if not self._sync_version(version) or not self._entries:
+            self.metrics.misses.inc()
+            return None
+
+        now = time.time()
+        for key in [key for key, entry in self._entries.items() if entry.expires <= now]:
+            self._remove(key, "ttl")
+
+        if self._entries:
+            if self._matrix is None:
+                self._matrix_keys = list(self._vectors)
+                self._matrix = np.stack([self._vectors[key] for key in self._matrix_keys])
+            similarities = self._matrix @ self._normalize(embedding)
+            for i in np.argsort(-similarities):
+                if similarities[i] < self.threshold:
+                    break
+                key = self._matrix_keys[i]
+                entry = self._entries[key]
+                if entry.fingerprint == fingerprint:
+                    self._entries.move_to_end(key)
+                    self.metrics.hits.inc()
+                    self.metrics.entries.set(len(self._entries))
+                    return entry
+
+        self.metrics.misses.inc()
+        self.metrics.entries.set(len(self._entries))
+        return None
+
+    def insert(self, embedding, fingerprint: str, version: int, answer: str, sources: List[Dict], latency: float):
+        # an answer computed while the corpus changed must not outlive the old corpus
+        if not answer or version != self._version:
+            return
+        key = self._next_key
+        self._next_key += 1
+        self._entries[key] = CacheEntry(answer, sources, fingerprint, latency, time.time() + self.ttl)
+        self._vectors[key] = self._normalize(embedding)
+        self._matrix = None
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)), "lru")
+        self.metrics.entries.set(len(self._entries))
+
+    def observe_hit(self, entry: CacheEntry, latency: float):
+        self.metrics.saved_latency.observe(max(entry.latency - latency, 0.0))
+
+    @staticmethod
+    async def replay(answer: str) -> AsyncIterator[bytes]:
+        """Replay a cached answer as OpenAI chat completion chunks, as an LLM stream would send them."""
+        for token in re.findall(r"\s*\S+\s*", answer, re.UNICODE):
+            chunk = {"choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+            yield f"data: {json.dumps(chunk)}\n\n".encode("utf-8")
+        chunk = {"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+        yield f"data: {json.dumps(chunk)}\n\n".encode("utf-8")
+        yield b"data: [DONE]\n\n"
+
+    async def record_stream(
+        self, body_iterator, embedding, fingerprint: str, version: int, sources: List[Dict], start: float
+    ):
+        """Pass a streamed answer through and cache it once the stream completes."""
+        chunks = []
+        async for chunk in body_iterator:
+            chunks.append(chunk.decode("utf-8") if isinstance(chunk, bytes) else chunk)
+            yield chunk
+        answer = METRICS_PATTERN.sub("", "".join(chunks)).strip()
+        self.insert(embedding, fingerprint, version, answer, sources, time.perf_counter() - start)
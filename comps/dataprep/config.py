@@ -6,6 +6,8 @@ import os
 # Embedding model
 
 EMBED_MODEL = os.getenv("EMBED_MODEL", "BAAI/bge-base-en-v1.5")
+# Encode batch of the local embedding model, larger batches keep more cores busy
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", min(128, 8 * (os.cpu_count() or 1))))
 
 # Redis Connection Information
 REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
@@ -61,6 +63,42 @@ REDIS_URL = format_redis_conn_from_env()
 INDEX_NAME = os.getenv("INDEX_NAME", "rag-redis")
 KEY_INDEX_NAME = os.getenv("KEY_INDEX_NAME", "file-keys")
 
+current_file_path = os.path.abspath(__file__)
+parent_dir = os.path.dirname(current_file_path)
+REDIS_SCHEMA = os.getenv("REDIS_SCHEMA", "redis_schema.yml")
+INDEX_SCHEMA = os.path.join(parent_dir, REDIS_SCHEMA)
+
+# Hash of chunk key -> file name, read by the retriever to resolve sources
+CHUNK_FILE_INDEX = os.getenv("CHUNK_FILE_INDEX", "chunk-file")
+# Per file hash of node content hash -> chunk keys, lets a re-upload keep its unchanged sections
+FILE_NODES_PREFIX = os.getenv("FILE_NODES_PREFIX", "file-nodes:")
+
+# Bumped on every ingest/delete so the megaservice drops cached answers of the old corpus
+RESPONSE_CACHE_VERSION_KEY = os.getenv("RESPONSE_CACHE_VERSION_KEY", "chatqna:corpus_version")
+
 TIMEOUT_SECONDS = int(os.getenv("TIMEOUT_SECONDS", 600))
 
 SEARCH_BATCH_SIZE = int(os.getenv("SEARCH_BATCH_SIZE", 10))
+
+# Ingestion pipeline: marker worker processes, threads of the chunk and table description
+# stages, and the number of documents waiting between two stages
+INGEST_PARSE_WORKERS = int(os.getenv("INGEST_PARSE_WORKERS", 2))
+# PDFs are converted in shards of this many pages, spread over the marker worker processes
+INGEST_PAGES_PER_SHARD = int(os.getenv("INGEST_PAGES_PER_SHARD", 16))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 4))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", 8))
+# Chunks embedded and written to the vector index per pipelined batch
+VECTOR_WRITE_BATCH_SIZE = int(os.getenv("VECTOR_WRITE_BATCH_SIZE", 256))
+# Uploads are streamed to disk in blocks of UPLOAD_BLOCK_SIZE bytes, larger files than UPLOAD_MAX_SIZE are rejected
+UPLOAD_BLOCK_SIZE = int(os.getenv("UPLOAD_BLOCK_SIZE", 2**20))
+UPLOAD_MAX_SIZE = int(os.getenv("UPLOAD_MAX_SIZE", 512 * 2**20))
+# Chunks unlinked per pipelined batch, files with more chunks are deleted by a background job
+DELETE_BATCH_SIZE = int(os.getenv("DELETE_BATCH_SIZE", 1000))
+DELETE_BACKGROUND_THRESHOLD = int(os.getenv("DELETE_BACKGROUND_THRESHOLD", 2000))
+
+# Table descriptions: parallel LLM requests, request timeout and lifetime of cached descriptions
+TABLE_DESCRIPTION_CONCURRENCY = int(os.getenv("TABLE_DESCRIPTION_CONCURRENCY", 8))
+TABLE_DESCRIPTION_TIMEOUT = float(os.getenv("TABLE_DESCRIPTION_TIMEOUT", 120))
+TABLE_DESCRIPTION_CACHE_TTL = int(os.getenv("TABLE_DESCRIPTION_CACHE_TTL", 30 * 86400))
+# Load the marker models in the parse workers at startup instead of on the first upload
+MARKER_PREWARM = get_boolean_env_var("MARKER_PREWARM", False)
@@ -0,0 +1,213 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Executor
+from typing import Callable, Dict, List, Tuple
+
+from comps import CustomLogger
+from comps.parsers.tree import Tree
+from comps.parsers.treeparser import TreeParser
+
+logger = CustomLogger("dataprep_pipeline")
+
+
+def parse_document(doc: dict, tree_parser: TreeParser = None) -> dict:
+    """Parse stage, marker runs in the worker processes of the page executor of tree_parser.
+
+    A document parsed before, even chunked with other settings, is loaded from the tree cache.
+    """
+    tree = Tree(doc["path"])
+    (tree_parser or TreeParser()).populate_tree(tree, doc.get("file_hash"))
+    doc["tree"] = tree
+    return doc
+
+
+class IngestJob:
+    """Progress of the files of one upload request through the ingestion stages."""
+
+    def __init__(self, file_names: List[str]):
+        self.job_id = uuid.uuid4().hex
+        self.created = time.time()
+        self.files = OrderedDict((file_name, {"stage": "queued", "error": None}) for file_name in file_names)
+
+    def update(self, file_name: str, stage: str, error: str = None):
+        self.files[file_name] = {"stage": stage, "error": error}
+
+    @property
+    def done(self) -> bool:
+        return all(state["stage"] in ("done", "failed") for state in self.files.values())
+
+    def status(self) -> dict:
+        finished = [state["stage"] for state in self.files.values() if state["stage"] in ("done", "failed")]
+        if len(finished) < len(self.files):
+            status = "running"
+        elif "failed" in finished:
+            status = "failed" if "done" not in finished else "partially_failed"
+        else:
+            status = "succeeded"
+        return {
+            "job_id": self.job_id,
+            "status": status,
+            "progress": f"{len(finished)}/{len(self.files)}",
+            "files": [{"file_name": file_name, **state} for file_name, state in self.files.items()],
+        }
+
+
+class IngestionPipeline:
+    """Staged ingestion with bounded queues between the stages.
+
+    ``stages`` is a list of ``(name, func, executor, concurrency)``. Every stage runs
+    ``func(doc) -> doc`` on its executor, or awaits it on the loop when func is a coroutine
+    function and executor is None, ``concurrency`` documents at a time, and hands the
+    document to the next stage through a queue of ``queue_size`` entries, so a slow stage
+    holds back the earlier ones instead of piling up parsed documents in memory.
+    ``on_done(doc)`` is called once a document passed the last stage, ``on_failed(doc)``
+    with the document as it entered the stage that failed.
+    """
+
+    def __init__(
+        self,
+        stages: List[Tuple[str, Callable, Executor, int]],
+        queue_size: int = 8,
+        max_jobs: int = 1024,
+        on_done: Callable = None,
+        on_failed: Callable = None,
+    ):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.max_jobs = max_jobs
+        self.on_done = on_done
+        self.on_failed = on_failed
+        self.jobs: Dict[str, IngestJob] = OrderedDict()
+        self._queues = None
+        self._workers = []
+        self._feeders = set()
+        self._reserved = set()
+        self._exclusive = False
+
+    def _start(self):
+        self._queues = [asyncio.Queue(self.queue_size) for _ in self.stages]
+        for i, (name, func, executor, concurrency) in enumerate(self.stages):
+            for _ in range(concurrency):
+                self._workers.append(asyncio.create_task(self._work(i, name, func, executor)))
+
+    async def _work(self, i: int, name: str, func: Callable, executor: Executor):
+        loop = asyncio.get_running_loop()
+        while True:
+            job, doc = await self._queues[i].get()
+            file_name = doc["file_name"]
+            job.update(file_name, name)
+            try:
+                if executor is None:
+                    doc = await func(doc)
+                else:
+                    doc = await loop.run_in_executor(executor, func, doc)
+            except Exception as e:
+                logger.error(f"[ ingest ] {name} failed for {file_name}: {e}")
+                self._notify(self.on_failed, doc)
+                job.update(file_name, "failed", f"{name}: {e}")
+                continue
+            finally:
+                self._queues[i].task_done()
+            if i + 1 < len(self.stages):
+                job.update(file_name, "queued")
+                await self._queues[i + 1].put((job, doc))
+            else:
+                self._notify(self.on_done, doc)
+                job.update(file_name, "done")
+
+    def _notify(self, callback: Callable, doc: dict):
+        if callback is None:
+            return
+        try:
+            callback(doc)
+        except Exception as e:
+            logger.error(f"[ ingest ] {callback.__name__} failed for {doc['file_name']}: {e}")
+
+    def in_flight(self, file_name: str) -> bool:
+        if self._exclusive or file_name in self._reserved:
+            return True
+        return any(
+            job.files.get(file_name, {}).get("stage") not in (None, "done", "failed") for job in self.jobs.values()
+        )
+
+    def reserve(self, file_names: List[str]) -> bool:
+        """Count file_names as in flight until release, False if any of them already is.
+
+        Checked and taken without awaiting, so of concurrent requests for a file only one
+        gets it. A request reserves its files before its first await and releases them
+        once their jobs are submitted, which keeps them in flight from then on.
+        """
+        if any(self.in_flight(file_name) for file_name in file_names):
+            return False
+        self._reserved.update(file_names)
+        return True
+
+    def release(self, file_names: List[str]):
+        self._reserved.difference_update(file_names)
+
+    def reserve_all(self) -> bool:
+        """Count every file as in flight until release_all, False while any file is in flight."""
+        if self._exclusive or self._reserved or any(not job.done for job in self.jobs.values()):
+            return False
+        self._exclusive = True
+        return True
+
+    def release_all(self):
+        self._exclusive = False
+
+    def _add_job(self, file_names: List[str]) -> IngestJob:
+        job = IngestJob(file_names)
+        self.jobs[job.job_id] = job
+        # forget the oldest finished jobs
+        finished = [job_id for job_id, old in self.jobs.items() if old.done]
+        for job_id in finished[: max(0, len(self.jobs) - self.max_jobs)]:
+            del self.jobs[job_id]
+        return job
+
+    def _background(self, coro):
+        task = asyncio.create_task(coro)
+        self._feeders.add(task)
+        task.add_done_callback(self._feeders.discard)
+
+    async def submit(self, docs: List[dict]) -> IngestJob:
+        if self._queues is None:
+            self._start()
+        job = self._add_job([doc["file_name"] for doc in docs])
+        # feed in the background, the caller only waits for the job id
+        self._background(self._feed(job, docs))
+        return job
+
+    def run_job(self, file_name: str, stage: str, func: Callable, *args) -> IngestJob:
+        """Run ``func(*args)`` in a thread in the background, tracked as a job of file_name.
+
+        The file counts as in flight until it returns, so it cannot be uploaded meanwhile.
+        """
+        job = self._add_job([file_name])
+        job.update(file_name, stage)
+        self._background(self._run_job(job, file_name, stage, func, *args))
+        return job
+
+    async def _run_job(self, job: IngestJob, file_name: str, stage: str, func: Callable, *args):
+        try:
+            await asyncio.to_thread(func, *args)
+        except Exception as e:
+            logger.error(f"[ ingest ] {stage} failed for {file_name}: {e}")
+            job.update(file_name, "failed", f"{stage}: {e}")
+            return
+        job.update(file_name, "done")
+
+    async def _feed(self, job: IngestJob, docs: List[dict]):
+        for doc in docs:
+            await self._queues[0].put((job, doc))
+
+    async def close(self):
+        for worker in self._workers:
+            worker.cancel()
+        for _, _, executor, _ in self.stages:
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
@@ -1,15 +1,45 @@
 # Copyright (C) 2024 Intel Corporation
 # SPDX-License-Identifier: Apache-2.0
 
+import asyncio
+import hashlib
 import json
 import os
+import threading
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from multiprocessing import get_context
 from pathlib import Path
-from typing import List, Optional, Union
-import requests
+from typing import Dict, List, Optional, Union
 
 # from pyspark import SparkConf, SparkContext
 import redis
-from config import EMBED_MODEL, INDEX_NAME, KEY_INDEX_NAME, REDIS_URL, SEARCH_BATCH_SIZE
+from config import (
+    CHUNK_FILE_INDEX,
+    DELETE_BACKGROUND_THRESHOLD,
+    DELETE_BATCH_SIZE,
+    EMBED_BATCH_SIZE,
+    EMBED_MODEL,
+    FILE_NODES_PREFIX,
+    INDEX_NAME,
+    INDEX_SCHEMA,
+    INGEST_PAGES_PER_SHARD,
+    INGEST_PARSE_WORKERS,
+    INGEST_QUEUE_SIZE,
+    INGEST_WORKERS,
+    KEY_INDEX_NAME,
+    MARKER_PREWARM,
+    REDIS_URL,
+    RESPONSE_CACHE_VERSION_KEY,
+    SEARCH_BATCH_SIZE,
+    TABLE_DESCRIPTION_CACHE_TTL,
+    TABLE_DESCRIPTION_CONCURRENCY,
+    TABLE_DESCRIPTION_TIMEOUT,
+    UPLOAD_BLOCK_SIZE,
+    UPLOAD_MAX_SIZE,
+    VECTOR_WRITE_BATCH_SIZE,
+)
 from fastapi import Body, File, Form, HTTPException, UploadFile
 from langchain_community.embeddings import HuggingFaceBgeEmbeddings
 from langchain_community.vectorstores import Redis
@@ -21,21 +51,24 @@ from redis.commands.search.indexDefinition import IndexDefinition, IndexType
 import os
 
 from groq import Groq
+from pipeline import IngestionPipeline, parse_document
+from table_describer import TableDescriber
+from vector_writer import BulkVectorWriter
 from utils import (
     create_upload_folder,
     document_loader,
     encode_filename,
     format_search_results,
+    get_file_hash,
     get_separators,
     get_tables_result,
     parse_html_new,
     remove_folder_with_ignore,
-    save_content_to_local_disk,
+    stage_upload,
 )
 
 from comps import CustomLogger, DocPath, opea_microservices, register_microservice
-from comps.parsers.treeparser import TreeParser
-from comps.parsers.tree import Tree
+from comps.parsers.treeparser import TreeParser, warmup_marker_models
 from comps.parsers.node import Node
 from comps.parsers.text import Text
 from comps.parsers.table import Table
@@ -47,6 +80,7 @@ logflag = os.getenv("LOGFLAG", False)
 tei_embedding_endpoint = os.getenv("TEI_ENDPOINT")
 upload_folder = "./uploaded_files/"
 redis_pool = redis.ConnectionPool.from_url(REDIS_URL)
+vector_writer = BulkVectorWriter(redis_pool, INDEX_NAME, INDEX_SCHEMA, batch_size=VECTOR_WRITE_BATCH_SIZE)
 tree_parser = TreeParser()
 
 def check_index_existance(client):
@@ -78,11 +112,12 @@ def create_index(client, index_name: str = KEY_INDEX_NAME):
     return True
 
 
-def store_by_id(client, key, value):
+def store_by_id(client, key, value, fingerprint=""):
     if logflag:
         logger.info(f"[ store by id ] storing ids of {key}")
     try:
-        client.add_document(doc_id="file:" + key, file_name=key, key_ids=value)
+        # replace the ids of a previous version of the file
+        client.add_document(doc_id="file:" + key, replace=True, file_name=key, key_ids=value, fingerprint=fingerprint)
         if logflag:
             logger.info(f"[ store by id ] store document success. id: file:{key}")
     except Exception as e:
@@ -132,39 +167,100 @@ def delete_by_id(client, id):
     return True
 
 
-def ingest_chunks_to_redis(file_name: str, chunks: List):
+def store_chunk_file_index(r, file_name: str, chunk_ids: List[str]):
     if logflag:
-        logger.info(f"[ ingest chunks ] file name: {file_name}")
-    # Create vectorstore
-    if tei_embedding_endpoint:
-        # create embeddings using TEI endpoint service
-        embedder = HuggingFaceEndpointEmbeddings(model=tei_embedding_endpoint)
-    else:
-        # create embeddings using local embedding model
-        embedder = HuggingFaceBgeEmbeddings(model_name=EMBED_MODEL)
+        logger.info(f"[ chunk file index ] indexing {len(chunk_ids)} chunks of {file_name}")
+    if chunk_ids:
+        r.hset(CHUNK_FILE_INDEX, mapping={chunk_id: file_name for chunk_id in chunk_ids})
+
+
+def delete_chunks(r, chunk_ids: List[str], batch_size: int = DELETE_BATCH_SIZE):
+    """Unlink chunks and their entries of the chunk file index, one pipelined round trip per batch."""
+    if logflag:
+        logger.info(f"[ delete chunks ] removing {len(chunk_ids)} chunks")
+    for i in range(0, len(chunk_ids), batch_size):
+        batch = chunk_ids[i : i + batch_size]
+        pipe = r.pipeline(transaction=False)
+        pipe.unlink(*batch)
+        pipe.hdel(CHUNK_FILE_INDEX, *batch)
+        pipe.execute()
+
+
+def load_node_keys(r, file_name: str) -> Dict[str, List[str]]:
+    stored = r.hgetall(FILE_NODES_PREFIX + file_name)
+    return {node.decode(): keys.decode().split("#") if keys else [] for node, keys in stored.items()}
+
+
+def store_node_keys(r, file_name: str, node_keys: Dict[str, List[str]]):
+    if logflag:
+        logger.info(f"[ node keys ] storing {len(node_keys)} nodes of {file_name}")
+    pipe = r.pipeline(transaction=True)
+    pipe.delete(FILE_NODES_PREFIX + file_name)
+    if node_keys:
+        pipe.hset(FILE_NODES_PREFIX + file_name, mapping={node: "#".join(keys) for node, keys in node_keys.items()})
+    pipe.execute()
+
+
+def bump_corpus_version(r):
+    try:
+        version = r.incr(RESPONSE_CACHE_VERSION_KEY)
+        if logflag:
+            logger.info(f"[ corpus version ] bumped to {version}")
+    except Exception as e:
+        logger.info(f"[ corpus version ] fail to bump {RESPONSE_CACHE_VERSION_KEY}: {e}")
+
+
+embedder = None
+embedder_lock = threading.Lock()
+
+
+def get_embedder():
+    """The embedder shared by every ingestion, the local model is loaded once and stays resident."""
+    global embedder
+    if embedder is None:
+        with embedder_lock:
+            if embedder is None:
+                if tei_embedding_endpoint:
+                    # create embeddings using TEI endpoint service
+                    embedder = HuggingFaceEndpointEmbeddings(model=tei_embedding_endpoint)
+                else:
+                    # create embeddings using local embedding model, encode batches sized to the CPU
+                    embedder = HuggingFaceBgeEmbeddings(
+                        model_name=EMBED_MODEL,
+                        encode_kwargs={"normalize_embeddings": True, "batch_size": EMBED_BATCH_SIZE},
+                    )
+    return embedder
+
+
+def warmup_embedder():
+    try:
+        get_embedder().embed_documents(["warmup"])
+    except Exception as e:
+        # an unreachable TEI endpoint must not keep the service from starting
+        logger.info(f"[ warmup ] fail to warm up the embedder: {e}")
+
 
-    # Batch size
+def embed_chunks(chunks: List[str]) -> List[List[float]]:
+    embedder = get_embedder()
+    if not tei_embedding_endpoint:
+        # the local model batches the texts itself, longest chunks together
+        return embedder.embed_documents(chunks) if chunks else []
+
+    # TEI rejects requests beyond its max client batch size
     batch_size = 32
     num_chunks = len(chunks)
 
-    file_ids = []
+    embeddings = []
     for i in range(0, num_chunks, batch_size):
         if logflag:
-            logger.info(f"[ ingest chunks ] Current batch: {i}")
-        batch_chunks = chunks[i : i + batch_size]
-        batch_texts = batch_chunks
-
-        _, keys = Redis.from_texts_return_keys(
-            texts=batch_texts,
-            embedding=embedder,
-            index_name=INDEX_NAME,
-            redis_url=REDIS_URL,
-        )
-        if logflag:
-            logger.info(f"[ ingest chunks ] keys: {keys}")
-        file_ids.extend(keys)
-        if logflag:
-            logger.info(f"[ ingest chunks ] Processed batch {i//batch_size + 1}/{(num_chunks-1)//batch_size + 1}")
+            logger.info(f"[ embed chunks ] Processed batch {i//batch_size + 1}/{(num_chunks-1)//batch_size + 1}")
+        embeddings.extend(embedder.embed_documents(chunks[i : i + batch_size]))
+    return embeddings
+
+
+def store_file_keys(file_name: str, file_ids: List[str], fingerprint: str = ""):
+    if logflag:
+        logger.info(f"[ store file keys ] file name: {file_name}, keys: {file_ids}")
 
     # store file_ids into index file-keys
     r = redis.Redis(connection_pool=redis_pool)
@@ -173,111 +269,26 @@ def ingest_chunks_to_redis(file_name: str, chunks: List):
         assert create_index(client)
 
     try:
-        assert store_by_id(client, key=file_name, value="#".join(file_ids))
+        assert store_by_id(client, key=file_name, value="#".join(file_ids), fingerprint=fingerprint)
+        store_chunk_file_index(r, file_name, file_ids)
     except Exception as e:
         if logflag:
-            logger.info(f"[ ingest chunks ] {e}. Fail to store chunks of file {file_name}.")
+            logger.info(f"[ store file keys ] {e}. Fail to store chunks of file {file_name}.")
         raise HTTPException(status_code=500, detail=f"Fail to store chunks of file {file_name}.")
     return True
 
-def get_table_description(item: Table):
-    server_host_ip = os.getenv("LLM_SERVER_HOST_IP", "vllm-service")
-    server_port = os.getenv("LLM_SERVER_PORT", 8000)
-    model_name = os.getenv("LLM_MODEL_ID", "meta-llama/Meta-Llama-3.1-8B-Instruct")
-    use_model_param = os.getenv("LLM_USE_MODEL_PARAM", "false").lower() == "true"
-    url = f"http://{server_host_ip}:{server_port}/v1/chat/completions"
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "text/event-stream"
-    }
-
-    data = {
-        "messages": [
-            {
-                "role": "system",
-                "content": """
-                    <s>[INST] <<SYS>>\n You are a helpful, respectful, and honest assistant. Your task is to generate a detailed and descriptive summary of the provided table data in Markdown format, based strictly on the table and its heading. <</SYS>> 
-                    [INST] Your job is to create a clear, specific, and **factual** textual description. **Do not add any external information** or provide an abstract summary. Only base the description on the data from the table and its heading.
-                    
-                    1. Link the **columns** with the corresponding **values** in the rows, referencing the exact terms and terminology from the table. 
-                    2. For each row, explain how each column's data relates to the corresponding values. Ensure the description is **step-by-step** and follows the structure of the table in a natural order.
-                    3. **Do not return the table itself.** Provide only the descriptive summary, written in **paragraphs**.
-                    4. The description should be precise, direct, and **avoid interpretation** or generalization. Stay true to the exact data given.
-                    
-                    Think carefully and make sure to describe every column and its respective values in detail. 
-                """
-            },
-            {
-                "role": "user",
-                "content": f"{item.heading}\n{item.markdown_content}",
-            }
-        ],
-        "model": model_name,
-        "stream": False
-    }
-
-    if use_model_param and model_name:
-        data["model"] = model_name
-    else:
-        data["file_name"] = ""
-
-    try:
-        response = requests.post(url, headers=headers, json=data, timeout=120)
-
-        if response.status_code != 200:
-            if logflag:
-                logger.error(f"[get_table_description] Status {response.status_code}: {response.text}")
-            return f"Table: {item.heading}\n{item.markdown_content}"
-
-        if not response.text or response.text.strip() == "":
-            if logflag:
-                logger.error("[get_table_description] Empty response")
-            return f"Table: {item.heading}\n{item.markdown_content}"
-
-        try:
-            response_data = json.loads(response.text)
-        except json.JSONDecodeError as e:
-            if logflag:
-                logger.error(f"[get_table_description] JSON parse error: {e}")
-            return f"Table: {item.heading}\n{item.markdown_content}"
 
-        if "choices" not in response_data or not response_data["choices"]:
-            if logflag:
-                logger.error("[get_table_description] Missing 'choices' in response")
-            return f"Table: {item.heading}\n{item.markdown_content}"
-
-        if "message" not in response_data["choices"][0]:
-            if logflag:
-                logger.error("[get_table_description] Missing 'message' in response")
-            return f"Table: {item.heading}\n{item.markdown_content}"
-
-        if "content" not in response_data["choices"][0]["message"]:
-            if logflag:
-                logger.error("[get_table_description] Missing 'content' in response")
-            return f"Table: {item.heading}\n{item.markdown_content}"
-        
-        content = response_data['choices'][0]['message']['content']
-        
-        if logflag:
-            logger.info("[get_table_description] Successfully generated description")
-        
-        return content
-        
-    except requests.exceptions.Timeout:
-        if logflag:
-            logger.error(f"[get_table_description] Request timeout for {url}")
-        return f"Table: {item.heading}\n{item.markdown_content}"
-    except requests.exceptions.ConnectionError as e:
-        if logflag:
-            logger.error(f"[get_table_description] Connection error: {e}")
-        return f"Table: {item.heading}\n{item.markdown_content}"
-    except Exception as e:
-        if logflag:
-            logger.error(f"[get_table_description] Unexpected error: {e}")
-        return f"Table: {item.heading}\n{item.markdown_content}"
+def get_text_splitter(chunk_size: int, chunk_overlap: int) -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        add_start_index=True,
+        separators=get_separators(),
+    )
 
 
 def chunk_node_content(node: Node, text_splitter: RecursiveCharacterTextSplitter):
+    """Split the text of node, tables are kept whole until their description is generated."""
     content = node.get_content()
     chunks = []
     for item in content:
@@ -285,55 +296,228 @@ def chunk_node_content(node: Node, text_splitter: RecursiveCharacterTextSplitter
             text_chunks = text_splitter.split_text(item.content)
             chunks.extend(text_chunks)
         if isinstance(item, Table):
-            table_description = get_table_description(item)
-            table_description_chunks = text_splitter.split_text(table_description)
-            chunks.extend(table_description_chunks)
+            chunks.append(item)
     return chunks
 
-def create_chunks(node: Node, text_splitter: RecursiveCharacterTextSplitter):
-    node_chunks = chunk_node_content(node, text_splitter)
-    total = node.get_length_children()
-    for i in range(total):
-        node_chunks.extend(create_chunks(node.get_child(i), text_splitter))
-    return node_chunks
+def hash_node(node: Node, salt: str) -> str:
+    """Hash of the own content of node, which is all its chunk texts are made of.
+
+    The heading path and the page are left out, so renaming a parent section or shifting the
+    pagination does not change the hash of every section after it, they are metadata updated
+    in place on the chunks that are reused.
+    """
+    digest = hashlib.sha256(salt.encode("utf-8"))
+    for item in node.get_content():
+        if isinstance(item, Text):
+            digest.update(f"\0text\0{item.content}".encode("utf-8"))
+        if isinstance(item, Table):
+            digest.update(f"\0table\0{item.heading}\0{item.markdown_content}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def iter_nodes(root: Node, heading_pages: dict, salt: str = ""):
+    """Yield (node hash, node, metadata) for the nodes of the tree in document order.
+
+    The metadata holds the heading path from the root and the page the enclosing section
+    starts on, sections missing from the document outline inherit the page of their parent.
+    The node hash covers the content of the node, salted with the chunking settings, and is
+    made unique within the document, so a re-ingestion can reuse the chunks of every node
+    whose hash it already knows. The tree is walked with a stack, deep documents do not hit the recursion limit.
+    """
+    seen = Counter()
+    stack = [(root, (), 0)]
+    while stack:
+        node, heading_path, page = stack.pop()
+        if node.get_level() != '0':
+            heading_path = heading_path + (node.get_heading(),)
+            page = heading_pages.get(tree_parser.normalize_heading(node.get_heading()), page)
+        metadata = {"heading_path": " > ".join(heading_path), "page": page}
+        node_hash = hash_node(node, salt)
+        seen[node_hash] += 1
+        if seen[node_hash] > 1:
+            node_hash = f"{node_hash}:{seen[node_hash]}"
+        yield node_hash, node, metadata
+        total = node.get_length_children()
+        stack.extend((node.get_child(i), heading_path, page) for i in reversed(range(total)))
+
+
+# Ingestion stages, each takes and returns the dict describing one document
+
+def chunk_document(doc: dict) -> dict:
+    """Chunk the document and leave out the nodes the previous version of the file already holds."""
+    tree = doc.pop("tree")
+    text_splitter = get_text_splitter(doc["chunk_size"], doc["chunk_overlap"])
+    salt = f"{doc['chunk_size']}:{doc['chunk_overlap']}"
 
-def ingest_data_to_redis(doc_path: DocPath):
-    """Ingest document to Redis."""
-    path = doc_path.path
+    r = redis.Redis(connection_pool=redis_pool)
+    previous = search_by_id(r.ft(KEY_INDEX_NAME), "file:" + doc["file_name"])
+    key_ids = getattr(previous, "key_ids", "")
+    doc["previous_ids"] = key_ids.split("#") if key_ids else []
+    known = load_node_keys(r, doc["file_name"])
+
+    # only the nodes the previous version does not hold are split
+    doc["nodes"], doc["reused"], doc["reused_metadata"], doc["chunks"] = [], {}, {}, []
+    for node_hash, node, metadata in iter_nodes(tree.rootNode, tree_parser.get_heading_pages(tree), salt):
+        if node_hash in known:
+            doc["nodes"].append(node_hash)
+            doc["reused"][node_hash] = known[node_hash]
+            doc["reused_metadata"][node_hash] = metadata
+            continue
+        chunks = [(node_hash, chunk, metadata) for chunk in chunk_node_content(node, text_splitter)]
+        if chunks:
+            doc["nodes"].append(node_hash)
+            doc["chunks"].extend(chunks)
     if logflag:
-        logger.info(f"[ ingest data ] Parsing document {path}.")
+        logger.info(
+            f"[ chunk ] {doc['file_name']}: {len(doc['nodes']) - len(doc['reused'])}/{len(doc['nodes'])} nodes changed"
+        )
+    return doc
+
 
-    text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=doc_path.chunk_size,
-            chunk_overlap=doc_path.chunk_overlap,
-            add_start_index=True,
-            separators=get_separators(),
+async def describe_tables(doc: dict) -> dict:
+    text_splitter = get_text_splitter(doc["chunk_size"], doc["chunk_overlap"])
+    # describe all the tables of the document at once, then merge them back in document order
+    tables = [chunk for _, chunk, _ in doc["chunks"] if isinstance(chunk, Table)]
+    table_descriptions = iter(await table_describer.describe(tables))
+    chunks = []
+    for node, chunk, metadata in doc["chunks"]:
+        if isinstance(chunk, Table):
+            chunks.extend((node, text, metadata) for text in text_splitter.split_text(next(table_descriptions)))
+        else:
+            chunks.append((node, chunk, metadata))
+    doc["chunks"] = chunks
+    return doc
+
+
+def embed_document(doc: dict) -> dict:
+    """Embed the chunks of the changed nodes and write them to the vector index, batch by batch."""
+    file_name = doc["file_name"]
+    new_chunks = {}
+    for node, chunk, metadata in doc["chunks"]:
+        new_chunks.setdefault(node, []).append((chunk, metadata))
+
+    # number the chunks in document order, across reused and new nodes, the reused chunks get
+    # their new index, heading path and page
+    chunks, metadatas, doc["reindexed"] = [], [], {}
+    for node in doc["nodes"]:
+        if node in doc["reused"]:
+            for key in doc["reused"][node]:
+                doc["reindexed"][key] = {
+                    "chunk_index": len(chunks) + len(doc["reindexed"]),
+                    **doc["reused_metadata"][node],
+                }
+            continue
+        for chunk, metadata in new_chunks.get(node, []):
+            metadatas.append({"file_name": file_name, "chunk_index": len(chunks) + len(doc["reindexed"]), **metadata})
+            chunks.append(chunk)
+
+    keys = iter(vector_writer.ingest(chunks, metadatas, embed_chunks))
+    doc["node_keys"] = {
+        node: doc["reused"][node] if node in doc["reused"] else [next(keys) for _ in new_chunks.get(node, [])]
+        for node in doc["nodes"]
+    }
+    return doc
+
+
+def write_document(doc: dict) -> dict:
+    """Point the file to its new chunks, then drop the chunks of the nodes that changed or disappeared."""
+    file_name = doc["file_name"]
+    file_ids = [key for keys in doc["node_keys"].values() for key in keys]
+    r = redis.Redis(connection_pool=redis_pool)
+    store_file_keys(file_name, file_ids, doc["fingerprint"])
+    store_node_keys(r, file_name, doc["node_keys"])
+
+    pipe = r.pipeline(transaction=False)
+    for key, metadata in doc["reindexed"].items():
+        pipe.hset(key, mapping=metadata)
+    pipe.execute()
+    kept = set(file_ids)
+    stale_ids = [key for key in doc["previous_ids"] if key not in kept]
+    delete_chunks(r, stale_ids)
+
+    bump_corpus_version(r)
+    if logflag:
+        logger.info(
+            f"[ ingest ] Successfully ingested file {doc['path']}, "
+            f"{len(file_ids) - len(doc['reindexed'])} new and {len(stale_ids)} stale chunks"
         )
+    return doc
 
 
-    ## TODO: call our custom pdf parser
-    ## content
-    tree = Tree(path)
-    tree_parser = TreeParser()
-    tree_parser.populate_tree(tree)
-    chunks = create_chunks(tree.rootNode, text_splitter)
+def get_fingerprint(file_hash: str, chunk_size: int, chunk_overlap: int) -> str:
+    """Identifies an ingested version of a file, the same content chunked differently is another version."""
+    return f"{file_hash}:{chunk_size}:{chunk_overlap}"
 
 
-    
+def new_document(doc_path: DocPath, file_hash: Optional[str] = None) -> dict:
+    file_hash = file_hash or get_file_hash(doc_path.path)
+    return {
+        "path": doc_path.path,
+        "file_name": doc_path.path.split("/")[-1],
+        "file_hash": file_hash,
+        "fingerprint": get_fingerprint(file_hash, doc_path.chunk_size, doc_path.chunk_overlap),
+        "chunk_size": doc_path.chunk_size,
+        "chunk_overlap": doc_path.chunk_overlap,
+    }
+
+
+def keep_previous_copy(path: str) -> Optional[str]:
+    """Move the current copy of path aside, returning where, None when there is none."""
+    if not os.path.exists(path):
+        return None
+    previous_path = path + ".previous"
+    os.replace(path, previous_path)
+    return previous_path
+
+
+def ingest_succeeded(doc: dict):
+    if doc.get("previous_path"):
+        os.remove(doc["previous_path"])
+
+
+def ingest_failed(doc: dict):
+    """The index still holds the previous version of a file whose ingestion failed, put its copy back."""
+    if doc.get("previous_path"):
+        os.replace(doc["previous_path"], doc["path"])
+
+
+# marker is CPU bound, convert in worker processes. They are forked, like torch DataLoader
+# workers, as a spawned child would re-run this script and re-register the service port.
+# Each worker keeps its marker models loaded, optionally from the moment it starts, and
+# converts page ranges of any document, so one long PDF keeps all of them busy.
+parse_executor = ProcessPoolExecutor(
+    INGEST_PARSE_WORKERS, get_context("fork"), initializer=warmup_marker_models if MARKER_PREWARM else None
+)
+sharded_tree_parser = TreeParser(page_executor=parse_executor, pages_per_shard=INGEST_PAGES_PER_SHARD)
 
 
+async def close_parse_executor():
+    parse_executor.shutdown(wait=False, cancel_futures=True)
 
-    ### Specially processing for the table content in PDFs
-    ## TODO: use our custom table parser
-    # if doc_path.process_table and path.endswith(".pdf"):
-    #     table_chunks = get_tables_result(path, doc_path.table_strategy)
-    #     chunks = chunks + table_chunks
-    # if logflag:
-    #     logger.info(f"[ ingest data ] Done preprocessing. Created {len(chunks)} chunks of the given file.")
 
-    file_name = doc_path.path.split("/")[-1]
-    # print(chunks)
-    return ingest_chunks_to_redis(file_name, chunks)
+table_describer = TableDescriber(
+    REDIS_URL,
+    concurrency=TABLE_DESCRIPTION_CONCURRENCY,
+    timeout=TABLE_DESCRIPTION_TIMEOUT,
+    cache_ttl=TABLE_DESCRIPTION_CACHE_TTL,
+)
+ingest_pipeline = IngestionPipeline(
+    [
+        (
+            "parse",
+            partial(parse_document, tree_parser=sharded_tree_parser),
+            ThreadPoolExecutor(INGEST_PARSE_WORKERS),
+            INGEST_PARSE_WORKERS,
+        ),
+        ("chunk", chunk_document, ThreadPoolExecutor(INGEST_WORKERS), INGEST_WORKERS),
+        ("describe", describe_tables, None, INGEST_WORKERS),
+        ("embed", embed_document, ThreadPoolExecutor(1), 1),
+        ("write", write_document, ThreadPoolExecutor(1), 1),
+    ],
+    queue_size=INGEST_QUEUE_SIZE,
+    on_done=ingest_succeeded,
+    on_failed=ingest_failed,
+)
 
 
 @register_microservice(name="opea_service@prepare_doc_redis", endpoint="/v1/dataprep", host="0.0.0.0", port=6007)
@@ -356,88 +540,89 @@ async def ingest_documents(
         if not isinstance(files, list):
             files = [files]
         uploaded_files = []
-
-        for file in files:
-            encode_file = encode_filename(file.filename)
-            doc_id = "file:" + encode_file
-            if logflag:
-                logger.info(f"[ upload ] processing file {doc_id}")
-
-            # check whether the file already exists
-            key_ids = None
-            try:
-                key_ids = search_by_id(client, doc_id).key_ids
+        unchanged_files = []
+
+        if len({file.filename for file in files}) < len(files):
+            raise HTTPException(status_code=400, detail="Uploaded files must have distinct names.")
+        # reserved before the first await, so a concurrent request cannot write the same files
+        encode_files = [encode_filename(file.filename) for file in files]
+        if not ingest_pipeline.reserve(encode_files):
+            busy = [file.filename for file, name in zip(files, encode_files) if ingest_pipeline.in_flight(name)]
+            raise HTTPException(
+                status_code=400, detail=f"Uploaded files {busy} are being ingested or deleted. Please retry later."
+            )
+        staged = []
+        try:
+            docs = []
+            for file, encode_file in zip(files, encode_files):
+                doc_id = "file:" + encode_file
                 if logflag:
-                    logger.info(f"[ upload ] File {file.filename} already exists.")
-            except Exception as e:
-                logger.info(f"[ upload ] File {file.filename} does not exist.")
-            if key_ids:
-                raise HTTPException(
-                    status_code=400, detail=f"Uploaded file {file.filename} already exists. Please change file name."
-                )
-
-            save_path = upload_folder + encode_file
-            await save_content_to_local_disk(save_path, file)
-            ingest_data_to_redis(
-                DocPath(
-                    path=save_path,
-                    chunk_size=chunk_size,
-                    chunk_overlap=chunk_overlap,
-                    process_table=process_table,
-                    table_strategy=table_strategy,
+                    logger.info(f"[ upload ] processing file {doc_id}")
+
+                # a file that already exists is updated, only its changed sections are ingested again
+                previous = getattr(search_by_id(client, doc_id), "fingerprint", None)
+
+                save_path = upload_folder + encode_file
+                part_path, file_hash = await stage_upload(save_path, file, UPLOAD_MAX_SIZE, UPLOAD_BLOCK_SIZE)
+                fingerprint = get_fingerprint(file_hash, chunk_size, chunk_overlap)
+                if fingerprint == previous:
+                    if logflag:
+                        logger.info(f"[ upload ] File {file.filename} is unchanged.")
+                    os.remove(part_path)
+                    unchanged_files.append(file.filename)
+                    continue
+                staged.append(part_path)
+                docs.append(
+                    new_document(
+                        DocPath(
+                            path=save_path,
+                            chunk_size=chunk_size,
+                            chunk_overlap=chunk_overlap,
+                            process_table=process_table,
+                            table_strategy=table_strategy,
+                        ),
+                        file_hash,
+                    )
                 )
-            )
-            uploaded_files.append(save_path)
-            if logflag:
-                logger.info(f"[ upload ] Successfully saved file {save_path}")
-
-        result = {"status": 200, "message": "Data preparation succeeded"}
+                uploaded_files.append(save_path)
+                if logflag:
+                    logger.info(f"[ upload ] Successfully saved file {save_path}")
+
+            # the files replace their copies on disk only once the whole request is received,
+            # the previous copy is kept until the new one is ingested
+            for doc, part_path in zip(docs, staged):
+                doc["previous_path"] = keep_previous_copy(doc["path"])
+                os.replace(part_path, doc["path"])
+            staged = []
+            if docs:
+                # the submitted files stay in flight through their job
+                job = await ingest_pipeline.submit(docs)
+                result = {"status": 200, "message": "Data preparation started", "job_id": job.job_id}
+            else:
+                result = {"status": 200, "message": "Uploaded files are unchanged", "job_id": None}
+        finally:
+            for part_path in staged:
+                os.remove(part_path)
+            ingest_pipeline.release(encode_files)
+        result["unchanged_files"] = unchanged_files
         if logflag:
             logger.info(result)
         return result
 
-    # if link_list:
-    #     link_list = json.loads(link_list)  # Parse JSON string to list
-    #     if not isinstance(link_list, list):
-    #         raise HTTPException(status_code=400, detail=f"Link_list {link_list} should be a list.")
-    #     for link in link_list:
-    #         encoded_link = encode_filename(link)
-    #         doc_id = "file:" + encoded_link + ".txt"
-    #         if logflag:
-    #             logger.info(f"[ upload ] processing link {doc_id}")
-
-    #         # check whether the link file already exists
-    #         key_ids = None
-    #         try:
-    #             key_ids = search_by_id(client, doc_id).key_ids
-    #             if logflag:
-    #                 logger.info(f"[ upload ] Link {link} already exists.")
-    #         except Exception as e:
-    #             logger.info(f"[ upload ] Link {link} does not exist. Keep storing.")
-    #         if key_ids:
-    #             raise HTTPException(
-    #                 status_code=400, detail=f"Uploaded link {link} already exists. Please change another link."
-    #             )
-
-    #         save_path = upload_folder + encoded_link + ".txt"
-    #         content = parse_html_new([link], chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-    #         await save_content_to_local_disk(save_path, content)
-    #         ingest_data_to_redis(
-    #             DocPath(
-    #                 path=save_path,
-    #                 chunk_size=chunk_size,
-    #                 chunk_overlap=chunk_overlap,
-    #                 process_table=process_table,
-    #                 table_strategy=table_strategy,
-    #             )
-    #         )
-    #     if logflag:
-    #         logger.info(f"[ upload ] Successfully saved link list {link_list}")
-    #     return {"status": 200, "message": "Data preparation succeeded"}
-
     raise HTTPException(status_code=400, detail="Must provide either a file or a string list.")
 
 
+@register_microservice(
+    name="opea_service@prepare_doc_redis", endpoint="/v1/dataprep/get_job", host="0.0.0.0", port=6007
+)
+async def get_ingest_job(job_id: str = Body(..., embed=True)):
+    """Progress of an ingestion job, per file the stage it is in or the error it failed with."""
+    job = ingest_pipeline.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found.")
+    return job.status()
+
+
 @register_microservice(
     name="opea_service@prepare_doc_redis", endpoint="/v1/dataprep/get_file", host="0.0.0.0", port=6007
 )
@@ -472,129 +657,161 @@ async def rag_get_file_structure():
     return file_list
 
 
-@register_microservice(
-    name="opea_service@prepare_doc_redis", endpoint="/v1/dataprep/delete_file", host="0.0.0.0", port=6007
-)
-async def delete_single_file(file_path: str = Body(..., embed=True)):
-    """Delete file according to `file_path`.
-
-    `file_path`:
-        - specific file path (e.g. /path/to/file.txt)
-        - "all": delete all files uploaded
-    """
+def delete_all_files():
+    """Drop both indexes with their documents and empty the upload folder, blocking, run in a thread."""
+    if logflag:
+        logger.info("[ delete ] delete all files")
 
     # define redis client
     r = redis.Redis(connection_pool=redis_pool)
     client = r.ft(KEY_INDEX_NAME)
     client2 = r.ft(INDEX_NAME)
 
-    # delete all uploaded files
-    if file_path == "all":
-        if logflag:
-            logger.info("[ delete ] delete all files")
-
-        # drop index KEY_INDEX_NAME
-        if check_index_existance(client):
-            try:
-                assert drop_index(index_name=KEY_INDEX_NAME)
-            except Exception as e:
-                if logflag:
-                    logger.info(f"[ delete ] {e}. Fail to drop index {KEY_INDEX_NAME}.")
-                raise HTTPException(status_code=500, detail=f"Fail to drop index {KEY_INDEX_NAME}.")
-        else:
-            logger.info(f"[ delete ] Index {KEY_INDEX_NAME} does not exits.")
-
-        # drop index INDEX_NAME
-        if check_index_existance(client2):
-            try:
-                assert drop_index(index_name=INDEX_NAME)
-            except Exception as e:
-                if logflag:
-                    logger.info(f"[ delete ] {e}. Fail to drop index {INDEX_NAME}.")
-                raise HTTPException(status_code=500, detail=f"Fail to drop index {INDEX_NAME}.")
-        else:
+    # drop index KEY_INDEX_NAME
+    if check_index_existance(client):
+        try:
+            assert drop_index(index_name=KEY_INDEX_NAME)
+        except Exception as e:
             if logflag:
-                logger.info(f"[ delete ] Index {INDEX_NAME} does not exits.")
+                logger.info(f"[ delete ] {e}. Fail to drop index {KEY_INDEX_NAME}.")
+            raise HTTPException(status_code=500, detail=f"Fail to drop index {KEY_INDEX_NAME}.")
+    else:
+        logger.info(f"[ delete ] Index {KEY_INDEX_NAME} does not exits.")
 
-        # delete files on local disk
+    node_keys = list(r.scan_iter(match=FILE_NODES_PREFIX + "*", count=DELETE_BATCH_SIZE))
+    r.unlink(CHUNK_FILE_INDEX, *node_keys)
+
+    # drop index INDEX_NAME
+    if check_index_existance(client2):
         try:
-            remove_folder_with_ignore(upload_folder)
+            assert drop_index(index_name=INDEX_NAME)
+            vector_writer.index_dropped()
         except Exception as e:
             if logflag:
-                logger.info(f"[ delete ] {e}. Fail to delete {upload_folder}.")
-            raise HTTPException(status_code=500, detail=f"Fail to delete {upload_folder}.")
-
+                logger.info(f"[ delete ] {e}. Fail to drop index {INDEX_NAME}.")
+            raise HTTPException(status_code=500, detail=f"Fail to drop index {INDEX_NAME}.")
+    else:
         if logflag:
-            logger.info("[ delete ] successfully delete all files.")
-        create_upload_folder(upload_folder)
+            logger.info(f"[ delete ] Index {INDEX_NAME} does not exits.")
+
+    # delete files on local disk
+    try:
+        remove_folder_with_ignore(upload_folder)
+    except Exception as e:
         if logflag:
-            logger.info({"status": True})
-        return {"status": True}
+            logger.info(f"[ delete ] {e}. Fail to delete {upload_folder}.")
+        raise HTTPException(status_code=500, detail=f"Fail to delete {upload_folder}.")
 
-    delete_path = Path(upload_folder + "/" + encode_filename(file_path))
     if logflag:
-        logger.info(f"[ delete ] delete_path: {delete_path}")
+        logger.info("[ delete ] successfully delete all files.")
+    bump_corpus_version(r)
+    create_upload_folder(upload_folder)
+    if logflag:
+        logger.info({"status": True})
+    return {"status": True}
 
-    # partially delete files
-    doc_id = "file:" + encode_filename(file_path)
-    logger.info(f"[ delete ] doc id: {doc_id}")
 
-    # determine whether this file exists in db KEY_INDEX_NAME
-    try:
-        key_ids = search_by_id(client, doc_id).key_ids
-    except Exception as e:
-        if logflag:
-            logger.info(f"[ delete ] {e}, File {file_path} does not exists.")
-        raise HTTPException(status_code=404, detail=f"File not found in db {KEY_INDEX_NAME}. Please check file_path.")
-    file_ids = key_ids.split("#")
+@register_microservice(
+    name="opea_service@prepare_doc_redis", endpoint="/v1/dataprep/delete_file", host="0.0.0.0", port=6007
+)
+async def delete_single_file(file_path: str = Body(..., embed=True)):
+    """Delete file according to `file_path`.
+
+    `file_path`:
+        - specific file path (e.g. /path/to/file.txt)
+        - "all": delete all files uploaded
+
+    The chunks of files larger than DELETE_BACKGROUND_THRESHOLD chunks are deleted by a
+    background job, the response then carries its `job_id`.
+    """
 
-    # delete file keys id in db KEY_INDEX_NAME
+    # delete all uploaded files, never under ingest jobs still writing them
+    if file_path == "all":
+        if not ingest_pipeline.reserve_all():
+            raise HTTPException(status_code=400, detail="Files are being ingested or deleted. Please retry later.")
+        try:
+            return await asyncio.to_thread(delete_all_files)
+        finally:
+            ingest_pipeline.release_all()
+
+    # define redis client
+    r = redis.Redis(connection_pool=redis_pool)
+    client = r.ft(KEY_INDEX_NAME)
+
+    encode_file = encode_filename(file_path)
+    delete_path = Path(upload_folder + "/" + encode_file)
+    if logflag:
+        logger.info(f"[ delete ] delete_path: {delete_path}")
+    # reserved before the first await, so the file cannot be uploaded while it is deleted
+    if not ingest_pipeline.reserve([encode_file]):
+        raise HTTPException(status_code=400, detail=f"File {file_path} is being ingested or deleted. Please retry later.")
     try:
-        assert delete_by_id(client, doc_id)
-    except Exception as e:
-        if logflag:
-            logger.info(f"[ delete ] {e}. File {file_path} delete failed for db {KEY_INDEX_NAME}.")
-        raise HTTPException(status_code=500, detail=f"File {file_path} delete failed for key index.")
+        # partially delete files
+        doc_id = "file:" + encode_file
+        logger.info(f"[ delete ] doc id: {doc_id}")
 
-    # delete file content in db INDEX_NAME
-    for file_id in file_ids:
-        # determine whether this file exists in db INDEX_NAME
+        # determine whether this file exists in db KEY_INDEX_NAME
         try:
-            search_by_id(client2, file_id)
+            key_ids = search_by_id(client, doc_id).key_ids
         except Exception as e:
             if logflag:
-                logger.info(f"[ delete ] {e}. File {file_path} does not exists.")
-            raise HTTPException(status_code=404, detail=f"File not found in db {INDEX_NAME}. Please check file_path.")
+                logger.info(f"[ delete ] {e}, File {file_path} does not exists.")
+            raise HTTPException(
+                status_code=404, detail=f"File not found in db {KEY_INDEX_NAME}. Please check file_path."
+            )
+        file_ids = key_ids.split("#") if key_ids else []
 
-        # delete file content
+        # delete file keys id in db KEY_INDEX_NAME
         try:
-            assert delete_by_id(client2, file_id)
+            assert delete_by_id(client, doc_id)
         except Exception as e:
             if logflag:
-                logger.info(f"[ delete ] {e}. File {file_path} delete failed for db {INDEX_NAME}")
-            raise HTTPException(status_code=500, detail=f"File {file_path} delete failed for index.")
+                logger.info(f"[ delete ] {e}. File {file_path} delete failed for db {KEY_INDEX_NAME}.")
+            raise HTTPException(status_code=500, detail=f"File {file_path} delete failed for key index.")
+
+        # delete file content in db INDEX_NAME, in the background for large files
+        def delete_file_content():
+            delete_chunks(r, file_ids)
+            r.delete(FILE_NODES_PREFIX + encode_file)
+            bump_corpus_version(r)
+
+        if len(file_ids) > DELETE_BACKGROUND_THRESHOLD:
+            job = ingest_pipeline.run_job(encode_file, "delete", delete_file_content)
+            result = {"status": True, "job_id": job.job_id}
+        else:
+            await asyncio.to_thread(delete_file_content)
+            result = {"status": True}
 
-    # local file does not exist (restarted docker container)
-    if not delete_path.exists():
-        if logflag:
-            logger.info(f"[ delete ] File {file_path} not saved locally.")
-        return {"status": True}
+        # local file does not exist (restarted docker container)
+        if not delete_path.exists():
+            if logflag:
+                logger.info(f"[ delete ] File {file_path} not saved locally.")
+            return result
 
-    # delete local file
-    if delete_path.is_file():
-        # delete file on local disk
-        delete_path.unlink()
-        if logflag:
-            logger.info(f"[ delete ] File {file_path} deleted successfully.")
-        return {"status": True}
+        # delete local file
+        if delete_path.is_file():
+            # delete file on local disk
+            delete_path.unlink()
+            if logflag:
+                logger.info(f"[ delete ] File {file_path} deleted successfully.")
+            return result
 
-    # delete folder
-    else:
-        if logflag:
-            logger.info(f"[ delete ] Delete folder {file_path} is not supported for now.")
-        raise HTTPException(status_code=404, detail=f"Delete folder {file_path} is not supported for now.")
+        # delete folder
+        else:
+            if logflag:
+                logger.info(f"[ delete ] Delete folder {file_path} is not supported for now.")
+            raise HTTPException(status_code=404, detail=f"Delete folder {file_path} is not supported for now.")
+    finally:
+        ingest_pipeline.release([encode_file])
 
 
 if __name__ == "__main__":
     create_upload_folder(upload_folder)
+    # the first task starts all the parse workers, fork them before this process loads torch
+    # models, their initializer loads the marker models when MARKER_PREWARM is set
+    parse_executor.submit(os.getpid).result()
+    warmup_embedder()
+    opea_microservices["opea_service@prepare_doc_redis"].add_shutdown_event(ingest_pipeline.close)
+    opea_microservices["opea_service@prepare_doc_redis"].add_shutdown_event(close_parse_executor)
+    opea_microservices["opea_service@prepare_doc_redis"].add_shutdown_event(table_describer.close)
     opea_microservices["opea_service@prepare_doc_redis"].start()
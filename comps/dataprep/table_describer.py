@@ -0,0 +1,155 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import asyncio
+import hashlib
+import json
+import os
+from typing import List, Optional
+
+import aiohttp
+import redis.asyncio
+
+from comps import CustomLogger
+from comps.parsers.table import Table
+
+logger = CustomLogger("table_describer")
+logflag = os.getenv("LOGFLAG", False)
+
+SYSTEM_PROMPT = """
+                    <s>[INST] <<SYS>>\n You are a helpful, respectful, and honest assistant. Your task is to generate a detailed and descriptive summary of the provided table data in Markdown format, based strictly on the table and its heading. <</SYS>> 
+                    [INST] Your job is to create a clear, specific, and **factual** textual description. **Do not add any external information** or provide an abstract summary. Only base the description on the data from the table and its heading.
+                    
+                    1. Link the **columns** with the corresponding **values** in the rows, referencing the exact terms and terminology from the table. 
+                    2. For each row, explain how each column's data relates to the corresponding values. Ensure the description is **step-by-step** and follows the structure of the table in a natural order.
+                    3. **Do not return the table itself.** Provide only the descriptive summary, written in **paragraphs**.
+                    4. The description should be precise, direct, and **avoid interpretation** or generalization. Stay true to the exact data given.
+                    
+                    Think carefully and make sure to describe every column and its respective values in detail. 
+                """
+
+
+def fallback_description(item: Table) -> str:
+    return f"Table: {item.heading}\n{item.markdown_content}"
+
+
+class TableDescriber:
+    """Generate table descriptions with the LLM, ``concurrency`` requests at a time.
+
+    Descriptions are cached in Redis under a hash of the model and the table content, so
+    tables seen before, in this document or an earlier ingestion, never reach the LLM again.
+    Failed requests fall back to the raw table and are not cached.
+    """
+
+    def __init__(
+        self,
+        redis_url: Optional[str] = None,
+        concurrency: int = 8,
+        timeout: float = 120,
+        cache_ttl: int = 30 * 86400,
+        key_prefix: str = "table-description:",
+    ):
+        server_host_ip = os.getenv("LLM_SERVER_HOST_IP", "vllm-service")
+        server_port = os.getenv("LLM_SERVER_PORT", 8000)
+        self.url = f"http://{server_host_ip}:{server_port}/v1/chat/completions"
+        self.model_name = os.getenv("LLM_MODEL_ID", "meta-llama/Meta-Llama-3.1-8B-Instruct")
+        self.use_model_param = os.getenv("LLM_USE_MODEL_PARAM", "false").lower() == "true"
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.key_prefix = key_prefix
+        self.redis_url = redis_url
+        # the session and the Redis client belong to the loop that created them
+        self._clients = {}
+
+    def key(self, item: Table) -> str:
+        digest = hashlib.sha256(f"{self.model_name}\0{item.heading}\0{item.markdown_content}".encode("utf-8"))
+        return self.key_prefix + digest.hexdigest()
+
+    def _get_clients(self):
+        loop = asyncio.get_running_loop()
+        if loop not in self._clients:
+            session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.concurrency),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+            cache = redis.asyncio.Redis.from_url(self.redis_url) if self.redis_url else None
+            self._clients[loop] = (session, cache)
+        return self._clients[loop]
+
+    async def close(self):
+        session, cache = self._clients.pop(asyncio.get_running_loop(), (None, None))
+        if session is not None:
+            await session.close()
+        if cache is not None:
+            await cache.aclose()
+
+    def _request(self, item: Table) -> dict:
+        data = {
+            "messages": [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": f"{item.heading}\n{item.markdown_content}"},
+            ],
+            "model": self.model_name,
+            "stream": False,
+        }
+        if not self.use_model_param or not self.model_name:
+            data["file_name"] = ""
+        return data
+
+    async def _generate(self, session: aiohttp.ClientSession, item: Table) -> Optional[str]:
+        headers = {"Content-Type": "application/json", "Accept": "text/event-stream"}
+        try:
+            async with session.post(self.url, headers=headers, json=self._request(item)) as response:
+                text = await response.text()
+                if response.status != 200:
+                    logger.error(f"[ describe tables ] Status {response.status}: {text}")
+                    return None
+            content = json.loads(text)["choices"][0]["message"]["content"]
+        except asyncio.TimeoutError:
+            logger.error(f"[ describe tables ] Request timeout for {self.url}")
+            return None
+        except aiohttp.ClientError as e:
+            logger.error(f"[ describe tables ] Connection error: {e}")
+            return None
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            logger.error(f"[ describe tables ] Malformed response: {e}")
+            return None
+        return content or None
+
+    async def describe(self, tables: List[Table]) -> List[str]:
+        """Descriptions of tables, in the same order."""
+        if not tables:
+            return []
+        session, cache = self._get_clients()
+        keys = [self.key(item) for item in tables]
+        unique = dict(zip(keys, tables))
+
+        descriptions = {}
+        if cache is not None:
+            try:
+                cached = await cache.mget(list(unique))
+                descriptions = {key: value.decode("utf-8") for key, value in zip(unique, cached) if value}
+            except Exception as e:
+                logger.error(f"[ describe tables ] Fail to read the description cache: {e}")
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def generate(key: str, item: Table):
+            async with semaphore:
+                description = await self._generate(session, item)
+            if description is None:
+                return fallback_description(item)
+            if cache is not None:
+                try:
+                    await cache.set(key, description, ex=self.cache_ttl)
+                except Exception as e:
+                    logger.error(f"[ describe tables ] Fail to write the description cache: {e}")
+            return description
+
+        missing = [key for key in unique if key not in descriptions]
+        if logflag:
+            logger.info(f"[ describe tables ] {len(tables)} tables, {len(unique) - len(missing)} cached")
+        for key, description in zip(missing, await asyncio.gather(*(generate(key, unique[key]) for key in missing))):
+            descriptions[key] = description
+        return [descriptions[key] for key in keys]
@@ -1,6 +1,7 @@
 import base64
 import errno
 import functools
+import hashlib
 import json
 import multiprocessing
 import os
@@ -14,9 +15,11 @@ import unicodedata
 import urllib.parse
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import Dict, List, Union
+from typing import Dict, List, Optional, Union
 from urllib.parse import urlparse, urlunparse
 
+import aiofiles
+import aiofiles.os
 import cairosvg
 import cv2
 import docx
@@ -29,6 +32,7 @@ import pytesseract
 import requests
 import yaml
 from bs4 import BeautifulSoup
+from fastapi import HTTPException
 from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from langchain_community.document_loaders import (
@@ -40,6 +44,7 @@ from langchain_community.document_loaders import (
 from langchain_community.llms import HuggingFaceEndpoint
 
 from comps import CustomLogger
+from comps.parsers.tree_cache import file_hash as get_file_hash
 
 logger = CustomLogger("prepare_doc_util")
 logflag = os.getenv("LOGFLAG", False)
@@ -751,19 +756,58 @@ def decode_filename(encoded_filename):
     return urllib.parse.unquote(encoded_filename)
 
 
-async def save_content_to_local_disk(save_path: str, content):
-    save_path = Path(save_path)
+async def stage_upload(save_path: str, content, max_size: Optional[int] = None, block_size: int = 1 << 20):
+    """Stream an uploaded file into a part file next to save_path, return its path and the SHA-256 of its bytes.
+
+    The upload is read ``block_size`` bytes at a time, so memory use does not depend on the
+    file size. save_path itself is left untouched, the caller replaces it with the part file
+    or removes the part file. Uploads over ``max_size`` bytes are rejected with 413, a failed
+    upload leaves no part file behind.
+    """
+    part_path = save_path + ".part"
+    digest = hashlib.sha256()
+    size = 0
     try:
-        if isinstance(content, str):
-            with open(save_path, "w", encoding="utf-8") as file:
-                file.write(content)
-        else:
-            with save_path.open("wb") as fout:
-                content = await content.read()
-                fout.write(content)
+        async with aiofiles.open(part_path, "wb") as fout:
+            while block := await content.read(block_size):
+                size += len(block)
+                if max_size is not None and size > max_size:
+                    raise HTTPException(
+                        status_code=413, detail=f"File {content.filename} exceeds the limit of {max_size} bytes."
+                    )
+                digest.update(block)
+                await fout.write(block)
+    except HTTPException:
+        os.remove(part_path)
+        raise
+    except Exception as e:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        print(f"Write file failed. Exception: {e}")
+        raise HTTPException(status_code=500, detail=f"Write file {save_path} failed. Exception: {e}")
+    return part_path, digest.hexdigest()
+
+
+async def save_content_to_local_disk(
+    save_path: str, content, max_size: Optional[int] = None, block_size: int = 1 << 20
+) -> str:
+    """Write a string or an uploaded file to save_path and return the SHA-256 of the bytes written.
+
+    Uploads are staged with stage_upload and replace save_path once complete, so an upload
+    over ``max_size`` bytes, rejected with 413, leaves save_path untouched.
+    """
+    if not isinstance(content, str):
+        part_path, file_hash = await stage_upload(save_path, content, max_size, block_size)
+        await aiofiles.os.replace(part_path, save_path)
+        return file_hash
+    try:
+        data = content.encode("utf-8")
+        async with aiofiles.open(save_path, "wb") as fout:
+            await fout.write(data)
+        return hashlib.sha256(data).hexdigest()
     except Exception as e:
         print(f"Write file failed. Exception: {e}")
-        raise Exception(status_code=500, detail=f"Write file {save_path} failed. Exception: {e}")
+        raise HTTPException(status_code=500, detail=f"Write file {save_path} failed. Exception: {e}")
 
 
 def get_file_structure(root_path: str, parent_path: str = "") -> List[Dict[str, Union[str, List]]]:
@@ -0,0 +1,95 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+import numpy as np
+import redis
+import yaml
+from redis.commands.search.field import NumericField, TextField, VectorField
+from redis.commands.search.indexDefinition import IndexDefinition, IndexType
+
+from comps import CustomLogger
+
+logger = CustomLogger("vector_writer")
+
+
+class BulkVectorWriter:
+    """Write chunks and their embeddings to the vector index over one connection pool.
+
+    Hashes use the layout of langchain's Redis vectorstore (``doc:<index>:<id>`` keys with
+    ``content`` and ``content_vector`` fields plus the metadata of ``index_schema``), so the
+    retriever reads them unchanged. Every batch is written with one pipelined round trip
+    while the next batch is being embedded.
+    """
+
+    def __init__(self, redis_pool: redis.ConnectionPool, index_name: str, index_schema: str, batch_size: int = 256):
+        self.redis_pool = redis_pool
+        self.index_name = index_name
+        self.key_prefix = f"doc:{index_name}"
+        self.batch_size = batch_size
+        with open(index_schema, "r") as schema_file:
+            schema = yaml.safe_load(schema_file)
+        self.metadata_fields = [TextField(field["name"]) for field in schema.get("text", [])]
+        self.metadata_fields += [NumericField(field["name"]) for field in schema.get("numeric", [])]
+        self._index_ready = False
+        self._index_lock = threading.Lock()
+        self._embed_executor = ThreadPoolExecutor(1)
+
+    def ensure_index(self, dim: int):
+        if self._index_ready:
+            return
+        with self._index_lock:
+            if self._index_ready:
+                return
+            client = redis.Redis(connection_pool=self.redis_pool).ft(self.index_name)
+            try:
+                client.info()
+            except redis.ResponseError:
+                logger.info(f"[ vector writer ] creating index {self.index_name} with {dim} dimensions")
+                vector_field = VectorField(
+                    "content_vector", "FLAT", {"TYPE": "FLOAT32", "DIM": dim, "DISTANCE_METRIC": "COSINE"}
+                )
+                client.create_index(
+                    [TextField("content"), *self.metadata_fields, vector_field],
+                    definition=IndexDefinition(prefix=[self.key_prefix], index_type=IndexType.HASH),
+                )
+            self._index_ready = True
+
+    def index_dropped(self):
+        """Recreate the index on the next write, after it was dropped."""
+        self._index_ready = False
+
+    def write(self, texts: List[str], metadatas: List[dict], embeddings: List[List[float]]) -> List[str]:
+        self.ensure_index(len(embeddings[0]))
+        keys = [f"{self.key_prefix}:{uuid.uuid4().hex}" for _ in texts]
+        pipe = redis.Redis(connection_pool=self.redis_pool).pipeline(transaction=False)
+        for key, text, metadata, embedding in zip(keys, texts, metadatas, embeddings):
+            mapping = {"content": text, "content_vector": np.asarray(embedding, dtype=np.float32).tobytes()}
+            mapping.update(metadata)
+            pipe.hset(key, mapping=mapping)
+        pipe.execute()
+        return keys
+
+    def ingest(
+        self,
+        texts: List[str],
+        metadatas: Optional[List[dict]],
+        embed: Callable[[List[str]], List[List[float]]],
+    ) -> List[str]:
+        """Embed texts in batches with ``embed`` and write them, returning the keys in order."""
+        metadatas = metadatas or [{} for _ in texts]
+        batches = [(i, i + self.batch_size) for i in range(0, len(texts), self.batch_size)]
+        keys = []
+        pending = self._embed_executor.submit(embed, texts[: self.batch_size]) if batches else None
+        for n, (start, end) in enumerate(batches):
+            embeddings = pending.result()
+            if n + 1 < len(batches):
+                # embed the next batch while this one is written
+                next_start, next_end = batches[n + 1]
+                pending = self._embed_executor.submit(embed, texts[next_start:next_end])
+            keys.extend(self.write(texts[start:end], metadatas[start:end], embeddings))
+        return keys
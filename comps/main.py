@@ -10,6 +10,8 @@ from datetime import datetime
 from typing import List, Dict, Optional
 from langchain_core.prompts import PromptTemplate
 from comps import MegaServiceEndpoint, MicroService, ServiceOrchestrator, ServiceRoleType, ServiceType
+from comps.core.embedding_cache import EmbeddingCache
+from comps.core.response_cache import SemanticResponseCache
 from comps.core.utils import handle_message
 from comps.proto.api_protocol import (
     ChatCompletionRequest,
@@ -50,8 +52,22 @@ RERANK_SERVER_PORT = int(os.getenv("RERANK_SERVER_PORT", 80))
 LLM_SERVER_HOST_IP = os.getenv("LLM_SERVER_HOST_IP", "0.0.0.0")
 LLM_SERVER_PORT = int(os.getenv("LLM_SERVER_PORT", 80))
 LLM_MODEL = os.getenv("LLM_MODEL_ID", "meta-llama/Meta-Llama-3.1-8B-Instruct")
+EMBEDDING_MODEL_ID = os.getenv("EMBEDDING_MODEL_ID", "BAAI/bge-base-en-v1.5")
 REDIS_URL = os.getenv("REDIS_URL")
 
+# Semantic answer cache in front of the RAG flow, keyed on the query embedding
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() == "true"
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", 0.95))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 3600))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 1024))
+RESPONSE_CACHE_VERSION_KEY = os.getenv("RESPONSE_CACHE_VERSION_KEY", "chatqna:corpus_version")
+
+# Query embedding cache for the embedding hop, optionally shared by all replicas through Redis
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", 4096))
+EMBEDDING_CACHE_REDIS = os.getenv("EMBEDDING_CACHE_REDIS", "false").lower() == "true"
+EMBEDDING_CACHE_TTL = int(os.getenv("EMBEDDING_CACHE_TTL", 86400))
+
 # Add Whisper service constants
 WHISPER_SERVICE_HOST_IP = os.getenv("WHISPER_SERVICE_HOST_IP", "0.0.0.0")
 WHISPER_SERVICE_PORT = int(os.getenv("WHISPER_SERVICE_PORT", 8765))
@@ -80,11 +96,32 @@ def align_inputs(self, inputs, cur_node, runtime_graph, llm_parameters_dict, **k
         inputs = next_inputs
     return inputs
 
+async def align_cached_outputs(self, inputs, cur_node, runtime_graph, llm_parameters_dict, **kwargs):
+    if self.services[cur_node].service_type == ServiceType.EMBEDDING and self._embedding_cache is not None:
+        embedding = await self._embedding_cache.get(inputs["inputs"])
+        if embedding is not None:
+            return [embedding]
+    return None
+
 def align_outputs(self, data, cur_node, inputs, runtime_graph, llm_parameters_dict, **kwargs):
     next_data = {}
     if self.services[cur_node].service_type == ServiceType.EMBEDDING:
         assert isinstance(data, list)
+        if self._embedding_cache is not None:
+            self._embedding_cache.put(inputs["inputs"], data[0])
         next_data = {"text": inputs["inputs"], "embedding": data[0]}
+        cache_state = kwargs.get("response_cache_state", None)
+        if cache_state is not None:
+            # answer a near-identical question from the cache and skip the rest of the flow
+            cache_state["embedding"] = data[0]
+            entry = cache_state["cache"].lookup(data[0], cache_state["fingerprint"], cache_state["version"])
+            if entry:
+                cache_state["hit"] = entry
+                next_data = {
+                    "text": entry.answer,
+                    "selected_sources": entry.sources,
+                    "downstream_black_list": [".*"],
+                }
     elif self.services[cur_node].service_type == ServiceType.RETRIEVER:
         if "retrieved_docs" in data:
             enhanced_docs = []
@@ -207,7 +244,7 @@ def align_outputs(self, data, cur_node, inputs, runtime_graph, llm_parameters_di
 
     return next_data
 
-def align_generator(self, gen, **kwargs):
+async def align_generator(self, gen, **kwargs):
     buffer = ""
     request_id = kwargs.get("request_id", str(uuid4()))
     
@@ -228,7 +265,7 @@ def align_generator(self, gen, **kwargs):
     
     full_response = ""
     
-    for line in gen:
+    async for line in gen:
         line = line.decode("utf-8")
         start = line.find("{")
         end = line.rfind("}") + 1
@@ -472,10 +509,31 @@ class ChatQnAService:
         ServiceOrchestrator.align_inputs = align_inputs
         ServiceOrchestrator.align_outputs = align_outputs
         ServiceOrchestrator.align_generator = align_generator
+        ServiceOrchestrator.align_cached_outputs = align_cached_outputs
         ServiceOrchestrator._metrics_registry = {}
-        self.megaservice = ServiceOrchestrator()
+        ServiceOrchestrator._embedding_cache = None
+        if EMBEDDING_CACHE_ENABLED:
+            ServiceOrchestrator._embedding_cache = EmbeddingCache(
+                model_id=EMBEDDING_MODEL_ID,
+                max_entries=EMBEDDING_CACHE_MAX_ENTRIES,
+                redis_url=REDIS_URL if EMBEDDING_CACHE_REDIS else None,
+                ttl=EMBEDDING_CACHE_TTL,
+            )
+        self.megaservice = ServiceOrchestrator(name=type(self).__name__)
         self.endpoint = str(MegaServiceEndpoint.CHAT_QNA)
         self.last_result_dict = {}
+        self.response_cache = None
+        if RESPONSE_CACHE_ENABLED and not REDIS_URL:
+            # the corpus version dataprep bumps lives in Redis, without it cached answers would never be dropped
+            print("RESPONSE_CACHE_ENABLED is ignored: the response cache requires REDIS_URL to see ingests and deletes")
+        elif RESPONSE_CACHE_ENABLED:
+            self.response_cache = SemanticResponseCache(
+                threshold=RESPONSE_CACHE_THRESHOLD,
+                ttl=RESPONSE_CACHE_TTL,
+                max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+                redis_url=REDIS_URL,
+                version_key=RESPONSE_CACHE_VERSION_KEY,
+            )
 
     def add_remote_service(self):
 
@@ -645,6 +703,14 @@ class ChatQnAService:
         ttft_start_time = e2e_start_time
         
         try:
+            cache_state = None
+            if self.response_cache is not None:
+                cache_state = {
+                    "cache": self.response_cache,
+                    "fingerprint": self.response_cache.fingerprint(parameters, retriever_parameters, reranker_parameters),
+                    "version": await self.response_cache.corpus_version(),
+                }
+
             result_dict, runtime_graph = await self.megaservice.schedule(
                 initial_inputs={"text": prompt},
                 llm_parameters=parameters,
@@ -652,9 +718,14 @@ class ChatQnAService:
                 reranker_parameters=reranker_parameters,
                 ttft_start_time=ttft_start_time,
                 request_id=request_id,
+                response_cache_state=cache_state,
             )
             
             self.last_result_dict = result_dict
+            cache_hit = cache_state.get("hit") if cache_state else None
+            cache_miss = cache_state is not None and not cache_hit and "embedding" in cache_state
+            if cache_hit:
+                self.response_cache.observe_hit(cache_hit, time.perf_counter() - e2e_start_time)
 
             sources = []
             try:
@@ -672,10 +743,34 @@ class ChatQnAService:
                         print(f"DEBUG: Found {len(sources)} sources in node {node_name}")
                         break
 
+            if cache_hit:
+                sources = cache_hit.sources
+
             self.last_sources = sources
             
             for node, response in result_dict.items():
                 if isinstance(response, StreamingResponse):
+                    if cache_hit:
+                        return StreamingResponse(
+                            self.megaservice.align_generator(
+                                self.response_cache.replay(cache_hit.answer),
+                                request_id=request_id,
+                                ttft_start_time=ttft_start_time,
+                            ),
+                            media_type="text/event-stream",
+                        )
+                    if cache_miss:
+                        return StreamingResponse(
+                            self.response_cache.record_stream(
+                                response.body_iterator,
+                                cache_state["embedding"],
+                                cache_state["fingerprint"],
+                                cache_state["version"],
+                                sources,
+                                e2e_start_time,
+                            ),
+                            media_type=response.media_type,
+                        )
                     return response
             
             e2e_end_time = time.perf_counter()
@@ -692,6 +787,16 @@ class ChatQnAService:
                 print(f"Error accessing last node response: {e}")
                 
             print(f"DEBUG: Using {len(sources)} pre-extracted sources for response")
+
+            if cache_miss and response != "No response generated":
+                self.response_cache.insert(
+                    cache_state["embedding"],
+                    cache_state["fingerprint"],
+                    cache_state["version"],
+                    response,
+                    sources,
+                    e2e_latency,
+                )
                 
             choices = []
             usage = UsageInfo()
@@ -764,6 +869,7 @@ class ChatQnAService:
         )
 
         self.service.add_route(self.endpoint, self.handle_request, methods=["POST"])
+        self.service.add_shutdown_event(self.megaservice.close)
 
         self.service.start()
 
@@ -1330,6 +1436,7 @@ class ConversationRAGService(ChatQnAService):
         # self.service.add_route("/api/circulars", handle_circular_get, methods=["GET"])
         self.service.add_route("/api/transcribe", self.handle_transcribe, methods=["POST"])
         self.service.add_route("/api/whisper_healthcheck", self.handle_whisper_healthcheck, methods=["GET"])
+        self.service.add_shutdown_event(self.megaservice.close)
         self.service.start()
 
 if __name__ == "__main__":
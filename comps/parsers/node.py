@@ -1,48 +1,225 @@
 import os
+from array import array
 from comps.parsers.text import Text
 from comps.parsers.table import Table
 
+
+def pack(item):
+    """Content item as the store keeps it, the text of a Text and a tuple for a Table."""
+    if type(item) is Text and type(item.content) is str:
+        return item.content
+    if type(item) is Table:
+        return (item.markdown_content, item.heading)
+    return item
+
+
+def unpack(item, node):
+    if type(item) is str:
+        return Text(item, node)
+    if type(item) is tuple:
+        return Table(item[0], item[1], node)
+    return item
+
+
+def resolve(store, index):
+    """Where the node at index of store lives, after its subtree was moved to other stores."""
+    while store.forward is not None and index in store.forward:
+        store, index = store.forward[index]
+    return store, index
+
+
+class NodeStore:
+    """The nodes of one tree in parallel arrays, a Node is a view of one index.
+
+    Children are arrays of indices, kept only for the nodes that have any. The content items
+    of all nodes are in one list, chained per node through next_item, texts as plain strings
+    and tables as tuples. A node costs a few array slots instead of an object, its attribute
+    dict, two lists and an object per content item. ``forward`` maps the nodes moved to
+    another store to their new place.
+    """
+    __slots__ = (
+        "levels", "headings", "dirs", "parents", "children", "items", "next_item", "first_item", "last_item", "forward"
+    )
+
+    def __init__(self):
+        self.levels = []
+        self.headings = []
+        self.dirs = []
+        self.parents = array("i")
+        self.children = []
+        self.items = []
+        self.next_item = array("i")
+        self.first_item = array("i")
+        self.last_item = array("i")
+        self.forward = None
+
+    def __len__(self):
+        return len(self.levels)
+
+    def add(self, level, heading, dir):
+        self.levels.append(level)
+        self.headings.append(heading)
+        self.dirs.append(dir)
+        self.parents.append(-1)
+        self.children.append(None)
+        self.first_item.append(-1)
+        self.last_item.append(-1)
+        return len(self.levels) - 1
+
+    def append_child(self, index, child):
+        if self.children[index] is None:
+            self.children[index] = array("i")
+        self.children[index].append(child)
+
+    def append_content(self, index, item):
+        self.items.append(item)
+        self.next_item.append(-1)
+        k = len(self.items) - 1
+        if self.last_item[index] == -1:
+            self.first_item[index] = k
+        else:
+            self.next_item[self.last_item[index]] = k
+        self.last_item[index] = k
+
+    def content(self, index):
+        k = self.first_item[index]
+        while k != -1:
+            yield self.items[k]
+            k = self.next_item[k]
+
+    def adopt(self, store, index):
+        """Move the subtree of index in another store into this one, returning its new index.
+
+        The moved nodes are forwarded to their copies, so every Node viewing them keeps working.
+        """
+        stack = [(store, index, -1)]
+        while stack:
+            store, old, parent = stack.pop()
+            store, old = resolve(store, old)
+            if store is self:
+                # already moved here as part of another subtree
+                new = old
+            else:
+                new = self.add(store.levels[old], store.headings[old], store.dirs[old])
+                if parent != -1 and store.parents[old] != -1:
+                    self.parents[new] = parent
+                for item in store.content(old):
+                    self.append_content(new, item)
+                if store.forward is None:
+                    store.forward = {}
+                store.forward[old] = (self, new)
+                stack.extend((store, child, new) for child in reversed(store.children[old] or ()))
+            if parent == -1:
+                moved = new
+            else:
+                self.append_child(parent, new)
+        return moved
+
+
 class Node:
-    def __init__(self, level, heading, dir):
-        self.__level = level
-        self.__heading = heading
-        self.__parent = None
-        self.__content = []
-        self.__children = []
-        self.__dir = dir
+    """A node of a NodeStore.
+
+    Nodes of a tree are created in the store of its root, ``Node(level, heading, dir, root.store)``.
+    A node created on its own gets a store of its own, and its subtree is moved into the store
+    of the node it is appended to. Content items are stored packed, get_content returns new
+    Text and Table objects.
+    """
+    __slots__ = ("store", "index")
+
+    def __init__(self, level, heading, dir, store=None):
+        self.store = NodeStore() if store is None else store
+        self.index = self.store.add(level, heading, dir)
+
+    @classmethod
+    def view(cls, store, index):
+        node = cls.__new__(cls)
+        node.store = store
+        node.index = index
+        return node
+
+    def locate(self):
+        if self.store.forward is not None:
+            self.store, self.index = resolve(self.store, self.index)
+
+    def __eq__(self, other):
+        if not isinstance(other, Node):
+            return False
+        self.locate()
+        other.locate()
+        return self.store is other.store and self.index == other.index
+
+    def __hash__(self):
+        self.locate()
+        return hash((id(self.store), self.index))
 
     def get_level(self):
-        return self.__level
-    
+        self.locate()
+        return self.store.levels[self.index]
+
     def get_heading(self):
-        return self.__heading
-    
+        self.locate()
+        return self.store.headings[self.index]
+
     def get_content(self):
-        return self.__content
-    
+        """The content items of the node, as a tuple of new Text and Table objects.
+
+        Unlike the list the dict-backed Node returned, it is a snapshot, changing its items does
+        not change the node and it cannot be appended to, content is added with append_content.
+        """
+        self.locate()
+        return tuple(unpack(item, self) for item in self.store.content(self.index))
+
     def set_parent(self, node):
-        self.__parent = node
+        node.locate()
+        self.move_to(node.store)
+        self.store.parents[self.index] = node.index
 
     def append_child(self, node):
-        self.__children.append(node)
+        self.locate()
+        node.move_to(self.store)
+        self.store.append_child(self.index, node.index)
+
+    def move_to(self, store):
+        self.locate()
+        if self.store is not store:
+            self.index = store.adopt(self.store, self.index)
+            self.store = store
 
     def append_content(self, line):
-        self.__content.append(line)
+        self.locate()
+        self.store.append_content(self.index, pack(line))
 
     def get_length_children(self):
-        return len(self.__children)
-    
+        self.locate()
+        children = self.store.children[self.index]
+        return len(children) if children else 0
+
     def get_child(self, pos):
-        return self.__children[pos]
-    
-    def output_node_info(self):
-        with open(os.path.join(self.__dir, "output.txt"), "a") as f:
-            f.write(self.__heading + "\n")
-            for item in self.__content:
-                if isinstance(item, Text):
-                    for line in item.content:
-                        f.write(line)
-                if isinstance(item, Table):
-                    for line in item.markdown_content:
-                        f.write(line)
-            f.write("\n")
+        self.locate()
+        return Node.view(*resolve(self.store, (self.store.children[self.index] or ())[pos]))
+
+    def walk(self):
+        """The nodes of the subtree in pre-order, without recursion."""
+        self.locate()
+        stack = [(self.store, self.index)]
+        while stack:
+            store, index = resolve(*stack.pop())
+            yield Node.view(store, index)
+            children = store.children[index]
+            if children:
+                stack.extend((store, child) for child in reversed(children))
+
+    def output_node_info(self, f=None):
+        self.locate()
+        if f is None:
+            with open(os.path.join(self.store.dirs[self.index], "output.txt"), "a") as f:
+                return self.output_node_info(f)
+        f.write(self.get_heading() + "\n")
+        for item in self.get_content():
+            if isinstance(item, Text):
+                for line in item.content:
+                    f.write(line)
+            if isinstance(item, Table):
+                for line in item.markdown_content:
+                    f.write(line)
+        f.write("\n")
@@ -1,4 +1,6 @@
 class Table:
+    __slots__ = ("markdown_content", "heading", "node")
+
     def __init__(self, markdown_content, heading, node):
         self.markdown_content = markdown_content
         self.heading = heading
@@ -1,4 +1,6 @@
 class Text:
+    __slots__ = ("content", "node")
+
     def __init__(self, content, node):
         self.content = content
         self.node = node
\ No newline at end of file
@@ -0,0 +1,138 @@
+import bisect
+import heapq
+import re
+from collections import Counter, defaultdict
+from difflib import SequenceMatcher
+
+# words, and section numbers such as 2.3.1 as one token
+TOKEN_PATTERN = re.compile(r'\w+(?:\.\w+)*')
+
+
+def normalize_title(title):
+    return re.sub(r'\s+', ' ', title.replace("*", "")).strip().lower()
+
+
+def similarity(a, b, threshold=0.6, matcher=None):
+    """SequenceMatcher ratio of a and b, or 0.0 when it is not above threshold.
+
+    When one string starts the other, as a heading does its TOC title, all of it is one
+    matching block, which gives the ratio without matching. Below 200 characters
+    SequenceMatcher has no autojunk heuristic that could find less. Other pairs are rejected
+    with the cheap upper bounds first. ``matcher``, a SequenceMatcher already holding b,
+    saves indexing b again when it is compared to many strings.
+    """
+    short, long = (a, b) if len(a) <= len(b) else (b, a)
+    if short and len(long) < 200 and long.startswith(short):
+        ratio = 2 * len(short) / (len(a) + len(b))
+        return ratio if ratio > threshold else 0.0
+    if matcher is None:
+        matcher = SequenceMatcher(None, a, b)
+    else:
+        matcher.set_seq1(a)
+    if matcher.real_quick_ratio() <= threshold or matcher.quick_ratio() <= threshold:
+        return 0.0
+    ratio = matcher.ratio()
+    return ratio if ratio > threshold else 0.0
+
+
+def is_similar(a, b, threshold=0.6):
+    return similarity(a, b, threshold) > 0
+
+
+def best_chain(pairs, num_titles):
+    """Heaviest chain of (heading, title, score) pairs increasing in both heading and title.
+
+    Pairs are visited by heading, a Fenwick tree over the titles holds the best chain ending
+    before every title, so the chain is found in O(pairs * log(titles)).
+    """
+    tree = [(0.0, -1)] * (num_titles + 1)
+    scores = [0.0] * len(pairs)
+    parents = [-1] * len(pairs)
+    order = sorted(range(len(pairs)), key=lambda k: pairs[k][0])
+
+    start = 0
+    while start < len(order):
+        end = start
+        while end < len(order) and pairs[order[end]][0] == pairs[order[start]][0]:
+            end += 1
+        # chains of one heading are extended only after all its pairs were scored
+        for k in order[start:end]:
+            best, position = (0.0, -1), pairs[k][1]
+            while position > 0:
+                best = max(best, tree[position])
+                position -= position & -position
+            scores[k] = best[0] + pairs[k][2]
+            parents[k] = best[1]
+        for k in order[start:end]:
+            position = pairs[k][1] + 1
+            while position <= num_titles:
+                tree[position] = max(tree[position], (scores[k], k))
+                position += position & -position
+        start = end
+
+    if not pairs:
+        return {}
+    k = max(range(len(pairs)), key=scores.__getitem__)
+    alignment = {}
+    while k != -1:
+        alignment[pairs[k][0]] = pairs[k][1]
+        k = parents[k]
+    return alignment
+
+
+def nearest(postings, expected, count):
+    """The ``count`` entries of the sorted postings closest to expected."""
+    position = bisect.bisect_left(postings, expected)
+    start = max(0, min(position - count // 2, len(postings) - count))
+    return postings[start:start + count]
+
+
+def align_headings(headings, titles, threshold=0.6, max_candidates=16):
+    """Align markdown headings with TOC titles, returning a dict of heading index -> title index.
+
+    A heading is scored against the titles equal to it once normalized or, when there are none,
+    against the titles sharing its rarest words, found through an index of the title words.
+    Of many candidates, such as the titles of a recurring "Exercises" section, only the
+    ``max_candidates`` closest to the expected position of the heading are kept, the position
+    following from the last heading before it with a unique title, and the titles around that
+    position are always scored, for headings whose words were damaged. The alignment is the chain
+    of pairs with the largest total similarity that keeps both sides in order, so a heading or
+    title missing on one side costs only its own match instead of every match after it.
+    """
+    headings = [normalize_title(heading) for heading in headings]
+    titles = [normalize_title(title) for title in titles]
+    exact = defaultdict(list)
+    index = defaultdict(list)
+    for j, title in enumerate(titles):
+        exact[title].append(j)
+        for token in set(TOKEN_PATTERN.findall(title)):
+            index[token].append(j)
+    common = 4 * max_candidates
+
+    pairs = []
+    anchor = (0, 0)
+    for i, heading in enumerate(headings):
+        expected = anchor[1] + i - anchor[0]
+        if heading in exact:
+            candidates = nearest(exact[heading], expected, max_candidates)
+            if len(exact[heading]) == 1:
+                anchor = (i, exact[heading][0])
+        else:
+            shared = Counter()
+            for token in sorted(set(TOKEN_PATTERN.findall(heading)), key=lambda token: len(index.get(token, ()))):
+                postings = index.get(token, ())
+                if len(postings) > common:
+                    if shared:
+                        break
+                    postings = nearest(postings, expected, max_candidates // 2)
+                shared.update(postings)
+            candidates = set(heapq.nsmallest(max_candidates, shared, key=lambda j: (-shared[j], abs(j - expected))))
+            # a damaged section number can point to another section, the title on the diagonal is kept too
+            candidates.update(range(max(0, expected - 1), min(len(titles), expected + 2)))
+        matcher = SequenceMatcher(None)
+        matcher.set_seq2(heading)
+        for j in candidates:
+            score = similarity(titles[j], heading, threshold, matcher)
+            if score:
+                pairs.append((i, j, score))
+    return best_chain(pairs, len(titles))
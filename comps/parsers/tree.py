@@ -7,4 +7,6 @@ class Tree:
     def __init__(self, file):
         self.rootNode = Node('0', "root", os.path.join(OUTPUT_DIR, os.path.splitext(os.path.basename(file))[0]))
         self.file = file
+        # heading title -> page, filled when the tree is populated
+        self.heading_pages = None
     
\ No newline at end of file
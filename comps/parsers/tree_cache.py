@@ -0,0 +1,81 @@
+import gzip
+import hashlib
+import json
+import os
+from comps.parsers.text import Text
+
+# bump whenever the same PDF would be parsed into a different tree, older caches are then ignored
+PARSER_VERSION = 1
+TREE_CACHE_FILE = "tree.json.gz"
+
+
+def file_hash(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def dump_tree(rootNode):
+    """Nodes in pre-order as [level, heading, number of children, content], the content a list of
+    texts and of [markdown, caption] tables."""
+    nodes = []
+    stack = [rootNode]
+    while stack:
+        node = stack.pop()
+        content = [
+            item.content if isinstance(item, Text) else [item.markdown_content, item.heading]
+            for item in node.get_content()
+        ]
+        total = node.get_length_children()
+        nodes.append([node.get_level(), node.get_heading(), total, content])
+        stack.extend(node.get_child(i) for i in reversed(range(total)))
+    return nodes
+
+
+def load_tree(nodes, rootNode, node_dir):
+    """Rebuild the nodes of dump_tree under rootNode, which takes the place of the dumped root.
+
+    The nodes are written straight into the store of rootNode, in the packed form it keeps.
+    """
+    rootNode.locate()
+    store = rootNode.store
+    stack = []
+    for level, heading, total, content in nodes:
+        if not stack:
+            index = rootNode.index
+        else:
+            while stack[-1][1] == 0:
+                stack.pop()
+            parent = stack[-1]
+            parent[1] -= 1
+            index = store.add(level, heading, node_dir)
+            store.append_child(parent[0], index)
+            store.parents[index] = parent[0]
+        for item in content:
+            store.append_content(index, item if isinstance(item, str) else (item[0], item[1]))
+        stack.append([index, total])
+
+
+def save_tree_cache(path, rootNode, heading_pages, file_hash):
+    data = {
+        "version": PARSER_VERSION,
+        "file_hash": file_hash,
+        "heading_pages": heading_pages,
+        "nodes": dump_tree(rootNode),
+    }
+    # written aside and renamed, so a reader never sees half a cache
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=1) as f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def read_tree_cache(path):
+    """The cache saved at path, or None when there is none or it cannot be read."""
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, EOFError, ValueError):
+        return None
@@ -4,14 +4,21 @@ from marker.output import output_exists, save_output
 from sortedcontainers import SortedDict
 from pdfminer.pdfparser import PDFParser, PDFSyntaxError
 from pdfminer.pdfdocument import PDFDocument, PDFNoOutlines
-from difflib import SequenceMatcher
+from pdfminer.pdfpage import PDFPage
+from itertools import repeat
 import re
 import json 
 import os
+import shutil
+import threading
 from comps import CustomLogger
 from comps.parsers.node import Node
 from comps.parsers.text import Text
 from comps.parsers.table import Table
+from comps.parsers.toc_alignment import align_headings, is_similar, normalize_title
+from comps.parsers.tree_cache import (
+    PARSER_VERSION, TREE_CACHE_FILE, file_hash, load_tree, read_tree_cache, save_tree_cache
+)
 from comps.core.utils import mkdirIfNotExists
 
 OUTPUT_DIR = "out"
@@ -19,24 +26,105 @@ NCERT_TOC_DIR = "../parsers/ncert_toc"
 
 logger = CustomLogger("treeparser")
 
+_marker_models = None
+_marker_models_lock = threading.Lock()
+
+
+def get_marker_models():
+    """Load the marker layout, OCR and table models once per process and share them."""
+    global _marker_models
+    if _marker_models is None:
+        with _marker_models_lock:
+            if _marker_models is None:
+                logger.info("Loading marker models")
+                _marker_models = create_model_dict()
+    return _marker_models
+
+
+def warmup_marker_models():
+    get_marker_models()
+
+
+def convert_pages(file, page_range=None):
+    """Convert the 0-based pages of page_range, or the whole PDF, with the marker models of this process."""
+    config = {
+        "output_format": "markdown",
+        "use_llm": False,
+    }
+    if page_range is not None:
+        config["page_range"] = page_range
+    converter = PdfConverter(
+        artifact_dict=get_marker_models(),
+        config=config
+    )
+    return converter(file)
+
+
+def merge_rendered(shards):
+    """Stitch the markdown outputs of consecutive page ranges into the output of the whole document.
+
+    marker numbers pages, images and table of contents entries after the original page, so the
+    shards concatenate without renumbering.
+    """
+    metadata = dict(shards[0].metadata)
+    for key in ("table_of_contents", "page_stats"):
+        metadata[key] = [entry for shard in shards for entry in shard.metadata.get(key, [])]
+    images = {}
+    for shard in shards:
+        images.update(shard.images)
+    markdown = "\n\n".join(shard.markdown.strip("\n") for shard in shards)
+    return shards[0].model_copy(update={"markdown": markdown + "\n", "images": images, "metadata": metadata})
+
+
+SPAN_PATTERN = re.compile(r'<span[^>]*?\/?>(</span>)?')
+CAPTION_PATTERN = re.compile(r'^(Table|Figure)\s+(\d+)', re.IGNORECASE)
+
+
+def split_lines(text):
+    """Split like reading a file line by line, on newlines only and keeping them."""
+    lines = text.split("\n")
+    last = lines.pop()
+    lines = [line + "\n" for line in lines]
+    if last:
+        lines.append(last)
+    return lines
+
+
+def count_pages(file):
+    with open(file, "rb") as fp:
+        try:
+            return sum(1 for _ in PDFPage.get_pages(fp))
+        except PDFSyntaxError:
+            return 0
+
+
 class TreeParser:
-    def __init__(self):
+    def __init__(self, page_executor=None, pages_per_shard=16):
+        """PDFs are converted in this process, or with ``page_executor``, a process pool, in shards
+        of ``pages_per_shard`` pages converted in parallel."""
         mkdirIfNotExists(OUTPUT_DIR)
+        self.page_executor = page_executor
+        self.pages_per_shard = pages_per_shard
 
     def get_filename(self, file):
         return os.path.splitext(os.path.basename(file))[0]
 
+    def convert_pdf(self, file):
+        if self.page_executor is None:
+            return convert_pages(file)
+        num_pages = count_pages(file)
+        page_ranges = [
+            list(range(start, min(start + self.pages_per_shard, num_pages)))
+            for start in range(0, num_pages, self.pages_per_shard)
+        ]
+        if len(page_ranges) <= 1:
+            return self.page_executor.submit(convert_pages, file).result()
+        logger.info(f"Converting {num_pages} pages in {len(page_ranges)} shards")
+        return merge_rendered(list(self.page_executor.map(convert_pages, repeat(file), page_ranges)))
+
     def generate_markdown(self, file, filename):
         if not output_exists(os.path.join(OUTPUT_DIR, filename), filename):
-            config = {
-                "output_format": "markdown",
-                "use_llm": False,
-            }
-            converter = PdfConverter(
-                artifact_dict=create_model_dict(),
-                config=config
-            )
-            rendered = converter(file)
+            rendered = self.convert_pdf(file)
             os.mkdir(os.path.join(OUTPUT_DIR, filename))
             save_output(rendered, os.path.join(OUTPUT_DIR, filename), filename)
             logger.info("Output generated")
@@ -127,151 +215,140 @@ class TreeParser:
                 finally:
                     parser.close()
 
-    def peek_next_lines(self, f):
-        pos = f.tell()
-        line = f.readline()
-        line_2 = f.readline()
-        f.seek(pos)
-        return line, line_2
-
     def parse_markdown(self, filename, rootNode, recentNodeDict):
-        toc_file = None
-
         if "grade" in filename:
-            toc_file = open(os.path.join(NCERT_TOC_DIR, f"{filename}.txt"), "r")
+            toc_path = os.path.join(NCERT_TOC_DIR, f"{filename}.txt")
         else:
-            toc_file = open(os.path.join(OUTPUT_DIR, filename, "toc.txt"), "r")
-        toc_line = toc_file.readline()
-                
-        currNode = rootNode
+            toc_path = os.path.join(OUTPUT_DIR, filename, "toc.txt")
+        with open(toc_path, "r") as toc_file:
+            toc_lines = toc_file.readlines()
+        with open(os.path.join(OUTPUT_DIR, filename, filename + ".md"), 'r') as markdown_file:
+            markdown = markdown_file.read()
+        self.build_tree(markdown, toc_lines, rootNode, recentNodeDict, os.path.join(OUTPUT_DIR, filename))
+
+    def build_tree(self, markdown, toc_lines, rootNode, recentNodeDict, node_dir):
+        """Build the tree in one pass over the markdown, with its headings aligned to the TOC beforehand.
+
+        Headings aligned with a TOC entry become nodes, attached by the level of the entry, the
+        others stay text. Text is collected into the current node, and tables are collected with
+        their "Table n"/"Figure n" caption from the line before or the second line after them.
+        """
+        lines = split_lines(markdown)
+        toc = [toc_line.rstrip("\n").split(";") for toc_line in toc_lines if toc_line.strip()]
+        toc = [(entry[0], entry[1] if len(entry) > 1 else "") for entry in toc]
+
+        headings = {}
+        for i, line in enumerate(lines):
+            if line.startswith("#") or line.startswith("<span"):
+                parts = SPAN_PATTERN.sub('', line).split(" ", 1)
+                if parts[0].startswith("#") and len(parts) > 1:
+                    headings[i] = parts[1].strip().replace("*", "")
+        alignment = align_headings(list(headings.values()), [title for _, title in toc])
+        heading_lines = list(headings)
+        matched = {heading_lines[i]: toc[j] for i, j in alignment.items()}
+        if len(alignment) < len(toc):
+            logger.warning(f"PDF not parsed accurately, {len(toc) - len(alignment)}/{len(toc)} TOC entries not found")
 
+        currNode = rootNode
         tables = []
-
-        content = ""
-
+        content = []
         previous_line = ""
 
-        with open(os.path.join(OUTPUT_DIR, filename, filename + ".md"), 'r') as markdown_file:
-            line = markdown_file.readline()
-            while line:
-                line = re.sub(r'<span[^>]*?\/?>(</span>)?', '', line)
-                if line == "\n":
-                    line = markdown_file.readline()
-                    continue
-                if bool(re.match(r'^#+', line)):
-                    _, heading = line.split(" ", 1)
-                    if not toc_line:
-                        line = markdown_file.readline()
-                        continue
-                    level, heading_toc = toc_line.split(";")
-                    heading = heading.strip().replace("*", "")
-                    if (SequenceMatcher(None, "contents", heading_toc.lower())).ratio() > 0.6:
-                        toc_line = toc_file.readline()
-                        level, heading_toc = toc_line.split(";")
-                    elif SequenceMatcher(None, heading.lower(), heading_toc.lower()).ratio() > 0.6:
-                        node = Node(level, heading, os.path.join(OUTPUT_DIR, filename))
-                        if level > currNode.get_level():
-                            currNode.append_child(node)
-                            node.set_parent(currNode)
-                        else:
-                            parent_key = -1
-                            for key in reversed(recentNodeDict):
-                                if key < node.get_level():
-                                    parent_key = key
-                                    break
-                            recentNodeDict[parent_key].append_child(node)
-                            node.set_parent(recentNodeDict[parent_key])
-                            recentNodeDict[node.get_level()] = node
-                        text_obj = Text(content, currNode)
-                        currNode.append_content(text_obj)
-                        for table in tables:
-                            currNode.append_content(table)
-                        tables.clear()
-                        content = ""
-                        currNode = node
-                        toc_line = toc_file.readline()  
-                    else:
-                        content += line    
-                elif line[0] == '|':
-                    table_list = []
-                    table_list.append(line)
-                    while self.peek_next_lines(markdown_file)[0] and self.peek_next_lines(markdown_file)[0][0] == '|':
-                        line = markdown_file.readline()
-                        table_list.append(line)
-                    next_line = self.peek_next_lines(markdown_file)[1].split('>', 1)
-                    if len(next_line) > 1:
-                        next_line = next_line[1]
+        i = 0
+        n = len(lines)
+        while i < n:
+            line = lines[i]
+            if "<span" in line:
+                line = SPAN_PATTERN.sub('', line)
+            if line == "\n":
+                i += 1
+                continue
+            if i in headings:
+                if i not in matched:
+                    content.append(line)
+                elif not is_similar("contents", normalize_title(matched[i][1])):
+                    level, heading = matched[i][0], headings[i]
+                    node = Node(level, heading, node_dir, rootNode.store)
+                    if level > currNode.get_level():
+                        currNode.append_child(node)
+                        node.set_parent(currNode)
                     else:
-                        next_line = next_line[0]
-                    pattern_table_heading = re.compile(r'^(Table|Figure)\s+(\d+)', re.IGNORECASE) 
-                    match_table_heading_previous = pattern_table_heading.search(previous_line)
-                    match_table_heading_next = pattern_table_heading.search(next_line)
-                    heading = ""
-                    if match_table_heading_previous:
-                        heading = previous_line
-                    elif match_table_heading_next:
-                        heading = next_line
-                    table_obj = Table("".join(table_list), heading, currNode)
-                    tables.append(table_obj)
-                else:
-                    pattern_heading = re.compile(r'^(Table|Figure)\s+(\d+)', re.IGNORECASE)
-                    match_heading = pattern_heading.search(line)
-                    if not match_heading:
-                        content += line
-                previous_line = line
-                line = markdown_file.readline()
-                if not line:
-                    text_obj = Text(content, currNode)
-                    currNode.append_content(text_obj)
+                        parent_key = -1
+                        for key in reversed(recentNodeDict):
+                            if key < node.get_level():
+                                parent_key = key
+                                break
+                        recentNodeDict[parent_key].append_child(node)
+                        node.set_parent(recentNodeDict[parent_key])
+                        recentNodeDict[node.get_level()] = node
+                    currNode.append_content(Text("".join(content), currNode))
                     for table in tables:
                         currNode.append_content(table)
-
-        if toc_file.readline():
-            logger.warning("PDF not parsed accurately")
-
-    def traverse_tree_text(self, node):
+                    tables = []
+                    content = []
+                    currNode = node
+            elif line.startswith("|"):
+                end = i + 1
+                while end < n and lines[end].startswith("|"):
+                    end += 1
+                # the caption comes before the table, or after the line that follows it
+                next_line = lines[end + 1].split('>', 1)[-1] if end + 1 < n else ""
+                heading = ""
+                if CAPTION_PATTERN.search(previous_line):
+                    heading = previous_line
+                elif CAPTION_PATTERN.search(next_line):
+                    heading = next_line
+                tables.append(Table("".join([line] + lines[i + 1:end]), heading, currNode))
+                if end > i + 1:
+                    line = lines[end - 1]
+                i = end - 1
+            elif not CAPTION_PATTERN.search(line):
+                content.append(line)
+            previous_line = line
+            i += 1
+
+        if lines:
+            currNode.append_content(Text("".join(content), currNode))
+            for table in tables:
+                currNode.append_content(table)
+
+    def traverse_tree_text(self, node, f=None):
         if node == None:
             return
-        
-        node.output_node_info()
 
-        total = node.get_length_children()
+        for child in node.walk():
+            child.output_node_info(f)
 
-        for i in range(total):
-            self.traverse_tree_text(node.get_child(i))
-        
     def generate_output_text(self, tree):
         filename = self.get_filename(tree.file)
         with open(os.path.join(OUTPUT_DIR, filename, "output.txt"), "w") as f:
-            f.write("")
-        self.traverse_tree_text(tree.rootNode)
+            self.traverse_tree_text(tree.rootNode, f)
 
     def traverse_tree_json(self, node):
+        """Nested {heading: {'content': [...], 'children': [...]}} dicts of the subtree, built without recursion."""
         if node == None:
             return
-        
-        data = {}
-
-        heading = node.get_heading()
 
-        data[heading] = {}
-        data[heading]['content'] = []
-
-        content = node.get_content()
-        for item in content:
-            if isinstance(item, Text):
-                data[heading]['content'].append(item.content)
-            if isinstance(item, Table):
-                data[heading]['content'].append(item.markdown_content)
-
-        data[heading]['children'] = []
-        
-        total = node.get_length_children()
-
-        for i in range(total):
-            data[heading]['children'].append(self.traverse_tree_json(node.get_child(i)))
-        
-        return data
+        root = {}
+        # the children list of its parent every node is appended to, in pre-order
+        stack = [(node, None)]
+        while stack:
+            node, siblings = stack.pop()
+            heading = node.get_heading()
+            data = {heading: {'content': [], 'children': []}}
+            for item in node.get_content():
+                if isinstance(item, Text):
+                    data[heading]['content'].append(item.content)
+                if isinstance(item, Table):
+                    data[heading]['content'].append(item.markdown_content)
+            if siblings is None:
+                root = data
+            else:
+                siblings.append(data)
+            children = data[heading]['children']
+            stack.extend((node.get_child(i), children) for i in reversed(range(node.get_length_children())))
+
+        return root
 
     def generate_output_json(self, tree):
         data = self.traverse_tree_json(tree.rootNode)
@@ -280,10 +357,31 @@ class TreeParser:
         with open(os.path.join(OUTPUT_DIR, filename, "output.json"), "w") as outfile: 
             json.dump(data, outfile)
 
-    def populate_tree(self, tree):
+    def populate_tree(self, tree, content_hash=None):
+        """Parse the file of tree into it, or load the tree cached by the last parse of the same content.
+
+        The cache is kept next to the marker output, it is used when the parser version and the
+        SHA-256 of the file, ``content_hash`` when the caller already has it, are the ones it was
+        saved with. A cache of other content, or none at all, means the marker output is stale as well.
+        """
         rootNode = tree.rootNode
         file = tree.file
         filename = self.get_filename(file)
+        output_dir = os.path.join(OUTPUT_DIR, filename)
+        cache_path = os.path.join(output_dir, TREE_CACHE_FILE)
+        content_hash = content_hash or file_hash(file)
+
+        cached = read_tree_cache(cache_path)
+        if cached and cached["file_hash"] == content_hash and cached["version"] == PARSER_VERSION:
+            load_tree(cached["nodes"], rootNode, output_dir)
+            tree.heading_pages = cached["heading_pages"]
+            logger.info(f"Loaded cached tree of {filename}")
+            return
+        # marker output without a readable cache, from before the cache or interrupted, may be of
+        # other content as well, only an output cached with the same hash is kept
+        if (cached is None or cached["file_hash"] != content_hash) and os.path.isdir(output_dir):
+            shutil.rmtree(output_dir)
+
         self.generate_markdown(file, filename)
         self.generate_toc(file, filename)
 
@@ -291,7 +389,28 @@ class TreeParser:
         recentNodeDict['0'] = rootNode
 
         self.parse_markdown(filename, rootNode, recentNodeDict)
+        tree.heading_pages = self.get_heading_pages(tree)
+        if os.path.isdir(output_dir):
+            save_tree_cache(cache_path, rootNode, tree.heading_pages, content_hash)
     
+    def normalize_heading(self, title):
+        return normalize_title(title)
+
+    def get_heading_pages(self, tree):
+        """Map normalized heading titles to the 1-based page marker found them on."""
+        if tree.heading_pages is not None:
+            return tree.heading_pages
+        filename = self.get_filename(tree.file)
+        meta_path = os.path.join(OUTPUT_DIR, filename, filename + "_meta.json")
+        if not os.path.exists(meta_path):
+            return {}
+        with open(meta_path, 'r') as file_meta:
+            data = json.load(file_meta)
+        pages = {}
+        for heading in data.get('table_of_contents', []):
+            pages.setdefault(self.normalize_heading(heading['title']), heading['page_id'] + 1)
+        return pages
+
     def get_output_path(self, tree):
         filename = self.get_filename(tree.file)
         return os.path.join(OUTPUT_DIR, filename, "output.txt")
@@ -125,8 +125,15 @@ class RetrievalResponseData(BaseModel):
     metadata: Optional[Dict[str, Any]] = None
 
 
+class RetrievalBatchResponseData(BaseModel):
+    index: int
+    retrieved_docs: List[RetrievalResponseData]
+
+
 class RetrievalResponse(BaseModel):
     retrieved_docs: List[RetrievalResponseData]
+    # per query results when the request embedding is an EmbeddingResponse, even of a single vector
+    data: Optional[List[RetrievalBatchResponseData]] = None
 
 
 class RerankingRequest(BaseModel):
@@ -0,0 +1,49 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+"""One-time backfill of the chunk -> file name index for the chunks ingested before it existed.
+
+Walks the key lists of the files in the file-keys index once and writes the chunks missing
+from CHUNK_FILE_INDEX, then sets CHUNK_FILE_BACKFILLED_KEY so that later runs return at once.
+Dataprep indexes every chunk it ingests, so the index stays complete afterwards. The
+retriever runs it in the background when it starts, unless CHUNK_FILE_BACKFILL is false.
+
+Usage:
+    python backfill_chunk_file_index.py [--force]
+"""
+
+import argparse
+
+import redis
+from redis_config import CHUNK_FILE_BACKFILLED_KEY, CHUNK_FILE_INDEX, REDIS_URL
+
+from comps import CustomLogger
+
+logger = CustomLogger("backfill_chunk_file_index")
+
+
+def backfill_chunk_file_index(r, force: bool = False, batch_size: int = 1000) -> int:
+    """Index the chunks of every file missing from CHUNK_FILE_INDEX, returning how many were written."""
+    if not force and r.exists(CHUNK_FILE_BACKFILLED_KEY):
+        return 0
+    written = 0
+    for key in r.scan_iter(match="file:*", count=batch_size):
+        file_name, key_ids = r.hmget(key, "file_name", "key_ids")
+        if not file_name or not key_ids:
+            continue
+        chunk_ids = key_ids.decode("utf-8").split("#")
+        indexed = r.hmget(CHUNK_FILE_INDEX, chunk_ids)
+        missing = {chunk_id: file_name for chunk_id, value in zip(chunk_ids, indexed) if value is None}
+        if missing:
+            r.hset(CHUNK_FILE_INDEX, mapping=missing)
+            written += len(missing)
+    r.set(CHUNK_FILE_BACKFILLED_KEY, 1)
+    logger.info(f"[ backfill ] indexed {written} chunks in {CHUNK_FILE_INDEX}")
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--force", action="store_true", help="run again even if the backfill already ran")
+    args = parser.parse_args()
+    backfill_chunk_file_index(redis.Redis.from_url(REDIS_URL), force=args.force)
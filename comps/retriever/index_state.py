@@ -0,0 +1,58 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import asyncio
+import time
+
+from redis.exceptions import ResponseError
+
+
+def is_missing_index(error: ResponseError) -> bool:
+    """Whether Redis answered that the index does not exist, the wording differs across RediSearch versions."""
+    message = str(error).lower()
+    return "no such index" in message or "unknown index name" in message
+
+
+class IndexState:
+    """Cached answer to "does the vector index hold any document?".
+
+    Reads ``num_docs`` from ``FT.INFO``, which is O(1) on the Redis side, at most once
+    every ``ttl`` seconds. A missing index counts as empty, while connection errors and
+    timeouts are raised. An empty answer is not cached, so documents become searchable as
+    soon as the first ingest finishes. A search that finds the index gone, dropped by a
+    delete of all files, calls invalidate so the next request sees it empty.
+    """
+
+    def __init__(self, client, index_name: str, ttl: float = 5.0):
+        self.client = client
+        self.index_name = index_name
+        self.ttl = ttl
+        self._num_docs = 0
+        self._expires = 0.0
+
+    def refresh(self) -> int:
+        try:
+            self._num_docs = int(self.client.ft(self.index_name).info()["num_docs"])
+        except ResponseError:
+            # unknown index, nothing was ingested yet
+            self._num_docs = 0
+        self._expires = time.monotonic() + self.ttl
+        return self._num_docs
+
+    def num_docs(self) -> int:
+        if not self._num_docs or time.monotonic() >= self._expires:
+            return self.refresh()
+        return self._num_docs
+
+    def is_empty(self) -> bool:
+        return self.num_docs() == 0
+
+    async def ais_empty(self) -> bool:
+        """is_empty without blocking the event loop, FT.INFO runs in a thread when the answer is stale."""
+        if self._num_docs and time.monotonic() < self._expires:
+            return False
+        return await asyncio.to_thread(self.refresh) == 0
+
+    def invalidate(self):
+        self._num_docs = 0
+        self._expires = 0.0
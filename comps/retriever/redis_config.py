@@ -3,6 +3,8 @@
 
 import os
 
+import yaml
+
 
 def get_boolean_env_var(var_name, default_value=False):
     """Retrieve the boolean value of an environment variable.
@@ -69,10 +71,26 @@ REDIS_URL = format_redis_conn_from_env()
 
 # Vector Index Configuration
 INDEX_NAME = os.getenv("INDEX_NAME", "rag-redis")
+KEY_INDEX_NAME = os.getenv("KEY_INDEX_NAME", "file-keys")
+# Hash of chunk key -> file name, maintained by dataprep
+CHUNK_FILE_INDEX = os.getenv("CHUNK_FILE_INDEX", "chunk-file")
+CHUNK_FILE_CACHE_SIZE = int(os.getenv("CHUNK_FILE_CACHE_SIZE", 65536))
+# Backfill the chunk file index with the chunks ingested before it existed, once, when the retriever starts
+CHUNK_FILE_BACKFILL = get_boolean_env_var("CHUNK_FILE_BACKFILL", True)
+CHUNK_FILE_BACKFILLED_KEY = os.getenv("CHUNK_FILE_BACKFILLED_KEY", CHUNK_FILE_INDEX + ":backfilled")
+# Window in seconds during which concurrent KNN searches are gathered into one pipelined batch
+RETRIEVER_BATCH_TIMEOUT = float(os.getenv("RETRIEVER_BATCH_TIMEOUT", 0.002))
+RETRIEVER_BATCH_MAX_SIZE = int(os.getenv("RETRIEVER_BATCH_MAX_SIZE", 64))
+# p99 latency target in seconds, the batching window shrinks to keep queueing plus search within it
+RETRIEVER_BATCH_TARGET_LATENCY = float(os.getenv("RETRIEVER_BATCH_TARGET_LATENCY", 0.05))
+# Seconds between FT.INFO refreshes of the index document count
+INDEX_STATE_TTL = float(os.getenv("INDEX_STATE_TTL", 5))
 
 
 current_file_path = os.path.abspath(__file__)
 parent_dir = os.path.dirname(current_file_path)
-REDIS_SCHEMA = os.getenv("REDIS_SCHEMA", "redis_schema_multi.yml")
+REDIS_SCHEMA = os.getenv("REDIS_SCHEMA", "redis_schema.yml")
 schema_path = os.path.join(parent_dir, REDIS_SCHEMA)
 INDEX_SCHEMA = schema_path
+with open(INDEX_SCHEMA, "r") as schema_file:
+    INDEX_METADATA_FIELDS = [field["name"] for fields in yaml.safe_load(schema_file).values() for field in fields]
@@ -1,14 +1,39 @@
 # Copyright (C) 2024 Intel Corporation
 # SPDX-License-Identifier: Apache-2.0
 
+import asyncio
 import os
+import threading
 import time
-import redis
+from collections import OrderedDict
 from typing import Union
+
+import numpy as np
+import redis
+from fastapi import HTTPException
 from langchain_community.embeddings import HuggingFaceBgeEmbeddings
 from langchain_community.vectorstores import Redis
+from langchain_core.documents import Document
 from langchain_huggingface import HuggingFaceEndpointEmbeddings
-from redis_config import EMBED_MODEL, INDEX_NAME, INDEX_SCHEMA, REDIS_URL
+from backfill_chunk_file_index import backfill_chunk_file_index
+from index_state import IndexState, is_missing_index
+from redis.commands.search.query import Query
+from redis.commands.search.result import Result
+from redis.exceptions import ResponseError
+from redis_config import (
+    CHUNK_FILE_BACKFILL,
+    CHUNK_FILE_CACHE_SIZE,
+    CHUNK_FILE_INDEX,
+    EMBED_MODEL,
+    INDEX_METADATA_FIELDS,
+    INDEX_NAME,
+    INDEX_SCHEMA,
+    INDEX_STATE_TTL,
+    REDIS_URL,
+    RETRIEVER_BATCH_MAX_SIZE,
+    RETRIEVER_BATCH_TARGET_LATENCY,
+    RETRIEVER_BATCH_TIMEOUT,
+)
 
 from comps import (
     CustomLogger,
@@ -26,6 +51,7 @@ from comps import (
 from comps.proto.api_protocol import (
     ChatCompletionRequest,
     EmbeddingResponse,
+    RetrievalBatchResponseData,
     RetrievalRequest,
     RetrievalResponse,
     RetrievalResponseData,
@@ -34,18 +60,183 @@ from comps.proto.api_protocol import (
 REDIS_URL = os.getenv("REDIS_URL")
 redis_pool = redis.ConnectionPool.from_url(REDIS_URL)
 
-def get_file_name(chunk_id):
-    r = redis.Redis(connection_pool=redis_pool)
-    client = r.ft('file-keys')
-    
-    results = client.search("*")
-    
-    for doc in results.docs:
-        key_ids = doc.key_ids.split("#")
-        if chunk_id in key_ids:
-            return doc.file_name
-    
-    return None
+chunk_file_cache = OrderedDict()
+# the cache is used from the worker threads of the requests and cleared by the backfill
+chunk_file_lock = threading.Lock()
+
+
+def get_file_names(chunk_ids):
+    file_names = {}
+    misses = []
+    with chunk_file_lock:
+        for chunk_id in chunk_ids:
+            if chunk_id in chunk_file_cache:
+                chunk_file_cache.move_to_end(chunk_id)
+                file_names[chunk_id] = chunk_file_cache[chunk_id]
+            elif chunk_id not in misses:
+                misses.append(chunk_id)
+
+    if misses:
+        r = redis.Redis(connection_pool=redis_pool)
+        values = r.hmget(CHUNK_FILE_INDEX, misses)
+        # chunks missing from the index, deleted ones or ingested before it and not backfilled yet,
+        # are cached without a file name too
+        resolved = {chunk_id: value.decode("utf-8") if value else None for chunk_id, value in zip(misses, values)}
+        with chunk_file_lock:
+            chunk_file_cache.update(resolved)
+            while len(chunk_file_cache) > CHUNK_FILE_CACHE_SIZE:
+                chunk_file_cache.popitem(last=False)
+        file_names.update(resolved)
+
+    return [file_names.get(chunk_id) for chunk_id in chunk_ids]
+
+
+async def with_file_names(search_res):
+    """Chunk metadata, resolving file_name only for chunks ingested without it."""
+    metadata_list = [dict(r.metadata) for r in search_res]
+    legacy = [metadata for metadata in metadata_list if not metadata.get("file_name")]
+    if legacy:
+        file_names = await asyncio.to_thread(get_file_names, [metadata["id"] for metadata in legacy])
+        for metadata, file_name in zip(legacy, file_names):
+            metadata["file_name"] = file_name
+    return metadata_list
+
+
+def knn_query(embedding, k: int, distance_threshold=None):
+    """The FT.SEARCH query langchain's Redis vectorstore issues for similarity search."""
+    if distance_threshold is None:
+        base_query = f"(*)=>[KNN {k} @content_vector $vector AS vector_distance]"
+        params = {"vector": np.asarray(embedding, dtype=np.float32).tobytes()}
+    else:
+        base_query = (
+            "@content_vector:[VECTOR_RANGE $distance_threshold $vector]=>{$YIELD_DISTANCE_AS: vector_distance}"
+        )
+        params = {
+            "vector": np.asarray(embedding, dtype=np.float32).tobytes(),
+            "distance_threshold": distance_threshold,
+        }
+    query = (
+        Query(base_query)
+        .return_fields("content", "vector_distance", *INDEX_METADATA_FIELDS)
+        .sort_by("vector_distance")
+        .paging(0, k)
+        .dialect(2)
+    )
+    return query, params
+
+
+def batch_similarity_search(queries):
+    """Run the (embedding, k, distance_threshold) KNN searches in a single pipelined round trip to Redis."""
+    pipe = vector_db.client.ft(INDEX_NAME).pipeline(transaction=False)
+    for embedding, k, distance_threshold in queries:
+        pipe.search(*knn_query(embedding, k, distance_threshold))
+    results = []
+    for res in pipe.execute():
+        docs = []
+        for doc in Result(res, True).docs:
+            metadata = {"id": doc.id}
+            metadata.update({key: getattr(doc, key) for key in INDEX_METADATA_FIELDS if hasattr(doc, key)})
+            docs.append(Document(page_content=doc.content, metadata=metadata))
+        results.append(docs)
+    return results
+
+
+async def retrieve_batch(input: RetrievalRequest, start: float) -> RetrievalResponse:
+    embeddings = sorted(input.embedding.data, key=lambda emb: emb.index)
+    if input.search_type == "similarity":
+        distance_threshold = None
+    elif input.search_type == "similarity_distance_threshold":
+        if input.distance_threshold is None:
+            raise HTTPException(
+                status_code=400, detail="distance_threshold must be provided for similarity_distance_threshold retriever"
+            )
+        distance_threshold = input.distance_threshold
+    else:
+        # mmr and similarity_score_threshold search by the request text, which a batch has only one of
+        raise HTTPException(
+            status_code=400,
+            detail=f"search_type {input.search_type} is not supported for a batch of embeddings, "
+            "use similarity or similarity_distance_threshold",
+        )
+
+    results = [[] for _ in embeddings]
+    if not await index_state.ais_empty():
+        try:
+            results = await asyncio.to_thread(
+                batch_similarity_search, [(emb.embedding, input.k, distance_threshold) for emb in embeddings]
+            )
+        except ResponseError as e:
+            if not is_missing_index(e):
+                raise
+            index_state.invalidate()
+
+    # resolve the file names of the whole batch at once
+    metadata_list = iter(await with_file_names([r for search_res in results for r in search_res]))
+    data = []
+    retrieved_docs = []
+    for emb, search_res in zip(embeddings, results):
+        docs = [RetrievalResponseData(text=r.page_content, metadata=next(metadata_list)) for r in search_res]
+        data.append(RetrievalBatchResponseData(index=emb.index, retrieved_docs=docs))
+        retrieved_docs.extend(docs)
+
+    statistics_dict["opea_service@retriever_redis"].append_latency(time.time() - start, None)
+    if logflag:
+        logger.info(f"[ retrieve batch ] {len(embeddings)} queries, {len(retrieved_docs)} docs")
+    return RetrievalResponse(retrieved_docs=retrieved_docs, data=data)
+
+
+async def search_index(input: Union[EmbedDoc, EmbedMultimodalDoc, RetrievalRequest, ChatCompletionRequest]):
+    """Documents matching the query of a single-query request, with its search type."""
+    if isinstance(input, EmbedDoc) or isinstance(input, EmbedMultimodalDoc):
+        embedding_data_input = input.embedding
+    else:
+        # for RetrievalRequest, ChatCompletionRequest
+        if isinstance(input.embedding, EmbeddingResponse):
+            # a single EmbeddingResponseData, batches are handled by retrieve_batch
+            embedding_data_input = input.embedding.data[0].embedding
+        else:
+            embedding_data_input = input.embedding
+
+    if input.search_type == "similarity":
+        return await batched_similarity_search(embedding_data_input, input.k)
+    elif input.search_type == "similarity_distance_threshold":
+        if input.distance_threshold is None:
+            raise ValueError("distance_threshold must be provided for " + "similarity_distance_threshold retriever")
+        return await batched_similarity_search(embedding_data_input, input.k, input.distance_threshold)
+    elif input.search_type == "similarity_score_threshold":
+        docs_and_similarities = await vector_db.asimilarity_search_with_relevance_scores(
+            query=input.text, k=input.k, score_threshold=input.score_threshold
+        )
+        return [doc for doc, _ in docs_and_similarities]
+    elif input.search_type == "mmr":
+        return await vector_db.amax_marginal_relevance_search(
+            query=input.text, k=input.k, fetch_k=input.fetch_k, lambda_mult=input.lambda_mult
+        )
+    else:
+        raise ValueError(f"{input.search_type} not valid")
+
+
+def run_backfill():
+    try:
+        backfill_chunk_file_index(redis.Redis(connection_pool=redis_pool))
+    except Exception as e:
+        logger.info(f"[ backfill ] fail to backfill {CHUNK_FILE_INDEX}: {e}")
+        return
+    # chunks cached without a file name while the backfill ran may have one now
+    with chunk_file_lock:
+        chunk_file_cache.clear()
+
+
+async def dynamic_batching_infer(service_type, batch):
+    return await asyncio.to_thread(batch_similarity_search, [req["request"] for req in batch])
+
+
+async def batched_similarity_search(embedding, k: int, distance_threshold=None):
+    """Queue one KNN search for the dynamic batching of the microservice."""
+    return await opea_microservices["opea_service@retriever_redis"].dynamic_batching_request(
+        ServiceType.RETRIEVER, (embedding, k, distance_threshold)
+    )
+
 
 logger = CustomLogger("retriever_redis")
 logflag = os.getenv("LOGFLAG", False)
@@ -60,6 +251,10 @@ bridge_tower_embedding = os.getenv("BRIDGE_TOWER_EMBEDDING")
     endpoint="/v1/retrieval",
     host="0.0.0.0",
     port=7000,
+    dynamic_batching=True,
+    dynamic_batching_timeout=RETRIEVER_BATCH_TIMEOUT,
+    dynamic_batching_max_batch_size=RETRIEVER_BATCH_MAX_SIZE,
+    dynamic_batching_target_latency=RETRIEVER_BATCH_TARGET_LATENCY,
 )
 @register_statistics(names=["opea_service@retriever_redis"])
 async def retrieve(
@@ -68,62 +263,41 @@ async def retrieve(
     if logflag:
         logger.info(input)
     start = time.time()
+    if (
+        isinstance(input, RetrievalRequest)
+        and isinstance(input.embedding, EmbeddingResponse)
+        and len(input.embedding.data) > 1
+    ):
+        return await retrieve_batch(input, start)
+
     # check if the Redis index has data
-    if vector_db.client.keys() == []:
-        search_res = []
-    else:
-        if isinstance(input, EmbedDoc) or isinstance(input, EmbedMultimodalDoc):
-            embedding_data_input = input.embedding
-        else:
-            # for RetrievalRequest, ChatCompletionRequest
-            if isinstance(input.embedding, EmbeddingResponse):
-                embeddings = input.embedding.data
-                embedding_data_input = []
-                for emb in embeddings:
-                    # each emb is EmbeddingResponseData
-                    embedding_data_input.append(emb.embedding)
-            else:
-                embedding_data_input = input.embedding
-
-        # if the Redis index has data, perform the search
-        if input.search_type == "similarity":
-            search_res = await vector_db.asimilarity_search_by_vector(embedding=embedding_data_input, k=input.k)
-        elif input.search_type == "similarity_distance_threshold":
-            if input.distance_threshold is None:
-                raise ValueError("distance_threshold must be provided for " + "similarity_distance_threshold retriever")
-            search_res = await vector_db.asimilarity_search_by_vector(
-                embedding=input.embedding, k=input.k, distance_threshold=input.distance_threshold
-            )
-        elif input.search_type == "similarity_score_threshold":
-            docs_and_similarities = await vector_db.asimilarity_search_with_relevance_scores(
-                query=input.text, k=input.k, score_threshold=input.score_threshold
-            )
-            search_res = [doc for doc, _ in docs_and_similarities]
-        elif input.search_type == "mmr":
-            search_res = await vector_db.amax_marginal_relevance_search(
-                query=input.text, k=input.k, fetch_k=input.fetch_k, lambda_mult=input.lambda_mult
-            )
-        else:
-            raise ValueError(f"{input.search_type} not valid")
+    search_res = []
+    if not await index_state.ais_empty():
+        try:
+            search_res = await search_index(input)
+        except ResponseError as e:
+            if not is_missing_index(e):
+                raise
+            # dropped since it was last seen, by a delete of all files
+            index_state.invalidate()
 
     # return different response format
     retrieved_docs = []
     if isinstance(input, EmbedDoc) or isinstance(input, EmbedMultimodalDoc):
-        metadata_list = []
+        metadata_list = await with_file_names(search_res)
         for r in search_res:
-            file_name = get_file_name(r.metadata['id'])
-            metadata_list.append({**r.metadata, 'file_name': file_name})
             retrieved_docs.append(TextDoc(text=r.page_content))
         result = SearchedMultimodalDoc(retrieved_docs=retrieved_docs, initial_query=input.text, metadata=metadata_list)
     else:
-        for r in search_res:
-            file_name = get_file_name(r.metadata['id'])
-            retrieved_docs.append(RetrievalResponseData(
-                text=r.page_content,
-                metadata={**r.metadata, 'file_name': file_name}
-            ))
+        for r, metadata in zip(search_res, await with_file_names(search_res)):
+            retrieved_docs.append(RetrievalResponseData(text=r.page_content, metadata=metadata))
         if isinstance(input, RetrievalRequest):
             result = RetrievalResponse(retrieved_docs=retrieved_docs)
+            if isinstance(input.embedding, EmbeddingResponse):
+                # the same shape as a batch of one query
+                result.data = [
+                    RetrievalBatchResponseData(index=input.embedding.data[0].index, retrieved_docs=retrieved_docs)
+                ]
         elif isinstance(input, ChatCompletionRequest):
             input.retrieved_docs = retrieved_docs
             input.documents = [doc.text for doc in retrieved_docs]
@@ -140,7 +314,7 @@ if __name__ == "__main__":
     if tei_embedding_endpoint:
         # create embeddings using TEI endpoint service
         embeddings = HuggingFaceEndpointEmbeddings(model=tei_embedding_endpoint)
-        vector_db = Redis(embedding=embeddings, index_name=INDEX_NAME, redis_url=REDIS_URL)
+        vector_db = Redis(embedding=embeddings, index_name=INDEX_NAME, index_schema=INDEX_SCHEMA, redis_url=REDIS_URL)
     # TODO: Add more support
     # elif bridge_tower_embedding:
     #     # create embeddings using BridgeTower service
@@ -149,6 +323,11 @@ if __name__ == "__main__":
     else:
         # create embeddings using local embedding model
         embeddings = HuggingFaceBgeEmbeddings(model_name=EMBED_MODEL)
-        vector_db = Redis(embedding=embeddings, index_name=INDEX_NAME, redis_url=REDIS_URL)
+        vector_db = Redis(embedding=embeddings, index_name=INDEX_NAME, index_schema=INDEX_SCHEMA, redis_url=REDIS_URL)
+
+    index_state = IndexState(vector_db.client, INDEX_NAME, ttl=INDEX_STATE_TTL)
+    opea_microservices["opea_service@retriever_redis"].dynamic_batching_infer = dynamic_batching_infer
+    if CHUNK_FILE_BACKFILL:
+        threading.Thread(target=run_backfill, daemon=True).start()
 
     opea_microservices["opea_service@retriever_redis"].start()
\ No newline at end of file